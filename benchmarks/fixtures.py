@@ -0,0 +1,160 @@
+###############################################################################################
+# Description:	Synthetic Skylight JSON:API payloads for benchmarking.
+# 		Generates calendar_events responses of any size that look like the
+# 		real thing: recurring events with RRULE/UNTIL, all day events,
+# 		events from several sources and time zones, categories and
+# 		calendar accounts in "included".
+#
+# 		The same seed always produces the same payload.
+###############################################################################################
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+# Default range the events are spread over (the same as skylight_scrape's default)
+fixture_start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+fixture_days = 7 * 365
+
+summaries = ['Soccer Practice', 'Dentist', 'Free Lunch at Work', 'Piano Lesson', 'Trash Day',
+             'Book Club', 'Date Night', 'Swim Team', 'Parent Teacher Conference', 'Grocery Run']
+locations = [None, None, '123 Main St, Springfield, IL 62701', 'Community Center', 'Lincoln Elementary']
+sources = ['skylight', 'skylight', 'skylight', 'google', 'ics_link']
+time_zones = ['America/New_York', 'America/Chicago', 'America/Denver', 'America/Los_Angeles']
+rrules = ['RRULE:FREQ=WEEKLY;WKST=SU;INTERVAL=1;BYDAY=TU',
+          'RRULE:FREQ=WEEKLY;WKST=SU;INTERVAL=2;BYDAY=MO',
+          'RRULE:FREQ=MONTHLY;BYMONTHDAY=15',
+          'RRULE:FREQ=YEARLY',
+          'RRULE:FREQ=DAILY;INTERVAL=1']
+colors = ['#E57373', '#64B5F6', '#81C784', '#FFD54F', '#BA68C8', None]
+
+# Formats a datetime the way the API does
+def _timestamp(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+#----------------------------------------------------------------
+# Builds the included categories and calendar accounts
+#----------------------------------------------------------------
+def generate_included(categories=6, calendar_accounts=2):
+    included = []
+    for i in range(categories):
+        included.append({
+            'id': str(1000 + i),
+            'type': 'category',
+            'attributes': {
+                'label': f'Person {i + 1}',
+                'color': colors[i % len(colors)],
+                'selected_for_chore_chart': i % 2 == 0,
+                'profile_pic_url': None,
+            },
+        })
+    for i in range(calendar_accounts):
+        included.append({
+            'id': str(2000 + i),
+            'type': 'calendar_account',
+            'attributes': {
+                'email': f'family{i}@example.com',
+                'provider': 'google' if i % 2 == 0 else 'icloud',
+                'active_calendars': [
+                    {'id': f'cal-{i}-{j}', 'name': f'Calendar {j}', 'role': 'owner', 'editable': True}
+                    for j in range(3)
+                ],
+            },
+        })
+    return included
+
+#----------------------------------------------------------------
+# Yields count synthetic calendar events
+# The events are spread evenly over the range and come out in
+# chronological order, the same as the API returns them.
+# recurring and all_day are the fraction of events of each kind
+#----------------------------------------------------------------
+def iter_events(count, seed=0, frame_id='1600234', recurring=0.3, all_day=0.1, categories=6, calendar_accounts=2,
+                start=fixture_start, days=fixture_days):
+    rng = random.Random(seed)
+    slots = days * 96     # Quarter hours in the range
+    for i in range(count):
+        starts_at = start + timedelta(minutes=15 * (i * slots // max(count, 1)))
+        is_all_day = rng.random() < all_day
+        is_recurring = rng.random() < recurring
+
+        if is_all_day:
+            starts_at = starts_at.replace(hour=0, minute=0)
+            ends_at = starts_at
+        else:
+            ends_at = starts_at + timedelta(minutes=15 * rng.randint(1, 12))
+
+        # Recurring series share their hash, and instances after a split get "-after-<epoch>"
+        series = rng.randrange(max(1, count // 20))
+        if is_recurring:
+            uid = f'from-app-{series:032x}-after-{int(starts_at.timestamp())}'
+            rrule = rng.choice(rrules)
+            if rng.random() < 0.5:
+                until = starts_at + timedelta(days=rng.randint(30, 720))
+                rrule += f';UNTIL={until:%Y%m%d}T000000Z'
+            rrule = [rrule]
+        else:
+            uid = f'from-app-{rng.getrandbits(128):032x}'
+            rrule = None
+
+        relationships = {}
+        if categories and rng.random() < 0.8:
+            relationships['category'] = {'data': {'id': str(1000 + rng.randrange(categories)), 'type': 'category'}}
+        if calendar_accounts and rng.random() < 0.3:
+            relationships['calendar_account'] = {'data': {'id': str(2000 + rng.randrange(calendar_accounts)), 'type': 'calendar_account'}}
+
+        yield {
+            'id': f'{frame_id}{i:08d}',
+            'type': 'calendar_event',
+            'attributes': {
+                'uid': uid,
+                'summary': rng.choice(summaries),
+                'description': None if rng.random() < 0.8 else 'Bring snacks',
+                'location': rng.choice(locations),
+                'starts_at': _timestamp(starts_at),
+                'ends_at': _timestamp(ends_at),
+                'all_day': is_all_day,
+                'invited_emails': [],
+                'status': 'approved',
+                'rrule': rrule,
+                'owner_email': 'parent@example.com',
+                'calendar_id': None,
+                'master_event_id': None,
+                'timezone': rng.choice(time_zones),
+                'recurring': is_recurring,
+                'recurring_config': None,
+                'lat': None,
+                'lng': None,
+                'source': rng.choice(sources),
+                'kind': 'standard',
+                'editable': True,
+            },
+            'relationships': relationships,
+        }
+
+#----------------------------------------------------------------
+# Returns a whole calendar_events response as a dictionary
+#----------------------------------------------------------------
+def generate_payload(count, seed=0, **kwargs):
+    included_kwargs = {key: kwargs[key] for key in ('categories', 'calendar_accounts') if key in kwargs}
+    return {
+        'data': list(iter_events(count, seed, **kwargs)),
+        'included': generate_included(**included_kwargs),
+        'meta': {'total_event_count': count},
+    }
+
+#----------------------------------------------------------------
+# Writes a calendar_events response to a binary stream one event
+# at a time, so even a million events never sit in memory at once
+# Returns the number of bytes written
+#----------------------------------------------------------------
+def write_payload(f, count, seed=0, **kwargs):
+    included_kwargs = {key: kwargs[key] for key in ('categories', 'calendar_accounts') if key in kwargs}
+    written = f.write(b'{"data":[')
+    for i, event in enumerate(iter_events(count, seed, **kwargs)):
+        if i:
+            written += f.write(b',')
+        written += f.write(json.dumps(event, separators=(',', ':')).encode())
+    written += f.write(b'],"included":')
+    written += f.write(json.dumps(generate_included(**included_kwargs), separators=(',', ':')).encode())
+    written += f.write(f',"meta":{{"total_event_count":{count}}}}}'.encode())
+    return written
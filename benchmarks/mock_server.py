@@ -0,0 +1,206 @@
+###############################################################################################
+# Description:	Local stand-in for the Skylight API, used by the benchmarks.
+# 		Serves /sessions, /frames and /frames/<id>/calendar_events with the
+# 		synthetic events from fixtures.py and a configurable latency.
+#
+# 		Every frame's events are written to a temporary file once, together
+# 		with the offset of each event, so a request for any after/before
+# 		range is answered by copying one slice of that file. This keeps the
+# 		server small even with a million events per frame.
+#
+# Usage:	python benchmarks/mock_server.py --events 100000 --frames 2 --latency 0.05
+###############################################################################################
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures
+
+# Size of the slices copied from the event files
+copy_chunk_size = 1 << 16
+
+# Converts an API timestamp into epoch seconds
+def _epoch(value):
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+
+#----------------------------------------------------------------
+# Holds one frame's events on disk along with their offsets
+#----------------------------------------------------------------
+class FrameEvents:
+    def __init__(self, frame_id, count, seed):
+        self.frame_id = frame_id
+        self.count = count
+        self.file = tempfile.TemporaryFile()
+
+        # keys[i] is the (never decreasing) start of event i, offsets[i] where it begins in the file
+        self.keys = array('q')
+        self.offsets = array('q')
+        latest = 0
+        for event in fixtures.iter_events(count, seed, frame_id=frame_id):
+            latest = max(latest, _epoch(event['attributes']['starts_at']))
+            self.keys.append(latest)
+            self.offsets.append(self.file.tell())
+            self.file.write(json.dumps(event, separators=(',', ':')).encode())
+            self.file.write(b',')
+        self.offsets.append(self.file.tell())
+        self.lock = threading.Lock()
+
+    # Returns the index range of the events starting within [after, before)
+    def select(self, after, before):
+        return bisect_left(self.keys, _epoch(after)), bisect_left(self.keys, _epoch(before))
+
+    # Yields the bytes of events lo..hi joined by commas
+    def iter_bytes(self, lo, hi):
+        if lo >= hi:
+            return
+        position = self.offsets[lo]
+        end = self.offsets[hi] - 1      # Drop the trailing comma
+        while position < end:
+            with self.lock:
+                self.file.seek(position)
+                chunk = self.file.read(min(copy_chunk_size, end - position))
+            position += len(chunk)
+            yield chunk
+
+#----------------------------------------------------------------
+# Request handler, the server it belongs to holds the frames
+#----------------------------------------------------------------
+class MockSkylightHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True      # Otherwise small responses wait on delayed ACKs
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        if urlparse(self.path).path.endswith('/sessions'):
+            self.server.counters['sessions'] += 1
+            self._send_json({'data': {'id': '1', 'type': 'user', 'attributes': {'token': 'benchmark'}}})
+        else:
+            self._send_json({'errors': [{'title': 'Not Found'}]}, 404)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        path = urlparse(self.path).path.rstrip('/')
+        query = parse_qs(urlparse(self.path).query)
+        parts = path.split('/')
+
+        if path.endswith('/frames'):
+            self.server.counters['frames'] += 1
+            self._send_json({
+                'data': [{
+                    'id': frame_id,
+                    'type': 'frame',
+                    'attributes': {'name': f'Frame {frame_id}'},
+                    'relationships': {'user': {'data': {'id': '1', 'type': 'user'}}, 'event_notification_setting': {'data': None}},
+                    'meta': {},
+                } for frame_id in self.server.frames],
+                'meta': {},
+            })
+            return
+
+        if path.endswith('/calendar_events') and parts[-2] in self.server.frames:
+            self.server.counters['calendar_events'] += 1
+            frame = self.server.frames[parts[-2]]
+            lo, hi = frame.select(query.get('after', ['1970-01-01T00:00:00Z'])[0], query.get('before', ['2100-01-01T00:00:00Z'])[0])
+
+            head = b'{"data":['
+            tail = (f'],"included":{json.dumps(fixtures.generate_included(), separators=(",", ":"))},'
+                    f'"meta":{{"total_event_count":{hi - lo}}}}}').encode()
+            length = len(head) + len(tail) + (frame.offsets[hi] - frame.offsets[lo] - 1 if hi > lo else 0)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(length))
+            self.end_headers()
+            self.wfile.write(head)
+            for chunk in frame.iter_bytes(lo, hi):
+                self.wfile.write(chunk)
+            self.wfile.write(tail)
+            return
+
+        self._send_json({'errors': [{'title': 'Not Found'}]}, 404)
+
+#----------------------------------------------------------------
+# The mock API itself
+# Runs in a background thread; use it as a context manager or call
+# start() and stop(). url is the base URL to hand to SkylightClient.
+#----------------------------------------------------------------
+class MockSkylight:
+    def __init__(self, events=1000, frames=1, latency=0.0, seed=0, host='127.0.0.1', port=0):
+        self.server = ThreadingHTTPServer((host, port), MockSkylightHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.counters = {'sessions': 0, 'frames': 0, 'calendar_events': 0}
+        self.server.frames = {}
+        for i in range(frames):
+            frame_id = str(1600234 + i)
+            self.server.frames[frame_id] = FrameEvents(frame_id, events, seed + i)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/api'
+
+    @property
+    def counters(self):
+        return self.server.counters
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for frame in self.server.frames.values():
+            frame.file.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Skylight API')
+    parser.add_argument('--events', type=int, default=1000, help='Events per frame')
+    parser.add_argument('--frames', type=int, default=1, help='Number of frames')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    mock = MockSkylight(args.events, args.frames, args.latency, args.seed, port=args.port)
+    print(f'Serving {args.frames} frame(s) of {args.events} events at {mock.url}')
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
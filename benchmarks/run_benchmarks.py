@@ -0,0 +1,219 @@
+###############################################################################################
+# Description:	Benchmarks every stage of an extraction against the local mock API.
+# 		For each size the mock server is started with that many events and
+# 		each stage is timed, then run a second time under tracemalloc to
+# 		find its peak memory (tracing slows everything down, so the two are
+# 		kept apart).
+#
+# 		Stages:
+# 		  login      POST /sessions
+# 		  frames     GET /frames
+# 		  fetch      GET calendar_events and json.loads (fetch_calendar_events)
+# 		  stream     GET calendar_events parsed as it arrives (stream_calendar_events)
+# 		  extract    EventTable.from_json, the EventInfo loop in main()
+# 		  parse      parse_event for every event
+# 		  ics        write_icalendar_stream to a discarding writer
+# 		  index      IntervalIndex over the EventTable
+#
+# Usage:	python benchmarks/run_benchmarks.py --sizes 1000,10000 --latency 0.05 --json results.json
+###############################################################################################
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_server import MockSkylight
+import skylight_scrape
+from skylight_scrape import (login, fetch_calendar_events, stream_calendar_events, index_included,
+                             EventTable, parse_event, write_icalendar_stream, default_after, default_before)
+from skylight_client import SkylightClient
+from skylight_index import IntervalIndex
+
+default_sizes = [1000, 10000, 100000, 1000000]
+all_stages = ['login', 'frames', 'fetch', 'stream', 'extract', 'parse', 'ics', 'index']
+
+#----------------------------------------------------------------
+# Binary stream that only counts what is written to it
+#----------------------------------------------------------------
+class CountingWriter:
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+#----------------------------------------------------------------
+# Holds what one size needs while its stages run
+# Stages read what earlier stages left here (the login, the
+# fetched data, the EventTable) and return the number of events
+# or requests they handled.
+#----------------------------------------------------------------
+class BenchmarkContext:
+    def __init__(self, mock):
+        self.mock = mock
+        self.frame_id = next(iter(mock.server.frames))
+        self.account = None
+        self.data = None
+        self.resources = None
+        self.table = None
+        self.now = datetime.now()
+
+    def get_account(self):
+        if self.account is None:
+            self.account = login(client=SkylightClient(self.mock.url), email='benchmark@example.com',
+                                 password='benchmark', token_cache=None)
+        return self.account
+
+    def get_data(self):
+        if self.data is None:
+            self.data = fetch_calendar_events(self.get_account(), self.frame_id, default_after, default_before)
+            self.resources = index_included(self.data['included'])
+        return self.data
+
+    def get_table(self):
+        if self.table is None:
+            self.table = EventTable.from_json(self.get_data()['data'], self.resources)
+        return self.table
+
+
+def stage_login(context):
+    context.account = None
+    context.get_account()
+    return 1
+
+def stage_frames(context):
+    client = context.get_account().client
+    client._frames = None
+    client.get_frames()
+    return 1
+
+def stage_fetch(context):
+    context.data = None
+    return len(context.get_data()['data'])
+
+def stage_stream(context):
+    count = 0
+    for _ in stream_calendar_events(context.get_account(), context.frame_id, default_after, default_before):
+        count += 1
+    return count
+
+def stage_extract(context):
+    context.table = None
+    return len(context.get_table())
+
+def stage_parse(context):
+    events = context.get_data()['data']
+    for event_data in events:
+        parse_event(event_data, context.now, context.resources)
+    return len(events)
+
+def stage_ics(context):
+    return write_icalendar_stream(context.get_data()['data'], CountingWriter(), now=context.now, resources=context.resources)
+
+def stage_index(context):
+    return len(IntervalIndex(context.get_table()))
+
+stage_functions = {
+    'login': stage_login,
+    'frames': stage_frames,
+    'fetch': stage_fetch,
+    'stream': stage_stream,
+    'extract': stage_extract,
+    'parse': stage_parse,
+    'ics': stage_ics,
+    'index': stage_index,
+}
+
+#----------------------------------------------------------------
+# Runs a stage and returns (items, seconds)
+#----------------------------------------------------------------
+def time_stage(function, context):
+    gc.collect()
+    started = time.perf_counter()
+    items = function(context)
+    return items, time.perf_counter() - started
+
+#----------------------------------------------------------------
+# Runs a stage under tracemalloc and returns the peak number of
+# bytes it allocated on top of what was already in memory
+#----------------------------------------------------------------
+def measure_stage(function, context):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(context)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+#----------------------------------------------------------------
+# Runs the stages for a single size and returns a result per stage
+#----------------------------------------------------------------
+def run_size(size, stages, latency=0.0, memory=True):
+    results = []
+    with MockSkylight(events=size, latency=latency) as mock:
+        context = BenchmarkContext(mock)
+        for stage in stages:
+            items, seconds = time_stage(stage_functions[stage], context)
+            result = {
+                'size': size,
+                'stage': stage,
+                'items': items,
+                'seconds': seconds,
+                'per_second': items / seconds if seconds else None,
+                'peak_bytes': None,
+            }
+            if memory:
+                result['peak_bytes'] = measure_stage(stage_functions[stage], context)
+            results.append(result)
+            print(format_result(result), flush=True)
+    return results
+
+def format_result(result):
+    peak = '' if result['peak_bytes'] is None else f'{result["peak_bytes"] / (1 << 20):10.1f} MB'
+    return (f'{result["size"]:>9} {result["stage"]:<8} {result["seconds"] * 1000:12.1f} ms '
+            f'{result["per_second"] or 0:14.0f} /s {peak}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the extraction stages against a local mock API')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in default_sizes), help='Comma separated event counts')
+    parser.add_argument('--stages', default=','.join(all_stages), help=f'Comma separated stages out of {", ".join(all_stages)}')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the mock API adds to every request')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc pass')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    stages = [stage.strip() for stage in args.stages.split(',')]
+    unknown = [stage for stage in stages if stage not in stage_functions]
+    if unknown:
+        parser.error(f'Unknown stages: {", ".join(unknown)}')
+
+    # Keep the scraper quiet while it is being measured
+    skylight_scrape.debug = False
+
+    print(f'{"events":>9} {"stage":<8} {"time":>15} {"throughput":>17} {"peak memory" if not args.no_memory else ""}')
+    results = []
+    for size in sizes:
+        results.extend(run_size(size, stages, args.latency, not args.no_memory))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+###############################################################################################
+# Description:	asyncio client for the Skylight API, for embedding in async services.
+# 		Logs in, lists frames and fetches calendar events without blocking
+# 		the event loop. iter_events() streams a calendar_events response and
+# 		hands back one EventInfo at a time: the next chunk of the body is
+# 		only read once the consumer asks for more, so a slow consumer slows
+# 		the download down instead of the response piling up in memory.
+#
+# 		Requires aiohttp (pip install aiohttp).
+#
+# Usage:	async with AsyncSkylightClient(email, password) as client:
+# 		    for frame_id in await client.frame_ids():
+# 		        async for event in client.iter_events(frame_id, after, before):
+# 		            ...
+###############################################################################################
+import base64
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from skylight_client import default_base_url, default_timeout, default_retries, default_pool_size, retry_statuses, backoff_delay
+from skylight_stream import JsonApiStreamParser
+from skylight_scrape import build_event_info, index_included, stream_chunk_size, page_cursor_keys, PageFollower
+
+#----------------------------------------------------------------
+# Async iterator over the events of one frame
+# Yields EventInfo objects (or the raw JSON items with raw=True).
+# Once iteration has finished, included and meta are available.
+#----------------------------------------------------------------
+class AsyncEventStream:
+    def __init__(self, client, frame_id, after, before, raw=False):
+        self.client = client
+        self.frame_id = frame_id
+        self.after = after
+        self.before = before
+        self.raw = raw
+        self.included = []
+        self.meta = {}
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        # Pages are followed the same way as fetch_calendar_events does, one at a time
+        follower = PageFollower(self.client, self.frame_id, self.after, self.before)
+        request = follower.first_request()
+        seen_included = set()
+        while request:
+            path, params = request
+            parser = JsonApiStreamParser()
+            keys = []
+            last_start = None
+            async with await self.client.request('GET', path, params=params) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(stream_chunk_size):
+                    for item in parser.feed(chunk):
+                        for event in self._new_events(item, follower, keys):
+                            yield event
+                        last_start = item['attributes'].get('starts_at')
+                    # Reading an already buffered chunk does not suspend, so let other tasks run
+                    await asyncio.sleep(0)
+            for item in parser.close():
+                for event in self._new_events(item, follower, keys):
+                    yield event
+                last_start = item['attributes'].get('starts_at')
+
+            # Keep the included items of every page once, and the meta of the first
+            document = parser.document
+            for item in document.get('included', []):
+                if (item['type'], item['id']) not in seen_included:
+                    seen_included.add((item['type'], item['id']))
+                    self.included.append(item)
+            if not self.meta:
+                self.meta = document.get('meta') or {}
+
+            follower.add(document, keys, last_start)
+            request = follower.next_request()
+
+    # Records the key of an event item, and returns it (as an EventInfo unless raw) unless an earlier page held it
+    def _new_events(self, item, follower, keys):
+        key = follower.key(item)
+        keys.append(key)
+        if key in follower.seen:
+            return ()
+        return (item if self.raw else build_event_info(item),)
+
+    # The included items indexed for joining events to categories and calendar accounts
+    @property
+    def resources(self):
+        return index_included(self.included)
+
+#----------------------------------------------------------------
+# Class holding the aiohttp session and the login of one account
+#----------------------------------------------------------------
+class AsyncSkylightClient:
+    def __init__(self, email, password, base_url=default_base_url, timeout=default_timeout,
+                 retries=default_retries, pool_size=default_pool_size, session=None):
+        if aiohttp is None:
+            raise ImportError('AsyncSkylightClient requires aiohttp (pip install aiohttp)')
+        self.email = email
+        self.password = password
+        self.base_url = base_url.rstrip('/')
+        self.retries = retries
+        self.timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        self.pool_size = pool_size
+
+        # A session passed in stays owned by the caller
+        self.session = session
+        self._owns_session = session is None
+
+        self.user_id = None
+        self.user_token = None
+        self.headers = {}
+        self._frames = None
+        self._login_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size), timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and self._owns_session:
+            await self.session.close()
+        self.session = None
+
+    #----------------------------------------------------------------
+    # Logs in and attaches the Auth Token to every following request
+    # stale is the Authorization header that was rejected; if another
+    # task has already replaced it there is nothing left to do
+    #----------------------------------------------------------------
+    async def login(self, stale=None):
+        async with self._login_lock:
+            if stale is not None and self.headers.get('Authorization') != stale:
+                return
+            response = await self.request('POST', '/sessions', auth_retry=False, json={
+                'email': self.email,
+                'name': '',
+                'phone': '',
+                'password': self.password,
+                'resettingPassword': 'false',
+                'textMeTheApp': 'true',
+                'agreedToMarketing': 'true'
+            })
+            async with response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+            self.user_id = data['data']['id']
+            self.user_token = data['data']['attributes']['token']
+            auth_token = base64.b64encode(f'{self.user_id}:{self.user_token}'.encode()).decode()
+            self.headers['Authorization'] = f'Basic {auth_token}'
+
+    #----------------------------------------------------------------
+    # Sends a request relative to the base URL
+    # Retries like SkylightClient does; a 401 logs in again once.
+    # Returns the aiohttp response, which the caller has to release
+    # (use it with "async with").
+    #----------------------------------------------------------------
+    async def request(self, method, path, auth_retry=True, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = await self._session().request(method, f'{self.base_url}{path}', headers=self.headers, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                attempt += 1
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt - 1))
+                continue
+
+            if response.status == 401 and auth_retry:
+                stale = self.headers.get('Authorization')
+                response.release()
+                await self.login(stale)
+                auth_retry = False
+                continue
+
+            attempt += 1
+            if response.status not in retry_statuses or attempt == self.retries:
+                return response
+            response.release()
+            await asyncio.sleep(backoff_delay(attempt - 1, response))
+
+    # Sends a GET request and returns the decoded JSON
+    async def get_json(self, path, **kwargs):
+        async with await self.request('GET', path, **kwargs) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    # Returns the /frames JSON data, only requested once
+    async def frames(self):
+        if self._frames is None:
+            self._frames = await self.get_json('/frames', params={'show_deleted': 'true'})
+        return self._frames
+
+    async def frame_ids(self):
+        return [frame['id'] for frame in (await self.frames())['data']]
+
+    # Returns a whole calendar_events response as JSON data, with every page merged into one
+    async def calendar_events(self, frame_id, after, before):
+        stream = self.iter_events(frame_id, after, before, raw=True)
+        events = [event async for event in stream]
+        meta = {key: value for key, value in stream.meta.items() if key not in page_cursor_keys}
+        meta.setdefault('total_event_count', len(events))
+        return {'data': events, 'included': stream.included, 'meta': meta}
+
+    # Returns an AsyncEventStream yielding the EventInfo of every event of the frame
+    def iter_events(self, frame_id, after, before, raw=False):
+        return AsyncEventStream(self, frame_id, after, before, raw)
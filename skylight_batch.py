@@ -0,0 +1,246 @@
+###############################################################################################
+# Description:	Batch export of several Skylight accounts without any prompts.
+# 		Reads the accounts and where their calendars go from a JSON config
+# 		file and exports them in parallel, one process per account so the
+# 		parsing and .ics generation of one account never waits on another.
+# 		A single semaphore shared by every process caps the number of
+# 		requests in flight to the API.
+#
+# Config:	{
+# 		    "max_processes": 4,
+# 		    "max_requests": 8,
+# 		    "defaults": {"after": "2024-01-01", "before": "2025-12-31", "window": "month",
+# 		                 "merge": false, "gzip": false},
+# 		    "accounts": [
+# 		        {"email": "parent@example.com", "password": "...", "output": "exports/parent"},
+# 		        {"credentials": "~/.skylight_grandma.json", "frames": ["1600234"], "output": "exports/grandma",
+# 		         "merge": true}
+# 		    ]
+# 		}
+# 		Every account setting can also be given in "defaults". "frames" is
+# 		"all" (the default), a list of frame IDs or a comma separated string
+# 		of them. "token_cache" is off by default as several processes would
+# 		be writing the same file.
+#
+# Usage:	python skylight_batch.py accounts.json --summary summary.json
+###############################################################################################
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import skylight_scrape
+from skylight_scrape import (login, extract_frames, merge_frame_data, write_icalendar_deterministic,
+                             index_included, parse_api_datetime, format_api_datetime, default_after, default_before)
+from skylight_client import SkylightClient
+
+# Accounts exported at the same time, and requests in flight across all of them
+default_max_processes = 4
+default_max_requests = 8
+
+#----------------------------------------------------------------
+# Class to hold the outcome of exporting a single account
+# Only plain values, so it can be sent back from the worker process
+#----------------------------------------------------------------
+class AccountResult:
+    def __init__(self, name, frames=0, frames_failed=0, events=0, bytes_written=0, elapsed=0.0, errors=None, files=None):
+        self.name = name
+        self.frames = frames
+        self.frames_failed = frames_failed
+        self.events = events
+        self.bytes_written = bytes_written
+        self.elapsed = elapsed
+        self.errors = errors or []
+        self.files = files or []
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        status = 'OK' if not self.errors else f'{len(self.errors)} error(s)'
+        return (f'{self.name}: {self.frames - self.frames_failed}/{self.frames} frames, {self.events} events, '
+                f'{self.bytes_written} bytes in {self.elapsed:.2f}s, {status}')
+
+# Returns a name for the account that can be shown in the summary
+def account_name(account):
+    return account.get('name') or account.get('email') or account.get('credentials') or '?'
+
+#----------------------------------------------------------------
+# Returns the frame IDs an account's "frames" setting asks for,
+# or None for every frame
+# Takes "all", a list of IDs or a comma separated string of them
+#----------------------------------------------------------------
+def frame_ids_of(account):
+    frames = account.get('frames', 'all')
+    if frames == 'all':
+        return None
+    if isinstance(frames, str):
+        frames = frames.split(',')
+    elif isinstance(frames, bool):
+        # bool is an int too, but true is not a frame ID
+        raise ValueError(f'"frames" must be "all", a list of frame IDs or a comma separated string, not {frames!r}')
+    elif isinstance(frames, int):
+        frames = [frames]
+    elif not isinstance(frames, list):
+        raise ValueError(f'"frames" must be "all", a list of frame IDs or a comma separated string, not {frames!r}')
+    if any(isinstance(frame_id, bool) or not isinstance(frame_id, (str, int)) for frame_id in frames):
+        raise ValueError(f'"frames" holds something other than a frame ID: {account["frames"]!r}')
+    frame_ids = [str(frame_id).strip() for frame_id in frames]
+    if not all(frame_ids):
+        raise ValueError(f'"frames" holds an empty frame ID: {account["frames"]!r}')
+    return frame_ids
+
+#----------------------------------------------------------------
+# Exports a single account, run in a worker process
+# slots is the shared semaphore capping the requests to the API
+# Returns an AccountResult, errors are recorded rather than raised
+#----------------------------------------------------------------
+def export_account(account, slots=None, base_url=None):
+    start = time.perf_counter()
+    result = AccountResult(account_name(account))
+    try:
+        # The credentials file is read as it is, SKYLIGHT_EMAIL / SKYLIGHT_PASSWORD would apply to every account
+        credentials = {}
+        if account.get('credentials'):
+            with open(os.path.expanduser(account['credentials']), 'r', encoding='utf-8') as f:
+                credentials = json.load(f)
+        email = account.get('email') or credentials.get('email')
+        password = account.get('password') or credentials.get('password')
+        if not email or not password:
+            raise ValueError('No email or password configured')
+
+        client = SkylightClient(base_url or skylight_scrape.url)
+        client.request_slots = slots
+        AccountInfo = login(client=client, email=email, password=password, token_cache=account.get('token_cache'))
+
+        frame_ids = frame_ids_of(account) or AccountInfo.getFrameId()
+
+        after = format_api_datetime(parse_api_datetime(account.get('after', default_after)))
+        before = format_api_datetime(parse_api_datetime(account.get('before', default_before)))
+        results = extract_frames(AccountInfo, frame_ids, after, before, account.get('workers', skylight_scrape.max_frame_workers),
+                                 account.get('window'))
+        result.frames = len(results)
+        for frame_result in results:
+            if frame_result.error:
+                result.frames_failed += 1
+                result.errors.append(f'Frame {frame_result.frame_id}: {frame_result.error}')
+
+        # One file per frame, or all of them merged into one
+        output = os.path.expanduser(account.get('output', '.'))
+        os.makedirs(output, exist_ok=True)
+        extension = '.ics.gz' if account.get('gzip') else '.ics'
+        if account.get('merge'):
+            outputs = [('calendar', merge_frame_data(results))] if result.frames_failed < result.frames else []
+        else:
+            outputs = [(f'calendar_{frame_result.frame_id}', frame_result.data) for frame_result in results if not frame_result.error]
+
+        for name, data in outputs:
+            path = os.path.join(output, f'{name}{extension}')
+            count, changed = write_icalendar_deterministic(data['data'], path, account.get('gzip', False),
+                                                           index_included(data['included']))
+            result.events += count
+            # Files whose events did not change are left as they were
+            if changed:
+                result.bytes_written += os.path.getsize(path)
+                result.files.append(path)
+    except Exception as e:
+        result.errors.append(f'{type(e).__name__}: {e}')
+    result.elapsed = time.perf_counter() - start
+    return result
+
+#----------------------------------------------------------------
+# Reads the config file
+# Returns (settings, accounts) where every account already has the
+# defaults filled in
+#----------------------------------------------------------------
+def load_config(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if not config.get('accounts'):
+        raise ValueError(f'{path} does not list any accounts')
+    defaults = config.get('defaults', {})
+    accounts = [{**defaults, **account} for account in config['accounts']]
+    # Bad frame lists are reported before anything is fetched
+    for account in accounts:
+        try:
+            frame_ids_of(account)
+        except ValueError as e:
+            raise ValueError(f'{path}: {account_name(account)}: {e}') from None
+    return config, accounts
+
+#----------------------------------------------------------------
+# Exports every account with up to max_processes at the same time
+# and at most max_requests requests in flight to each host
+# Returns the AccountResults in the order of accounts
+#----------------------------------------------------------------
+def run_batch(accounts, max_processes=default_max_processes, max_requests=default_max_requests, base_url=None):
+    base_url = base_url or skylight_scrape.url
+    results = {}
+    with multiprocessing.Manager() as manager:
+        # Every account talks to the same host unless the config points some elsewhere
+        slots = {}
+        for account in accounts:
+            host = urlsplit(account.get('url') or base_url).netloc
+            if host not in slots:
+                slots[host] = manager.Semaphore(max_requests)
+
+        with ProcessPoolExecutor(max_workers=max_processes) as executor:
+            futures = {}
+            for i, account in enumerate(accounts):
+                account_url = account.get('url') or base_url
+                futures[executor.submit(export_account, account, slots[urlsplit(account_url).netloc], account_url)] = i
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    # Only happens if the worker process itself died
+                    results[i] = AccountResult(account_name(accounts[i]), errors=[f'{type(e).__name__}: {e}'])
+                print(results[i], flush=True)
+    return [results[i] for i in range(len(accounts))]
+
+# Prints the summary table of a batch
+def print_summary(results, elapsed):
+    print('-' * 20)
+    print(f'{"Account":<32} {"Frames":>7} {"Events":>9} {"Bytes":>12} {"Seconds":>8} Errors')
+    for result in results:
+        print(f'{result.name[:32]:<32} {result.frames - result.frames_failed:>3}/{result.frames:<3} {result.events:>9} '
+              f'{result.bytes_written:>12} {result.elapsed:>8.2f} {len(result.errors)}')
+        for error in result.errors:
+            print(f'    {error}')
+    print(f'{len(results)} accounts, {sum(result.events for result in results)} events, '
+          f'{sum(result.bytes_written for result in results)} bytes in {elapsed:.2f}s, '
+          f'{sum(1 for result in results if result.errors)} with errors')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export several Skylight accounts described in a config file')
+    parser.add_argument('config', help='JSON file listing the accounts and their outputs')
+    parser.add_argument('--processes', type=int, help=f'Accounts exported at the same time (default {default_max_processes})')
+    parser.add_argument('--max-requests', type=int, help=f'Requests in flight to the API across all accounts (default {default_max_requests})')
+    parser.add_argument('--summary', help='Also write the summary to this JSON file')
+    args = parser.parse_args()
+
+    config, accounts = load_config(args.config)
+    max_processes = args.processes or config.get('max_processes', default_max_processes)
+    max_requests = args.max_requests or config.get('max_requests', default_max_requests)
+
+    start = time.perf_counter()
+    results = run_batch(accounts, max_processes, max_requests, config.get('url'))
+    elapsed = time.perf_counter() - start
+    print_summary(results, elapsed)
+
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump({'elapsed': elapsed, 'accounts': [result.to_dict() for result in results]}, f, indent=4)
+
+    # A non-zero exit code lets a scheduler notice failed accounts
+    sys.exit(1 if any(result.errors for result in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+###############################################################################################
+# Description:	On-disk cache underneath SkylightClient.
+# 		Responses are stored per method, URL, query, request body and account
+# 		(the login email), one small .json file of metadata next to the raw
+# 		body. Writes sent several times in a run are stored once per time.
+#
+# 		Modes:
+# 		  live     GET requests are revalidated with If-None-Match /
+# 		           If-Modified-Since when the API sent an ETag or
+# 		           Last-Modified, so unchanged data only costs a 304.
+# 		           Responses without either are reused for ttl seconds
+# 		           without any request at all.
+# 		  record   Every request goes to the API and every successful
+# 		           response (including the login) is stored.
+# 		  replay   Nothing goes to the API, every response comes from
+# 		           what was recorded. A request that was never recorded
+# 		           raises CacheMiss.
+###############################################################################################
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import requests
+from requests.structures import CaseInsensitiveDict
+
+cache_modes = ('live', 'record', 'replay')
+
+# Seconds a response without ETag or Last-Modified is reused in live mode
+default_ttl = 300
+
+# Response headers that are never written to disk
+_private_headers = ('set-cookie',)
+
+#----------------------------------------------------------------
+# Raised in replay mode for a request that was never recorded
+#----------------------------------------------------------------
+class CacheMiss(Exception):
+    pass
+
+#----------------------------------------------------------------
+# Returns the cache key of a request
+# The account keeps the responses of different logins apart, the
+# Authorization header itself is not used as it changes whenever
+# the token is refreshed. body is the json or data sent, so writes
+# to the same path with different bodies get keys of their own;
+# occurrence tells identical writes apart (the 2nd, 3rd, ... one).
+#----------------------------------------------------------------
+def cache_key(method, url, params=None, account=None, body=None, occurrence=0):
+    query = sorted((str(key), str(value)) for key, value in (params or {}).items())
+    parts = [method.upper(), url, query, account or '']
+    if body is not None:
+        parts.append(body_digest(body))
+    if occurrence:
+        parts.append(occurrence)
+    raw = json.dumps(parts, separators=(',', ':'))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+# Returns the hash of a request body, the same for equal JSON whatever the order of its keys
+def body_digest(body):
+    if isinstance(body, str):
+        body = body.encode()
+    elif not isinstance(body, bytes):
+        body = json.dumps(body, sort_keys=True, separators=(',', ':'), default=str).encode()
+    return hashlib.sha256(body).hexdigest()
+
+# Writes data to path through a temporary file so readers never see half of it
+def _write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+#----------------------------------------------------------------
+# Class holding the cache directory
+# Attach it with SkylightClient(cache=ResponseCache(...)); every
+# request of the client then goes through request() below.
+#----------------------------------------------------------------
+class ResponseCache:
+    def __init__(self, directory, mode='live', ttl=default_ttl):
+        if mode not in cache_modes:
+            raise ValueError(f'Unknown cache mode {mode!r}, expected one of {", ".join(cache_modes)}')
+        self.directory = os.path.expanduser(directory)
+        self.mode = mode
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Requests answered from disk, revalidated with a 304, and sent in full
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # How often each write was sent this run, to key repeats of it apart
+        self._occurrences = {}
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _paths(self, key):
+        return os.path.join(self.directory, f'{key}.json'), os.path.join(self.directory, f'{key}.body')
+
+    # Returns the stored metadata for key, or None
+    def load(self, key):
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if os.path.exists(body_path) else None
+
+    # Stores a successful response under key
+    def store(self, key, response):
+        meta_path, body_path = self._paths(key)
+        _write_atomic(body_path, response.content)
+        entry = {
+            'url': response.url,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {name: value for name, value in response.headers.items() if name.lower() not in _private_headers},
+            'stored_at': time.time(),
+        }
+        _write_atomic(meta_path, json.dumps(entry).encode())
+        return entry
+
+    # Marks a stored response as fresh again after a 304
+    def touch(self, key, entry):
+        entry['stored_at'] = time.time()
+        _write_atomic(self._paths(key)[0], json.dumps(entry).encode())
+
+    # Builds a Response out of a stored entry
+    # Its content is already loaded, so iter_content works even for stream=True callers
+    def response(self, key, entry):
+        with open(self._paths(key)[1], 'rb') as f:
+            content = f.read()
+        r = requests.Response()
+        r.status_code = entry['status']
+        r.reason = entry.get('reason')
+        r.url = entry['url']
+        r.headers = CaseInsensitiveDict(entry['headers'])
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+        r._content = content
+        r._content_consumed = True
+        r.from_cache = True
+        return r
+
+    #----------------------------------------------------------------
+    # Answers a request of client according to the mode
+    # The arguments are those of SkylightClient.request(); anything
+    # that cannot be cached is handed straight to client.send()
+    #----------------------------------------------------------------
+    def request(self, client, method, path, **kwargs):
+        body = kwargs.get('json', kwargs.get('data'))
+        key = cache_key(method, f'{client.base_url}{path}', kwargs.get('params'), client.account, body)
+        if method.upper() not in ('GET', 'HEAD'):
+            # Sending the same write again is a new request, not a repeat of the first
+            with self._lock:
+                occurrence = self._occurrences.get(key, 0)
+                self._occurrences[key] = occurrence + 1
+            key = cache_key(method, f'{client.base_url}{path}', kwargs.get('params'), client.account, body, occurrence)
+
+        if self.mode == 'replay':
+            entry = self.load(key)
+            if entry is None:
+                raise CacheMiss(f'{method} {path} was never recorded')
+            self._count('hits')
+            return self.response(key, entry)
+
+        if self.mode == 'record':
+            r = client.send(method, path, **kwargs)
+            self._count('misses')
+            if r.status_code == 200:
+                self.store(key, r)
+            return r
+
+        # Live mode only caches reads. Streamed responses are passed through
+        # untouched so they keep their flat memory use.
+        if method.upper() != 'GET' or kwargs.get('stream'):
+            return client.send(method, path, **kwargs)
+
+        entry = self.load(key)
+        if entry is not None:
+            headers = CaseInsensitiveDict(entry['headers'])
+            etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+
+            # Without validators the response is reused until it expires
+            if not etag and not last_modified:
+                if time.time() - entry['stored_at'] < self.ttl:
+                    self._count('hits')
+                    return self.response(key, entry)
+            else:
+                conditional = dict(kwargs.pop('headers', None) or {})
+                if etag:
+                    conditional['If-None-Match'] = etag
+                if last_modified:
+                    conditional['If-Modified-Since'] = last_modified
+                kwargs['headers'] = conditional
+
+        r = client.send(method, path, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            r.close()
+            self.touch(key, entry)
+            self._count('not_modified')
+            return self.response(key, entry)
+
+        self._count('misses')
+        if r.status_code == 200:
+            self.store(key, r)
+        return r
+
+    def __str__(self):
+        return f'Cache ({self.mode}): {self.hits} hits, {self.not_modified} not modified, {self.misses} requests'
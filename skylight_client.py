@@ -0,0 +1,202 @@
+###############################################################################################
+# Description:	HTTP client used for every call to the Skylight API.
+# 		One pooled requests.Session is kept per base URL so connections are
+# 		reused (keep-alive) instead of opening a new TLS connection per call.
+# 		Every request gets a timeout and is retried with exponential backoff
+# 		and jitter on connection errors, timeouts, 429 and 5xx responses.
+# 		Requests also pass through the shared AdaptiveLimiter, which slows
+# 		every client down together when the API starts throttling.
+###############################################################################################
+import time
+import random
+import threading
+import requests
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+from skylight_limiter import shared_limiter
+from skylight_metrics import metrics
+
+# Base URL
+default_base_url = 'https://app.ourskylight.com/api'
+
+# (connect, read) timeout in seconds used when none is provided
+default_timeout = (10, 60)
+
+# Number of attempts per request and the backoff between them
+default_retries = 4
+backoff_base = 0.5      # Seconds, doubled after every attempt
+backoff_max = 30        # Seconds, upper bound of a single wait
+
+# Connections kept open per host, this should cover the frame and shard workers
+default_pool_size = 16
+
+# Responses that are worth trying again
+retry_statuses = (429, 500, 502, 503, 504)
+
+#----------------------------------------------------------------
+# Returns how long to wait before the next attempt
+# Uses the Retry-After header when the API provides one, otherwise
+# exponential backoff with full jitter
+#----------------------------------------------------------------
+def backoff_delay(attempt, response=None):
+    if response is not None:
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return min(retry_after, backoff_max)
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+#----------------------------------------------------------------
+# Returns the Retry-After header of a response in seconds, or None
+# The header is either a number of seconds or an HTTP date
+#----------------------------------------------------------------
+def retry_after_seconds(response):
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return int(retry_after)
+    try:
+        when = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+#----------------------------------------------------------------
+# Class that owns the pooled session for a single base URL
+#----------------------------------------------------------------
+class SkylightClient:
+    def __init__(self, base_url=default_base_url, timeout=default_timeout, retries=default_retries, pool_size=default_pool_size, cache=None,
+                 limiter=shared_limiter):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+
+        # Optional skylight_cache.ResponseCache every request goes through,
+        # account keeps the cached responses of different logins apart
+        self.cache = cache
+        self.account = None
+
+        # Optional semaphore (possibly shared between processes) held while a
+        # request is sent, capping the requests in flight to the host
+        self.request_slots = None
+
+        # Adaptive rate and concurrency limit, shared by every client by default (None turns it off)
+        self.limiter = limiter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Called with the rejected Authorization header when the API answers 401
+        # It should log in again and update the session headers
+        self.reauthenticate = None
+
+        # /frames is only requested once per run
+        self._frames = None
+        self._frames_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    #----------------------------------------------------------------
+    # Sends a request relative to the base URL, through the cache
+    # if there is one
+    #----------------------------------------------------------------
+    def request(self, method, path, **kwargs):
+        if self.cache is not None:
+            return self.cache.request(self, method, path, **kwargs)
+        return self.send(method, path, **kwargs)
+
+    # Sends a single request once the limiter and the shared slots allow it
+    def _send_once(self, method, path, **kwargs):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        metrics.add('requests')
+        started = time.monotonic()
+        response = None
+        try:
+            if self.request_slots is None:
+                response = self.session.request(method, f'{self.base_url}{path}', **kwargs)
+            else:
+                with self.request_slots:
+                    response = self.session.request(method, f'{self.base_url}{path}', **kwargs)
+            return response
+        finally:
+            if self.limiter is not None:
+                if response is None:
+                    self.limiter.release(time.monotonic() - started)
+                else:
+                    self.limiter.release(time.monotonic() - started, response.status_code, retry_after_seconds(response))
+
+    #----------------------------------------------------------------
+    # Sends a request relative to the base URL straight to the API
+    # Retries on connection errors, timeouts and retry_statuses.
+    # A 401 is retried once after reauthenticating (unless auth_retry
+    # is False, as for the login request itself).
+    # Returns the final Response; raises the last exception if every
+    # attempt failed to get a response at all. Either carries the
+    # number of attempts made as .attempts
+    #----------------------------------------------------------------
+    def send(self, method, path, timeout=None, retries=None, auth_retry=True, **kwargs):
+        attempts = retries or self.retries
+        kwargs['timeout'] = timeout or self.timeout
+
+        attempt = 0
+        while True:
+            try:
+                response = self._send_once(method, path, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                attempt += 1
+                if attempt == attempts:
+                    e.attempts = attempt
+                    raise
+                metrics.add('retries')
+                time.sleep(backoff_delay(attempt - 1))
+                continue
+
+            # Log in again and repeat the request, this does not count as an attempt
+            if response.status_code == 401 and auth_retry and self.reauthenticate:
+                stale = self.session.headers.get('Authorization')
+                response.close()
+                self.reauthenticate(stale)
+                auth_retry = False
+                continue
+
+            attempt += 1
+            if response.status_code not in retry_statuses or attempt == attempts:
+                response.attempts = attempt
+                return response
+
+            # Release the connection back to the pool before waiting
+            response.close()
+            metrics.add('retries')
+            time.sleep(backoff_delay(attempt - 1, response))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    #----------------------------------------------------------------
+    # Returns the /frames JSON data
+    # The response is only requested once and then reused, so both
+    # the frame information and the frame IDs come from a single call
+    #----------------------------------------------------------------
+    def get_frames(self, **kwargs):
+        with self._frames_lock:
+            if self._frames is None:
+                with metrics.stage('frames'):
+                    r = self.get('/frames', params={'show_deleted': 'true'}, **kwargs)
+                    r.raise_for_status()
+                    self._frames = r.json()
+            return self._frames
@@ -0,0 +1,284 @@
+###############################################################################################
+# Description:	Long running sync daemon serving the .ics feeds of every frame.
+# 		Logs in once and keeps the session (the client logs in again by itself
+# 		when the token is rejected), then polls the calendar events of each
+# 		frame over a rolling range. The interval adapts: right after a change
+# 		or when an event is about to start it polls every min_interval, and
+# 		it backs off towards max_interval when nothing is coming up.
+#
+# 		Every frame's .ics is rendered with write_icalendar_deterministic, so
+# 		it is only rendered again when its events change, and the bytes (plus
+# 		a gzipped copy) are kept in memory. Subscribers are answered from
+# 		memory over HTTP and never cause a request to the API:
+# 		  GET /frames/<frame_id>.ics   the feed, with ETag / Last-Modified
+# 		                              and 304 Not Modified for If-None-Match
+# 		  GET /                       JSON status of every feed
+#
+# Usage:	python skylight_daemon.py --port 8787 --frames 1600234,1600235
+###############################################################################################
+import os
+import gzip
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import skylight_scrape
+from skylight_scrape import (login, logger, fetch_calendar_events, fetch_calendar_events_sharded, index_included,
+                             write_icalendar_deterministic, load_ics_state, ics_state_suffix, format_api_datetime,
+                             EventTable, default_token_cache)
+from skylight_client import SkylightClient
+from skylight_recurrence import RecurrenceExpander
+
+default_host = '127.0.0.1'
+default_port = 8787
+
+# Seconds between polls of a frame
+default_min_interval = 60
+default_max_interval = 900
+
+# Rolling range polled, in days before and after now
+default_past_days = 30
+default_future_days = 365
+
+#----------------------------------------------------------------
+# Class holding the rendered feed of one frame
+# A new Feed replaces the old one whole, so the HTTP threads never
+# see one half updated
+#----------------------------------------------------------------
+class Feed:
+    __slots__ = ('frame_id', 'body', 'gzipped', 'etag', 'last_modified', 'events')
+
+    def __init__(self, frame_id, body, calendar_hash, modified, events):
+        self.frame_id = frame_id
+        self.body = body
+        self.gzipped = gzip.compress(body, mtime=0)
+        self.etag = f'"{calendar_hash}"'
+        self.last_modified = formatdate(modified, usegmt=True)
+        self.events = events
+
+#----------------------------------------------------------------
+# Thread polling the calendar events of one frame
+#----------------------------------------------------------------
+class FrameSyncer(threading.Thread):
+    def __init__(self, daemon, frame_id):
+        super().__init__(name=f'sync-{frame_id}', daemon=True)
+        self.owner = daemon
+        self.frame_id = frame_id
+        self.path = os.path.join(daemon.directory, f'calendar_{frame_id}.ics')
+        self.expander = RecurrenceExpander()
+        self.interval = daemon.min_interval
+        self.next_poll = time.time()
+        self.polls = 0
+        self.errors = 0
+        self.last_error = None
+
+    def run(self):
+        while not self.owner.stopping.is_set():
+            try:
+                changed, events = self.sync()
+                self.interval = self.next_interval(changed, events)
+            except Exception as e:
+                # Keep serving the last feed, and try again less and less often
+                self.errors += 1
+                self.last_error = f'{type(e).__name__}: {e}'
+                print(f'Frame {self.frame_id}: {self.last_error}')
+                self.interval = min(self.owner.max_interval, self.interval * 2)
+            self.next_poll = time.time() + self.interval
+            self.owner.stopping.wait(self.interval)
+
+    #----------------------------------------------------------------
+    # Fetches the events and renders the feed again if they changed
+    # Returns (whether the feed changed, the events as an EventTable)
+    #----------------------------------------------------------------
+    def sync(self):
+        owner = self.owner
+        now = datetime.now(timezone.utc)
+        after = format_api_datetime(now - timedelta(days=owner.past_days))
+        before = format_api_datetime(now + timedelta(days=owner.future_days))
+        if owner.window:
+            data = fetch_calendar_events_sharded(owner.AccountInfo, self.frame_id, after, before, owner.window)
+        else:
+            data = fetch_calendar_events(owner.AccountInfo, self.frame_id, after, before)
+        self.polls += 1
+
+        resources = index_included(data['included'])
+        count, changed = write_icalendar_deterministic(data['data'], self.path, resources=resources)
+        events = EventTable.from_json(data['data'], resources)
+        if changed or self.frame_id not in owner.feeds:
+            with open(self.path, 'rb') as f:
+                body = f.read()
+            state = load_ics_state(f'{self.path}{ics_state_suffix}')
+            owner.feeds[self.frame_id] = Feed(self.frame_id, body, state.get('hash', ''), time.time(), count)
+            logger('Frame %s: feed rendered with %s events', self.frame_id, count)
+        return changed, events
+
+    #----------------------------------------------------------------
+    # Returns the seconds to wait before the next poll
+    # A quarter of the time left until the next event starts, kept
+    # between min_interval and max_interval; min_interval straight
+    # after a change as more edits tend to follow
+    #----------------------------------------------------------------
+    def next_interval(self, changed, events):
+        owner = self.owner
+        if changed:
+            return owner.min_interval
+        now_ms = int(time.time() * 1000)
+        horizon_ms = now_ms + owner.max_interval * 4 * 1000
+        upcoming = [start for _, found in self.expander.expand(events, now_ms, horizon_ms) for start in found if start >= now_ms]
+        if not upcoming:
+            return owner.max_interval
+        return max(owner.min_interval, min(owner.max_interval, (min(upcoming) - now_ms) / 4000))
+
+    def status(self):
+        feed = self.owner.feeds.get(self.frame_id)
+        return {
+            'frame_id': self.frame_id,
+            'events': feed.events if feed else None,
+            'etag': feed.etag if feed else None,
+            'last_modified': feed.last_modified if feed else None,
+            'polls': self.polls,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'interval': round(self.interval, 1),
+            'next_poll_in': round(max(0.0, self.next_poll - time.time()), 1),
+        }
+
+#----------------------------------------------------------------
+# Answers feed requests from the feeds in memory
+#----------------------------------------------------------------
+class FeedHandler(BaseHTTPRequestHandler):
+    server_version = 'SkylightFeeds/1.0'
+    # Keep-alive, so a subscriber polling often reuses its connection
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        owner = self.server.owner
+        path = self.path.split('?', 1)[0]
+        if path == '/':
+            body = json.dumps([syncer.status() for syncer in owner.syncers], indent=4).encode()
+            return self._send(200, body, 'application/json', head=head)
+
+        frame_id = path[len('/frames/'):-len('.ics')] if path.startswith('/frames/') and path.endswith('.ics') else None
+        feed = owner.feeds.get(frame_id)
+        if feed is None:
+            if frame_id in owner.frame_ids:
+                return self._send(503, b'Feed not ready yet\n', 'text/plain', head=head, headers={'Retry-After': '5'})
+            return self._send(404, b'Unknown feed\n', 'text/plain', head=head)
+
+        headers = {'ETag': feed.etag, 'Last-Modified': feed.last_modified, 'Cache-Control': 'no-cache'}
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            if feed.etag in tags or '*' in tags:
+                return self._send(304, b'', None, head=True, headers=headers)
+        elif self.headers.get('If-Modified-Since') == feed.last_modified:
+            return self._send(304, b'', None, head=True, headers=headers)
+
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            body = feed.gzipped
+        else:
+            body = feed.body
+        headers['Vary'] = 'Accept-Encoding'
+        self._send(200, body, 'text/calendar; charset=utf-8', head=head, headers=headers)
+
+    def _send(self, status, body, content_type, head=False, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger('%s - %s', self.address_string(), format % args)
+
+#----------------------------------------------------------------
+# Class tying the login, the syncers and the HTTP server together
+#----------------------------------------------------------------
+class SyncDaemon:
+    def __init__(self, AccountInfo, frame_ids, directory='.', host=default_host, port=default_port,
+                 min_interval=default_min_interval, max_interval=default_max_interval,
+                 past_days=default_past_days, future_days=default_future_days, window=None):
+        self.AccountInfo = AccountInfo
+        self.frame_ids = [str(frame_id) for frame_id in frame_ids]
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.past_days = past_days
+        self.future_days = future_days
+        self.window = window
+
+        self.feeds = {}
+        self.stopping = threading.Event()
+        self.syncers = [FrameSyncer(self, frame_id) for frame_id in self.frame_ids]
+        self.server = ThreadingHTTPServer((host, port), FeedHandler)
+        self.server.daemon_threads = True
+        self.server.owner = self
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    # Starts polling and serving in the background
+    def start(self):
+        for syncer in self.syncers:
+            syncer.start()
+        threading.Thread(target=self.server.serve_forever, name='feeds', daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Runs until interrupted
+    def run(self):
+        self.start()
+        print(f'Serving {len(self.syncers)} feeds on {self.address}/frames/<frame_id>.ics')
+        try:
+            while not self.stopping.wait(3600):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep the Skylight calendars in sync and serve them as .ics feeds')
+    parser.add_argument('--frames', help='Comma separated frame IDs to serve (default every frame)')
+    parser.add_argument('--host', default=default_host, help=f'Address to listen on (default {default_host})')
+    parser.add_argument('--port', type=int, default=default_port, help=f'Port to listen on (default {default_port})')
+    parser.add_argument('--directory', default='.', help='Where the .ics files and their state are kept between restarts')
+    parser.add_argument('--min-interval', type=float, default=default_min_interval, help='Shortest time between polls of a frame, in seconds')
+    parser.add_argument('--max-interval', type=float, default=default_max_interval, help='Longest time between polls of a frame, in seconds')
+    parser.add_argument('--past-days', type=int, default=default_past_days, help='Days before now to include in the feeds')
+    parser.add_argument('--future-days', type=int, default=default_future_days, help='Days after now to include in the feeds')
+    parser.add_argument('--window', help='Split the range into windows fetched concurrently: year, month, week, day or a number of days')
+    parser.add_argument('--credentials', help='JSON file with "email" and "password"')
+    parser.add_argument('--no-token-cache', action='store_true', help='Always log in instead of reusing the cached token')
+    args = parser.parse_args()
+
+    AccountInfo = login(client=SkylightClient(skylight_scrape.url), credentials_file=args.credentials,
+                        token_cache=None if args.no_token_cache else default_token_cache)
+    frame_ids = args.frames.split(',') if args.frames else AccountInfo.getFrameId()
+
+    SyncDaemon(AccountInfo, frame_ids, args.directory, args.host, args.port, args.min_interval, args.max_interval,
+               args.past_days, args.future_days, args.window).run()
+
+
+if __name__ == '__main__':
+    main()
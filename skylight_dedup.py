@@ -0,0 +1,252 @@
+###############################################################################################
+# Description:	De-duplication of events merged from several frames and sources.
+# 		The same event can come back from several frames, and through several
+# 		sources (skylight, google, ics_link, ...). Each event gets a key made
+# 		of its normalised UID base, summary, start, end and RRULE, and one
+# 		pass over the events with a dictionary keeps a single copy per key,
+# 		so the cost stays linear in the number of events.
+#
+# 		Which copy is kept is decided by the precedence rules, tried in order:
+# 		  source     earlier in source_order wins
+# 		  editable   an editable copy beats a read only one
+# 		  updated    the most recently updated copy wins
+# 		  complete   the copy with the most attributes filled in wins
+# 		and otherwise the first copy seen is kept.
+#
+# 		Editing a series "from this event on" splits it: the original gets an
+# 		UNTIL and the rest continues as a new series with a UID like
+# 		from-app-<hash>-after-<epoch> (Google uses <uid>_R<date>). When the
+# 		new series carries on exactly where the old one stopped, with the same
+# 		summary, times, rule and details (description, location, category,
+# 		...), the two are joined back into one series. A split that changed
+# 		any of those is a real edit and both parts are kept.
+#
+# 		Works on the JSON event items of a response as well as on EventInfo.
+###############################################################################################
+import re
+import copy
+from datetime import datetime, timezone
+
+from skylight_scrape import timestamp_to_epoch_ms, missing_timestamp, get_zoneinfo, relationship_id
+from skylight_recurrence import normalize_rrule, Series
+from skylight_index import day_ms
+
+# Suffixes added to the UID of the continuation of a split series
+split_uid_patterns = [
+    re.compile(r'-after-\d+$'),                 # Skylight: from-app-<hash>-after-<epoch>
+    re.compile(r'_R\d{8}(T\d{6}Z?)?$'),         # Google: <uid>_R20240101T090000
+]
+
+precedence_rules = ('source', 'editable', 'updated', 'complete')
+default_precedence = precedence_rules
+
+# Sources in the order they win when they hold the same event
+default_source_order = ('skylight', 'google', 'icloud', 'outlook', 'ics_link')
+
+# Attributes counted by the "complete" rule
+_detail_attributes = ('description', 'location', 'time_zone', 'lat', 'lng', 'category_id', 'calendar_id', 'owner_email')
+
+# Attributes the parts of a split series must share to be joined, as
+# the joined series keeps those of the earlier part
+_series_attributes = ('description', 'location', 'status', 'invited_emails', 'lat', 'lng', 'category_id',
+                      'calendar_id', 'owner_email', 'source', 'kind', 'editable')
+
+# EventInfo names of what JSON event items hold as a relationship or under another name
+_relationship_names = {'category_id': 'category', 'calendar_account_id': 'calendar_account'}
+_json_attribute_names = {'time_zone': 'timezone'}
+
+# Returns an attribute of a JSON event item or an EventInfo
+def _get(event, name):
+    if isinstance(event, dict):
+        if name in _relationship_names:
+            return relationship_id(event, _relationship_names[name])
+        return event['attributes'].get(_json_attribute_names.get(name, name))
+    return getattr(event, name, None)
+
+# Returns the UID without the suffix of a series split
+def uid_base(uid):
+    if not uid:
+        return ''
+    for pattern in split_uid_patterns:
+        uid = pattern.sub('', uid)
+    return uid
+
+# Returns the rule with its parts in a fixed order, and without UNTIL and COUNT if asked for
+def _canonical_rule(rrule, open_ended=False):
+    rule = normalize_rrule(rrule)
+    if not rule:
+        return ''
+    parts = sorted(part for part in rule.split(';') if not (open_ended and part.split('=', 1)[0] in ('UNTIL', 'COUNT')))
+    return ';'.join(parts)
+
+# Returns the start and end of an event as epoch milliseconds
+def _span(event):
+    start = timestamp_to_epoch_ms(_get(event, 'starts_at'))
+    if _get(event, 'all_day'):
+        return start, start + day_ms if start != missing_timestamp else missing_timestamp
+    return start, timestamp_to_epoch_ms(_get(event, 'ends_at'))
+
+#----------------------------------------------------------------
+# Returns the key two copies of the same event share
+# by_uid=False leaves the UID out, for sources that give the same
+# event a UID of their own
+#----------------------------------------------------------------
+def event_key(event, by_uid=True):
+    start, end = _span(event)
+    summary = ' '.join((_get(event, 'summary') or '').split()).casefold()
+    rule = _canonical_rule(_get(event, 'rrule')) if _get(event, 'recurring') else ''
+    return (uid_base(_get(event, 'uid')) if by_uid else '', summary, start, end, rule)
+
+#----------------------------------------------------------------
+# Class holding the de-duplication settings and counters
+#----------------------------------------------------------------
+class Deduplicator:
+    def __init__(self, precedence=default_precedence, source_order=default_source_order, by_uid=True, join_splits=True):
+        unknown = [rule for rule in precedence if rule not in precedence_rules]
+        if unknown:
+            raise ValueError(f'Unknown precedence rule(s) {", ".join(unknown)}, expected {", ".join(precedence_rules)}')
+        self.precedence = tuple(precedence)
+        self.source_order = {source: i for i, source in enumerate(source_order)}
+        self.by_uid = by_uid
+        self.join_splits = join_splits
+
+        # Counters of the last dedupe()
+        self.seen = 0
+        self.duplicates = 0
+        self.splits_joined = 0
+
+    # Returns the rank of a copy, the lowest rank wins
+    def rank(self, event):
+        rank = []
+        for rule in self.precedence:
+            if rule == 'source':
+                rank.append(self.source_order.get(_get(event, 'source'), len(self.source_order)))
+            elif rule == 'editable':
+                rank.append(0 if _get(event, 'editable') else 1)
+            elif rule == 'updated':
+                updated = _get(event, 'updated_at')
+                rank.append(-timestamp_to_epoch_ms(updated) if updated else 0)
+            elif rule == 'complete':
+                rank.append(-sum(1 for name in _detail_attributes if _get(event, name) not in (None, '', [])))
+        return tuple(rank)
+
+    #----------------------------------------------------------------
+    # Returns the events with one copy of every event kept, in the
+    # order they were first seen, and split series joined back up
+    #----------------------------------------------------------------
+    def dedupe(self, events):
+        kept = []
+        index = {}          # key: (position in kept, rank)
+        self.seen = 0
+        for event in events:
+            self.seen += 1
+            key = event_key(event, self.by_uid)
+            found = index.get(key)
+            if found is None:
+                index[key] = (len(kept), self.rank(event))
+                kept.append(event)
+                continue
+            position, best = found
+            rank = self.rank(event)
+            if rank < best:
+                kept[position] = event
+                index[key] = (position, rank)
+        self.duplicates = self.seen - len(kept)
+
+        self.splits_joined = 0
+        if self.join_splits:
+            kept = self._join_splits(kept)
+        return kept
+
+    #----------------------------------------------------------------
+    # Joins the parts of split series back together
+    # Parts are grouped by UID base, summary, rule and duration in
+    # one pass; only groups of several parts are looked at further
+    #----------------------------------------------------------------
+    def _join_splits(self, events):
+        groups = {}
+        for position, event in enumerate(events):
+            if not _get(event, 'recurring'):
+                continue
+            rule = _canonical_rule(_get(event, 'rrule'))
+            base = uid_base(_get(event, 'uid'))
+            if not rule or not base or 'COUNT=' in rule:
+                continue
+            start, end = _span(event)
+            if start == missing_timestamp or end == missing_timestamp:
+                continue
+            summary = ' '.join((_get(event, 'summary') or '').split()).casefold()
+            groups.setdefault((base, summary, _canonical_rule(rule, open_ended=True), end - start, _get(event, 'time_zone')), []).append(position)
+
+        dropped = set()
+        for positions in groups.values():
+            if len(positions) < 2:
+                continue
+            positions.sort(key=lambda position: _span(events[position])[0])
+            first = positions[0]
+            for position in positions[1:]:
+                joined = _join(events[first], events[position])
+                if joined is None:
+                    first = position
+                    continue
+                events[first] = joined
+                dropped.add(position)
+                self.splits_joined += 1
+        if not dropped:
+            return events
+        return [event for position, event in enumerate(events) if position not in dropped]
+
+    def __str__(self):
+        return (f'De-duplication: {self.seen} events, {self.duplicates} duplicates removed, '
+                f'{self.splits_joined} split series joined')
+
+# Returns the series of an event (the rule without UNTIL and COUNT starting at its start) and its UNTIL
+def _open_series(event):
+    start, end = _span(event)
+    zone = get_zoneinfo(_get(event, 'time_zone')) if _get(event, 'time_zone') else None
+    until_ms = Series(_canonical_rule(_get(event, 'rrule')), start, end - start, zone).until_ms
+    return Series(_canonical_rule(_get(event, 'rrule'), open_ended=True), start, end - start, zone), until_ms
+
+#----------------------------------------------------------------
+# Returns the series earlier continued by later as a single event,
+# or None if later is not its continuation: later has to start on
+# an occurrence of earlier's rule, with none of them left out
+# between the end of earlier and the start of later, and share
+# its details
+#----------------------------------------------------------------
+def _join(earlier, later):
+    if any(_get(earlier, name) != _get(later, name) for name in _series_attributes):
+        return None
+    series, until_ms = _open_series(earlier)
+    later_start = _span(later)[0]
+    rule = series.rrule()
+    moment = datetime.fromtimestamp((later_start - 1) / 1000, tz=timezone.utc)
+    following = rule.after(moment)
+    if following is None or int(following.timestamp() * 1000) != later_start:
+        return None
+    if until_ms is not None and until_ms < later_start:
+        gap = rule.after(datetime.fromtimestamp(until_ms / 1000, tz=timezone.utc))
+        if gap is not None and int(gap.timestamp() * 1000) < later_start:
+            return None
+
+    # Runs as long as the longer of the two
+    later_until = _open_series(later)[1]
+    if until_ms is None or later_until is None:
+        until_ms = None
+    else:
+        until_ms = max(until_ms, later_until)
+    # The rule of earlier as it was written, with the new UNTIL
+    rule = ';'.join(part for part in normalize_rrule(_get(earlier, 'rrule')).split(';') if not part.startswith('UNTIL='))
+    if until_ms is not None:
+        rule += f';UNTIL={datetime.fromtimestamp(until_ms / 1000, tz=timezone.utc):%Y%m%dT%H%M%SZ}'
+    return _with_rrule(earlier, [f'RRULE:{rule}'])
+
+# Returns a copy of the event with another rule
+def _with_rrule(event, rrule):
+    if isinstance(event, dict):
+        joined = dict(event)
+        joined['attributes'] = dict(event['attributes'], rrule=rrule)
+        return joined
+    joined = copy.copy(event)
+    joined.rrule = rrule
+    return joined
@@ -0,0 +1,242 @@
+###############################################################################################
+# Description:	Streaming exports of the extracted events, categories and calendar
+# 		accounts for analytics, which load far faster than reparsing .ics.
+# 		  jsonl     one JSON object per line
+# 		  csv       one row per record, lists and dictionaries as JSON text
+# 		  parquet   columnar, written in batches (requires pyarrow)
+# 		Records are written as they are read, so memory use stays bounded no
+# 		matter how many events there are. JSON Lines and CSV can be gzip, bz2
+# 		or xz compressed; Parquet compresses its columns itself.
+###############################################################################################
+import io
+import os
+import bz2
+import csv
+import gzip
+import json
+import lzma
+from datetime import datetime
+from contextlib import contextmanager
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+export_formats = ('jsonl', 'csv', 'parquet')
+compressions = ('gz', 'bz2', 'xz')
+
+# Of those, what Parquet can compress its columns with (None is its own zstd)
+parquet_compressions = (None, 'gz')
+
+# Rows per Parquet row group
+default_batch_size = 65536
+
+# Parquet column types; every other column is stored as a string
+column_types = {
+    'starts_at': 'timestamp',
+    'ends_at': 'timestamp',
+    'all_day': 'bool',
+    'recurring': 'bool',
+    'editable': 'bool',
+    'selected_for_chore_chart': 'bool',
+    'lat': 'float64',
+    'lng': 'float64',
+}
+
+#----------------------------------------------------------------
+# Returns the field names of a record
+# Works for the __slots__ classes (EventInfo), plain classes
+# (Category, CalendarAccount) and dictionaries
+#----------------------------------------------------------------
+def record_fields(record):
+    if isinstance(record, dict):
+        return list(record)
+    slots = getattr(type(record), '__slots__', None)
+    if slots:
+        return list(slots)
+    return list(vars(record))
+
+def record_values(record, fields):
+    if isinstance(record, dict):
+        return [record.get(field) for field in fields]
+    return [getattr(record, field, None) for field in fields]
+
+#----------------------------------------------------------------
+# Opens path for writing text, compressed with gzip, bz2 or xz
+# when asked for or when the path ends in .gz, .bz2 or .xz
+# gzip output has a fixed timestamp so the same records always
+# produce the same file
+#----------------------------------------------------------------
+@contextmanager
+def open_text(path, compression=None, newline=None):
+    if compression is None:
+        extension = os.path.splitext(path)[1].lstrip('.')
+        compression = extension if extension in compressions else None
+    if compression == 'gz':
+        # GzipFile leaves a file it was handed open, so that one is closed here
+        with open(path, 'wb') as raw, gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as packed, \
+                io.TextIOWrapper(packed, encoding='utf-8', newline=newline) as f:
+            yield f
+        return
+    if compression == 'bz2':
+        f = bz2.open(path, 'wt', encoding='utf-8', newline=newline)
+    elif compression == 'xz':
+        f = lzma.open(path, 'wt', encoding='utf-8', newline=newline)
+    elif compression:
+        raise ValueError(f'Unknown compression {compression!r}, expected one of {", ".join(compressions)}')
+    else:
+        f = open(path, 'w', encoding='utf-8', newline=newline)
+    with f:
+        yield f
+
+#----------------------------------------------------------------
+# Writes records as JSON Lines
+# Returns the number of records written
+#----------------------------------------------------------------
+def write_jsonl(records, path, compression=None):
+    count = 0
+    fields = None
+    with open_text(path, compression) as f:
+        for record in records:
+            if fields is None:
+                fields = record_fields(record)
+            f.write(json.dumps(dict(zip(fields, record_values(record, fields))), ensure_ascii=False, separators=(',', ':')))
+            f.write('\n')
+            count += 1
+    return count
+
+# Turns a value into a CSV cell
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+#----------------------------------------------------------------
+# Writes records as CSV with a header row
+# fields defaults to those of the first record
+# Returns the number of records written
+#----------------------------------------------------------------
+def write_csv(records, path, compression=None, fields=None):
+    count = 0
+    with open_text(path, compression, newline='') as f:
+        writer = csv.writer(f)
+        if fields is not None:
+            writer.writerow(fields)
+        for record in records:
+            if fields is None:
+                fields = record_fields(record)
+                writer.writerow(fields)
+            writer.writerow([_csv_value(value) for value in record_values(record, fields)])
+            count += 1
+    return count
+
+# Returns the pyarrow schema for the fields
+def _parquet_schema(fields):
+    types = {
+        'timestamp': pyarrow.timestamp('ms', tz='UTC'),
+        'bool': pyarrow.bool_(),
+        'float64': pyarrow.float64(),
+    }
+    return pyarrow.schema([(field, types.get(column_types.get(field), pyarrow.string())) for field in fields])
+
+# Converts a value for a Parquet column of the given type
+def _parquet_value(value, kind):
+    if value is None:
+        return None
+    if kind == 'timestamp':
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if kind == 'bool':
+        return bool(value)
+    if kind == 'float64':
+        return float(value)
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+#----------------------------------------------------------------
+# Writes records as Parquet, batch_size rows at a time
+# compression is the Parquet column codec (zstd, snappy, gzip, ...)
+# fields defaults to those of the first record
+# Returns the number of records written
+#----------------------------------------------------------------
+def write_parquet(records, path, compression='zstd', batch_size=default_batch_size, fields=None):
+    if pyarrow is None:
+        raise ImportError('Parquet export requires pyarrow (pip install pyarrow)')
+    if compression == 'gz':
+        compression = 'gzip'
+
+    count = 0
+    kinds = schema = writer = None
+    columns = None
+    try:
+        for record in records:
+            if writer is None:
+                fields = fields or record_fields(record)
+                kinds = [column_types.get(field) for field in fields]
+                schema = _parquet_schema(fields)
+                writer = pyarrow.parquet.ParquetWriter(path, schema, compression=compression)
+                columns = [[] for _ in fields]
+            for column, kind, value in zip(columns, kinds, record_values(record, fields)):
+                column.append(_parquet_value(value, kind))
+            count += 1
+            if len(columns[0]) >= batch_size:
+                writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+                columns = [[] for _ in fields]
+        if writer is not None and columns[0]:
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    # No records, leave a file with just the columns (if they are known) rather than none
+    if writer is None:
+        table = _parquet_schema(fields).empty_table() if fields else pyarrow.table({})
+        pyarrow.parquet.write_table(table, path, compression=compression)
+    return count
+
+#----------------------------------------------------------------
+# Writes records to path in the given format
+# fields are the CSV and Parquet columns, by default those of the
+# first record
+# Returns the number of records written
+#----------------------------------------------------------------
+def export_records(records, path, export_format, compression=None, fields=None):
+    if export_format == 'jsonl':
+        return write_jsonl(records, path, compression)
+    if export_format == 'csv':
+        return write_csv(records, path, compression, fields)
+    if export_format == 'parquet':
+        if compression not in parquet_compressions:
+            raise ValueError(f'Parquet exports cannot be compressed with {compression}')
+        return write_parquet(records, path, compression or 'zstd', fields=fields)
+    raise ValueError(f'Unknown export format {export_format!r}, expected one of {", ".join(export_formats)}')
+
+#----------------------------------------------------------------
+# Exports events, categories and calendar accounts into directory
+# as events.<format>, categories.<format> and calendar_accounts.<format>
+# (plus .gz/.bz2/.xz for compressed JSON Lines and CSV)
+# The CSV and Parquet files always have the columns of EventInfo,
+# Category and CalendarAccount, even when there are no records
+# Returns {name: (path, count)}
+#----------------------------------------------------------------
+def export_all(directory, export_format, events, categories=(), calendar_accounts=(), compression=None):
+    # Imported here as skylight_scrape builds on this module
+    from skylight_scrape import EventInfo, Category, CalendarAccount
+
+    os.makedirs(directory, exist_ok=True)
+    suffix = f'.{compression}' if compression and export_format != 'parquet' else ''
+    written = {}
+    for name, records, fields in (('events', events, list(EventInfo.__slots__)),
+                                  ('categories', categories, record_fields(Category(None, None))),
+                                  ('calendar_accounts', calendar_accounts, record_fields(CalendarAccount(None, None)))):
+        path = os.path.join(directory, f'{name}.{export_format}{suffix}')
+        written[name] = (path, export_records(records, path, export_format, compression, fields))
+    return written
@@ -0,0 +1,234 @@
+###############################################################################################
+# Description:	Interval index over extracted events.
+# 		Answers "what is on between X and Y", finds conflicts and computes
+# 		merged busy / free blocks per category or calendar without scanning
+# 		every event's starts_at / ends_at strings.
+#
+# 		The events are sorted by start and laid out as an implicit balanced
+# 		binary tree (the middle of every range is its root) where each node
+# 		also stores the latest end within its subtree. An overlap query walks
+# 		only the branches that can still contain a match, so it takes
+# 		O(log n) when nothing matches and at most O(k log n) for k results.
+###############################################################################################
+import heapq
+from array import array
+from datetime import datetime, timezone
+
+from skylight_scrape import EventTable, timestamp_to_epoch_ms, missing_timestamp
+
+# All day events last one day from their start, the same as in the .ics
+day_ms = 24 * 60 * 60 * 1000
+
+#----------------------------------------------------------------
+# Converts a query bound into epoch milliseconds
+# Accepts epoch milliseconds, a datetime (naive is taken as UTC)
+# or an API timestamp string
+#----------------------------------------------------------------
+def to_epoch_ms(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp() * 1000)
+    if isinstance(value, str):
+        return timestamp_to_epoch_ms(value)
+    return int(value)
+
+# Returns the group of event i for a key that is a column name or a callable
+def _group_of(events, key, i):
+    if callable(key):
+        return key(events[i])
+    if isinstance(events, EventTable):
+        if key in EventTable.interned_columns:
+            return events.pool.get(events.columns[key][i])
+        if key in EventTable.object_columns:
+            return events.columns[key][i]
+    return getattr(events[i], key)
+
+# Merges (start, end) pairs that are already sorted by start
+def _merge_sorted(intervals):
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(block) for block in merged]
+
+#----------------------------------------------------------------
+# Class holding the index
+# events can be an EventTable or any list of EventInfo objects;
+# results refer back to them by position.
+#----------------------------------------------------------------
+class IntervalIndex:
+    def __init__(self, events):
+        self.events = events
+
+        if isinstance(events, EventTable):
+            raw_starts = events.starts_at_ms
+            raw_ends = events.ends_at_ms
+            all_day = [flag == 1 for flag in events.columns['all_day']]
+        else:
+            raw_starts = [timestamp_to_epoch_ms(event.starts_at) for event in events]
+            raw_ends = [timestamp_to_epoch_ms(event.ends_at) for event in events]
+            all_day = [bool(event.all_day) for event in events]
+
+        # Work out the effective end of every event, skipping events without a start
+        intervals = []
+        for i, start in enumerate(raw_starts):
+            if start == missing_timestamp:
+                continue
+            end = start + day_ms if all_day[i] else raw_ends[i]
+            # Zero length (or broken) events still occupy their start instant
+            if end <= start:
+                end = start + 1
+            intervals.append((start, end, i))
+        intervals.sort()
+
+        self.starts = array('q', (interval[0] for interval in intervals))
+        self.ends = array('q', (interval[1] for interval in intervals))
+        self.positions = array('q', (interval[2] for interval in intervals))
+
+        # max_end[mid] is the latest end within the subtree rooted at mid
+        self.max_end = array('q', self.ends)
+        self._build(0, len(self.starts))
+
+    def __len__(self):
+        return len(self.starts)
+
+    # Fills in max_end bottom up for the range [lo, hi)
+    def _build(self, lo, hi):
+        # Iterative post-order walk, so very large calendars do not hit the recursion limit
+        stack = [(lo, hi, False)]
+        while stack:
+            lo, hi, children_done = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if not children_done:
+                stack.append((lo, hi, True))
+                stack.append((lo, mid, False))
+                stack.append((mid + 1, hi, False))
+                continue
+            best = self.ends[mid]
+            if lo < mid:
+                best = max(best, self.max_end[(lo + mid) // 2])
+            if mid + 1 < hi:
+                best = max(best, self.max_end[(mid + 1 + hi) // 2])
+            self.max_end[mid] = best
+
+    #----------------------------------------------------------------
+    # Returns the indices into starts/ends/positions of every event
+    # overlapping [start, end), in ascending order (so by start)
+    #----------------------------------------------------------------
+    def _overlapping_indices(self, start, end):
+        start = to_epoch_ms(start)
+        end = to_epoch_ms(end)
+        starts, ends, max_end = self.starts, self.ends, self.max_end
+
+        # A subtree is skipped when everything in it ends before start,
+        # and the right side when its events start at or after end
+        found = []
+        stack = [(0, len(starts))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if max_end[mid] <= start:
+                continue
+            stack.append((lo, mid))
+            if starts[mid] < end:
+                if ends[mid] > start:
+                    found.append(mid)
+                stack.append((mid + 1, hi))
+
+        found.sort()
+        return found
+
+    #----------------------------------------------------------------
+    # Returns the positions of every event overlapping [start, end)
+    # ordered by their start
+    #----------------------------------------------------------------
+    def overlapping_positions(self, start, end):
+        return [self.positions[i] for i in self._overlapping_indices(start, end)]
+
+    # Returns the events overlapping [start, end) ordered by their start
+    def overlapping(self, start, end):
+        return [self.events[i] for i in self.overlapping_positions(start, end)]
+
+    # Returns the events happening at a single instant
+    def at(self, instant):
+        instant = to_epoch_ms(instant)
+        return self.overlapping(instant, instant + 1)
+
+    #----------------------------------------------------------------
+    # Finds every pair of events that overlap each other
+    # Sweeps the events by start while keeping the ones still running
+    # in a heap ordered by end. Returns a list of (position, position)
+    #----------------------------------------------------------------
+    def conflicts(self, start=None, end=None):
+        if start is None:
+            candidates = range(len(self.starts))
+        else:
+            candidates = self._overlapping_indices(start, end)
+
+        pairs = []
+        running = []
+        for i in candidates:
+            while running and running[0][0] <= self.starts[i]:
+                heapq.heappop(running)
+            for _, other in running:
+                pairs.append((self.positions[other], self.positions[i]))
+            heapq.heappush(running, (self.ends[i], i))
+        return pairs
+
+    #----------------------------------------------------------------
+    # Merges the events into busy blocks of (start_ms, end_ms)
+    # Optionally clipped to [start, end). If key is given (a column
+    # such as 'category_id' or 'calendar_id', or a callable taking an
+    # EventInfo) a dictionary of blocks per group is returned instead.
+    #----------------------------------------------------------------
+    def busy_blocks(self, start=None, end=None, key=None):
+        if start is None:
+            indices = range(len(self.starts))
+            lower, upper = None, None
+        else:
+            lower, upper = to_epoch_ms(start), to_epoch_ms(end)
+            indices = self._overlapping_indices(lower, upper)
+
+        groups = {}
+        for i in indices:
+            block_start, block_end = self.starts[i], self.ends[i]
+            if lower is not None:
+                block_start, block_end = max(block_start, lower), min(block_end, upper)
+            group = _group_of(self.events, key, self.positions[i]) if key else None
+            groups.setdefault(group, []).append((block_start, block_end))
+
+        merged = {group: _merge_sorted(intervals) for group, intervals in groups.items()}
+        if key:
+            return merged
+        return merged.get(None, [])
+
+    #----------------------------------------------------------------
+    # Returns the free blocks of (start_ms, end_ms) within [start, end)
+    # Like busy_blocks, a key returns a dictionary per group
+    #----------------------------------------------------------------
+    def free_blocks(self, start, end, key=None):
+        lower, upper = to_epoch_ms(start), to_epoch_ms(end)
+        busy = self.busy_blocks(lower, upper, key)
+
+        def invert(blocks):
+            free = []
+            cursor = lower
+            for block_start, block_end in blocks:
+                if block_start > cursor:
+                    free.append((cursor, block_start))
+                cursor = max(cursor, block_end)
+            if cursor < upper:
+                free.append((cursor, upper))
+            return free
+
+        if key:
+            return {group: invert(blocks) for group, blocks in busy.items()}
+        return invert(busy)
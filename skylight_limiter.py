@@ -0,0 +1,178 @@
+###############################################################################################
+# Description:	Adaptive rate limiting for every request sent to the Skylight API.
+# 		A token bucket spaces the requests out to at most rate per second,
+# 		and an AIMD controller (additive increase, multiplicative decrease)
+# 		decides how many may be in flight at once:
+# 		  429 / 503 / Retry-After   rate and concurrency are halved, and with
+# 		                            Retry-After every request waits it out
+# 		  healthy latency           concurrency grows by about one per round
+# 		                            of requests, the rate by rate_step per
+# 		                            response
+# 		  slow responses            both are held where they are
+# 		One limiter is shared by every client in the process, so frames,
+# 		windows and pages all draw from the same budget.
+###############################################################################################
+import time
+import threading
+
+# Starting point and bounds of the controller
+default_rate = 10.0             # Requests per second
+default_max_rate = 50.0
+default_min_rate = 0.5
+default_burst = 10              # Requests that may be sent back to back
+default_concurrency = 4         # Requests in flight
+default_max_concurrency = 16    # Matches the client's connection pool
+default_min_concurrency = 1
+
+# Responses slower than this (in seconds, up to the headers) stop the ramp up
+default_latency_target = 5.0
+
+# Statuses that mean the API wants us to slow down
+throttle_statuses = (429, 503)
+
+#----------------------------------------------------------------
+# Class holding the shared limiter state
+# acquire() before sending a request, release() with the outcome
+# once the response (or error) is back.
+#----------------------------------------------------------------
+class AdaptiveLimiter:
+    def __init__(self, rate=default_rate, burst=default_burst, concurrency=default_concurrency,
+                 min_rate=default_min_rate, max_rate=default_max_rate,
+                 min_concurrency=default_min_concurrency, max_concurrency=default_max_concurrency,
+                 latency_target=default_latency_target, rate_step=0.5, decrease_factor=0.5, cooldown=1.0):
+        if rate <= 0 or min_rate <= 0:
+            raise ValueError('The request rate has to be above 0')
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        # At least one request has to be let through, or acquire() waits forever
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = float(max(self.min_concurrency, concurrency))
+        self.latency_target = latency_target
+        self.rate_step = rate_step
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown            # Seconds during which further throttles count as the same one
+
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0.0            # Set from Retry-After
+        self.last_decrease = 0.0
+
+        # Counters
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.decreases = 0
+        self.waited = 0.0
+        self.latency_total = 0.0
+
+        self._condition = threading.Condition()
+
+    #----------------------------------------------------------------
+    # Caps how far the controller ramps up, bringing the current rate
+    # and concurrency down to the new caps if they are above them
+    #----------------------------------------------------------------
+    def set_limits(self, max_rate=None, max_concurrency=None):
+        with self._condition:
+            if max_rate is not None:
+                if max_rate <= 0:
+                    raise ValueError(f'max_rate has to be above 0, not {max_rate}')
+                self.max_rate = max_rate
+                self.min_rate = min(self.min_rate, max_rate)
+                self.rate = min(self.rate, max_rate)
+            if max_concurrency is not None:
+                if max_concurrency < 1:
+                    raise ValueError(f'max_concurrency has to be at least 1, not {max_concurrency}')
+                self.max_concurrency = max_concurrency
+                self.min_concurrency = min(self.min_concurrency, max_concurrency)
+                self.limit = max(self.min_concurrency, min(self.limit, max_concurrency))
+            self._condition.notify_all()
+
+    # Refills the bucket and takes a token, returns how long to wait if there was none
+    def _take_token(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    #----------------------------------------------------------------
+    # Blocks until a request may be sent
+    #----------------------------------------------------------------
+    def acquire(self):
+        started = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.in_flight >= max(self.min_concurrency, int(self.limit)):
+                        self._condition.wait()
+                        continue
+                    wait = self._take_token(now)
+                    if wait <= 0:
+                        self.in_flight += 1
+                        self.requests += 1
+                        self.waited += now - started
+                        return
+                self._condition.wait(wait)
+
+    #----------------------------------------------------------------
+    # Reports the outcome of a request sent after acquire()
+    # latency is in seconds, status is None when no response arrived
+    # and retry_after is the parsed Retry-After header, if any
+    #----------------------------------------------------------------
+    def release(self, latency=0.0, status=None, retry_after=None):
+        with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self.latency_total += latency
+
+            if status in throttle_statuses or retry_after:
+                self.throttled += 1
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+                # A burst of throttled responses only counts once
+                if now - self.last_decrease >= self.cooldown:
+                    self.last_decrease = now
+                    self.decreases += 1
+                    self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+                    self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                    self.tokens = min(self.tokens, 1.0)
+            elif status is None:
+                self.errors += 1
+            elif latency <= self.latency_target:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self.rate = min(self.max_rate, self.rate + self.rate_step)
+
+            self._condition.notify_all()
+
+    #----------------------------------------------------------------
+    # Returns the current limits and counters
+    #----------------------------------------------------------------
+    def stats(self):
+        with self._condition:
+            return {
+                'rate': round(self.rate, 2),
+                'concurrency': int(self.limit),
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'errors': self.errors,
+                'decreases': self.decreases,
+                'waited': round(self.waited, 3),
+                'average_latency': round(self.latency_total / self.requests, 3) if self.requests else None,
+                'blocked_for': round(max(0.0, self.blocked_until - time.monotonic()), 3),
+            }
+
+    def __str__(self):
+        stats = self.stats()
+        return (f'Limiter: {stats["rate"]} req/s, {stats["concurrency"]} concurrent, {stats["requests"]} requests, '
+                f'{stats["throttled"]} throttled, {stats["waited"]}s waited')
+
+# Shared by every SkylightClient unless one is given its own
+shared_limiter = AdaptiveLimiter()
@@ -0,0 +1,134 @@
+###############################################################################################
+# Description:	Per-stage timings and counters for an extraction.
+# 		Stages (login, frames, fetch, parse, ics_build, serialize, write)
+# 		are timed with "with metrics.stage('fetch'):" and counters (bytes
+# 		received, events, retries, ...) are bumped with metrics.add().
+# 		The results can be written out as JSON or Prometheus text.
+#
+# 		Metrics are off by default. While off, stage() hands back one shared
+# 		object that does nothing and add() returns straight away, so the
+# 		instrumented code costs next to nothing in production.
+###############################################################################################
+import json
+import time
+import threading
+
+# Prefix of every Prometheus metric name
+prometheus_prefix = 'skylight'
+
+# Returned by stage() while metrics are off
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_timer = _NullTimer()
+
+# Times one pass through a stage
+class _StageTimer:
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+#----------------------------------------------------------------
+# Class holding the timings and counters
+# Stage times from several threads add up, so a stage can report
+# more seconds than the wall time of the run.
+#----------------------------------------------------------------
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}        # name: [calls, seconds, max seconds]
+            self.counters = {}
+            self.started = time.time()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    # Returns a context manager timing the stage
+    def stage(self, name):
+        if not self.enabled:
+            return _null_timer
+        return _StageTimer(self, name)
+
+    # Records one pass of seconds through a stage
+    def observe(self, name, seconds):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [1, seconds, seconds]
+            else:
+                stage[0] += 1
+                stage[1] += seconds
+                if seconds > stage[2]:
+                    stage[2] = seconds
+
+    # Adds value to a counter
+    def add(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    #----------------------------------------------------------------
+    # Returns everything collected as a dictionary
+    #----------------------------------------------------------------
+    def snapshot(self):
+        with self._lock:
+            return {
+                'elapsed': time.time() - self.started,
+                'stages': {name: {'calls': calls, 'seconds': seconds, 'max_seconds': longest}
+                           for name, (calls, seconds, longest) in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4)
+
+    #----------------------------------------------------------------
+    # Returns everything collected in the Prometheus text format
+    #----------------------------------------------------------------
+    def to_prometheus(self, prefix=prometheus_prefix):
+        snapshot = self.snapshot()
+        lines = [
+            f'# HELP {prefix}_stage_seconds_total Seconds spent in each stage',
+            f'# TYPE {prefix}_stage_seconds_total counter',
+        ]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}' for name, stage in snapshot['stages'].items()]
+        lines += [f'# HELP {prefix}_stage_calls_total Passes through each stage', f'# TYPE {prefix}_stage_calls_total counter']
+        lines += [f'{prefix}_stage_calls_total{{stage="{name}"}} {stage["calls"]}' for name, stage in snapshot['stages'].items()]
+        lines += [f'# HELP {prefix}_stage_max_seconds Longest single pass through each stage', f'# TYPE {prefix}_stage_max_seconds gauge']
+        lines += [f'{prefix}_stage_max_seconds{{stage="{name}"}} {stage["max_seconds"]:.6f}' for name, stage in snapshot['stages'].items()]
+        for name, value in snapshot['counters'].items():
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        lines.append(f'# TYPE {prefix}_elapsed_seconds gauge')
+        lines.append(f'{prefix}_elapsed_seconds {snapshot["elapsed"]:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    # Writes the metrics to path, as Prometheus text for .prom files and JSON otherwise
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+# Shared by every module of the extractor
+metrics = Metrics()
@@ -0,0 +1,262 @@
+###############################################################################################
+# Description:	Expands recurring events into their occurrences within a window.
+# 		Each recurring EventInfo (rrule, starts_at, time_zone, UNTIL) is a
+# 		series. A series is expanded in its own time zone, so a weekly 6pm
+# 		event stays at 6pm local time across daylight saving changes, and
+# 		the occurrence starts are cached as epoch milliseconds.
+#
+# 		The cache only grows as far as queries have asked for (a chunk at a
+# 		time for never ending rules), and every query just clips the cached
+# 		array with two binary searches, so asking for large windows over the
+# 		same series again and again is cheap.
+#
+# 		Rules that simply repeat every n days or weeks in a zone without
+# 		daylight saving skip dateutil altogether: their occurrences are an
+# 		arithmetic sequence and are generated straight into an array.
+###############################################################################################
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from dateutil.rrule import rrulestr
+
+from skylight_scrape import get_zoneinfo, timestamp_to_epoch_ms, missing_timestamp
+from skylight_index import to_epoch_ms, day_ms
+
+week_ms = 7 * day_ms
+
+# How far a never ending rule is expanded past the end of a query
+default_chunk_days = 366
+
+# Series kept in the cache before the least recently used is dropped
+default_max_series = 4096
+
+# How far ahead a never ending rule must keep its UTC offset to use the fast path
+fixed_offset_years = 50
+
+# Parts of a rule the arithmetic fast path understands
+_simple_parts = {'FREQ', 'INTERVAL', 'UNTIL', 'COUNT', 'WKST', 'BYDAY'}
+_weekdays = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+#----------------------------------------------------------------
+# Normalises the RRULE strings the API sends
+# The API wraps the rule in a list and sometimes gives UNTIL as a
+# bare date or without a Z, which dateutil refuses alongside a
+# time zone aware start. Both are taken as UTC (a bare date as
+# the end of that day).
+#----------------------------------------------------------------
+def normalize_rrule(rrule):
+    if isinstance(rrule, (list, tuple)):
+        rrule = rrule[0] if rrule else None
+    if not rrule:
+        return None
+    rule = rrule[6:] if rrule.upper().startswith('RRULE:') else rrule
+    parts = []
+    for part in rule.split(';'):
+        if not part:
+            continue
+        name, _, value = part.partition('=')
+        if name.upper() == 'UNTIL':
+            if len(value) == 8:
+                value += 'T235959Z'
+            elif not value.endswith('Z'):
+                value += 'Z'
+        parts.append(f'{name.upper()}={value}')
+    return ';'.join(parts)
+
+# Returns the rule's parts as a dictionary
+def _rule_parts(rule):
+    return dict(part.split('=', 1) for part in rule.split(';'))
+
+# Checks whether a zone keeps the same UTC offset between start and end
+# Sampled monthly, which is enough to catch any daylight saving change
+def _fixed_offset(zone, start, end):
+    if zone is None:
+        return True
+    offset = start.astimezone(zone).utcoffset()
+    moment = start
+    while moment < end:
+        moment += timedelta(days=30)
+        if moment.astimezone(zone).utcoffset() != offset:
+            return False
+    return end.astimezone(zone).utcoffset() == offset
+
+#----------------------------------------------------------------
+# Class holding one expanded series
+#----------------------------------------------------------------
+class Series:
+    def __init__(self, rule, start_ms, duration_ms, zone):
+        self.rule = rule
+        self.start_ms = start_ms
+        self.duration_ms = duration_ms
+        self.zone = zone
+        self.parts = _rule_parts(rule)
+
+        # Occurrence starts found so far and how far they are complete
+        self.starts = array('q')
+        self.horizon = start_ms
+        self.exhausted = False
+
+        self.step_ms = None
+        self.until_ms = None
+        self.count = int(self.parts['COUNT']) if 'COUNT' in self.parts else None
+        if 'UNTIL' in self.parts:
+            until = datetime.strptime(self.parts['UNTIL'], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            self.until_ms = int(until.timestamp() * 1000)
+        self._rrule = None
+
+    # Returns the dateutil rule, built the first time it is needed
+    def rrule(self):
+        if self._rrule is None:
+            dtstart = datetime.fromtimestamp(self.start_ms / 1000, tz=self.zone or timezone.utc)
+            self._rrule = rrulestr(f'RRULE:{self.rule}', dtstart=dtstart)
+        return self._rrule
+
+    # Returns the step of the arithmetic fast path, or None if the rule needs dateutil
+    # Worked out once per series, 0 is kept for "not possible"
+    def arithmetic_step(self):
+        if self.step_ms is None:
+            self.step_ms = self._arithmetic_step() or 0
+        return self.step_ms or None
+
+    def _arithmetic_step(self):
+        if not set(self.parts) <= _simple_parts or self.parts.get('FREQ') not in ('DAILY', 'WEEKLY'):
+            return None
+        interval = int(self.parts.get('INTERVAL', 1))
+        start = datetime.fromtimestamp(self.start_ms / 1000, tz=timezone.utc)
+        if self.parts['FREQ'] == 'WEEKLY':
+            # Only a rule that repeats on the weekday it starts on is a plain step
+            byday = self.parts.get('BYDAY')
+            local_start = start.astimezone(self.zone) if self.zone else start
+            if byday and byday != _weekdays[local_start.weekday()]:
+                return None
+            step = interval * week_ms
+        else:
+            if 'BYDAY' in self.parts:
+                return None
+            step = interval * day_ms
+        # The offset has to hold for as long as the series can run
+        last = self.until_ms if self.until_ms is not None else self.start_ms + fixed_offset_years * 365 * day_ms
+        if not _fixed_offset(self.zone, start, datetime.fromtimestamp(max(last, self.start_ms) / 1000, tz=timezone.utc)):
+            return None
+        return step
+
+    #----------------------------------------------------------------
+    # Makes sure every occurrence starting before end_ms is cached
+    #----------------------------------------------------------------
+    def extend(self, end_ms, chunk_ms):
+        if self.exhausted or self.horizon >= end_ms:
+            return
+        target = end_ms + chunk_ms
+        rule = self.rrule()
+        after = datetime.fromtimestamp(self.horizon / 1000, tz=timezone.utc)
+        before = datetime.fromtimestamp(target / 1000, tz=timezone.utc)
+        found = rule.between(after, before, inc=True)
+        self.starts.extend(int(occurrence.timestamp() * 1000) for occurrence in found
+                           if not self.starts or occurrence.timestamp() * 1000 > self.starts[-1])
+        self.horizon = target
+        # Nothing can follow UNTIL or the last of COUNT occurrences
+        if (self.until_ms is not None and target > self.until_ms) or (self.count is not None and len(self.starts) >= self.count):
+            self.exhausted = True
+
+    #----------------------------------------------------------------
+    # Returns the starts of the occurrences overlapping [start_ms, end_ms)
+    #----------------------------------------------------------------
+    def occurrences(self, start_ms, end_ms, chunk_ms):
+        # An occurrence starting up to duration_ms before the window still overlaps it
+        lower = start_ms - self.duration_ms + 1
+        step = self.arithmetic_step()
+        if step is not None:
+            first = max(0, -(-(lower - self.start_ms) // step))
+            last = -(-(end_ms - self.start_ms) // step)
+            if self.until_ms is not None:
+                last = min(last, (self.until_ms - self.start_ms) // step + 1)
+            if self.count is not None:
+                last = min(last, self.count)
+            if last <= first:
+                return array('q')
+            return array('q', range(self.start_ms + first * step, self.start_ms + last * step, step))
+
+        self.extend(end_ms, chunk_ms)
+        return self.starts[bisect_left(self.starts, lower):bisect_left(self.starts, end_ms)]
+
+#----------------------------------------------------------------
+# Class holding the cache of expanded series
+# Events can be EventInfo objects or come from an EventTable;
+# non recurring events simply have their own start as occurrence.
+#----------------------------------------------------------------
+class RecurrenceExpander:
+    def __init__(self, chunk_days=default_chunk_days, max_series=default_max_series):
+        self.chunk_ms = chunk_days * day_ms
+        self.max_series = max_series
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the cached Series for an event, or None if it does not recur
+    def series(self, event):
+        rule = normalize_rrule(event.rrule) if event.recurring else None
+        if not rule:
+            return None
+        key = (rule, event.starts_at, event.ends_at, event.all_day, event.time_zone)
+        with self._lock:
+            series = self._series.get(key)
+            if series is not None:
+                self._series.move_to_end(key)
+                return series
+
+        start_ms = timestamp_to_epoch_ms(event.starts_at)
+        if start_ms == missing_timestamp:
+            return None
+        if event.all_day:
+            duration_ms = day_ms
+        else:
+            duration_ms = max(1, timestamp_to_epoch_ms(event.ends_at) - start_ms) if event.ends_at else 1
+        series = Series(rule, start_ms, duration_ms, get_zoneinfo(event.time_zone) if event.time_zone else None)
+
+        with self._lock:
+            series = self._series.setdefault(key, series)
+            while len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+        return series
+
+    #----------------------------------------------------------------
+    # Returns the starts (epoch milliseconds) of the occurrences of
+    # event overlapping [start, end). Bounds can be epoch milliseconds,
+    # datetimes or API timestamps.
+    #----------------------------------------------------------------
+    def occurrences(self, event, start, end):
+        start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+        series = self.series(event)
+        if series is not None:
+            with self._lock:
+                return series.occurrences(start_ms, end_ms, self.chunk_ms)
+
+        # A single event
+        event_start = timestamp_to_epoch_ms(event.starts_at)
+        if event_start == missing_timestamp:
+            return array('q')
+        event_end = event_start + day_ms if event.all_day else max(event_start + 1, timestamp_to_epoch_ms(event.ends_at))
+        return array('q', [event_start]) if event_start < end_ms and event_end > start_ms else array('q')
+
+    # Same as occurrences() but as UTC datetimes
+    def occurrence_datetimes(self, event, start, end):
+        return [datetime.fromtimestamp(value / 1000, tz=timezone.utc) for value in self.occurrences(event, start, end)]
+
+    #----------------------------------------------------------------
+    # Yields (event, occurrence starts) for every event overlapping
+    # [start, end). events can be an EventTable or a list of EventInfo
+    #----------------------------------------------------------------
+    def expand(self, events, start, end):
+        start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+        for event in events:
+            found = self.occurrences(event, start_ms, end_ms)
+            if found:
+                yield event, found
+
+    # Returns the total number of occurrences within [start, end)
+    def count(self, events, start, end):
+        return sum(len(found) for _, found in self.expand(events, start, end))
+
+    def __len__(self):
+        return len(self._series)
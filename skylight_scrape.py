@@ -9,15 +9,35 @@
 #
 # TODO:		Build this into a library
 # TODO:		Accept login information and scrape the authentication token to be used - DONE
-# TODO:		Scrape and provide an API to to create, modify, and delete all items.
+# TODO:		Scrape and provide an API to to create, modify, and delete all items. - calendar events DONE (skylight_write.py)
 #
 ###############################################################################################
+import os
 import json
+import gzip
+import hashlib
+import subprocess
+import time
+import threading
+import functools
+import math
+from array import array
+import argparse
 import requests
 import base64
 import dateutil.parser
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from icalendar import Calendar, Event, vDatetime
+from skylight_client import SkylightClient
+from skylight_limiter import shared_limiter
+from skylight_metrics import metrics
+from skylight_store import EventStore
+from skylight_stream import CalendarEventStream
+from skylight_cache import ResponseCache, cache_modes, default_ttl
+from skylight_export import export_all, export_formats, compressions, parquet_compressions
 
 #----------------------------------------------------------------
 # SET TO TRUE FOR DEBUGGING
@@ -28,12 +48,43 @@ total_event_count = 0
 # Base URL
 url = 'https://app.ourskylight.com/api'
 
+# Size of the chunks read from the response when streaming
+stream_chunk_size = 1 << 16
+
+# Where login credentials and cached tokens are looked for
+# SKYLIGHT_EMAIL / SKYLIGHT_PASSWORD in the environment take precedence over the file
+default_credentials_file = os.path.expanduser(os.environ.get('SKYLIGHT_CONFIG', '~/.skylight.json'))
+default_token_cache = os.path.expanduser(os.environ.get('SKYLIGHT_TOKEN_CACHE', '~/.skylight_token.json'))
+
+# Default number of frames to extract at the same time in "all frames" mode
+max_frame_workers = 4
+
+# Default range that we are searching
+default_after = '2020-01-01T00:00:00.000Z'
+default_before = '2026-12-31T23:59:59.000Z'
+
+# Settings used when the range is split into windows (shards)
+max_shard_workers = 4
+shard_timeout = 60      # Seconds before a single shard request is abandoned
+shard_retries = 3       # Attempts per shard before the whole fetch fails
+
+# Windows ending within this many days ago are always refetched by a sync
+sync_refresh_days = 31
+
+# Pagination of calendar_events, only used when a response says there is more
+page_param = 'page'                                 # Query parameter for numbered pages
+page_cursor_param = 'cursor'                        # Query parameter a cursor is sent back in
+page_cursor_keys = ('next_cursor', 'cursor')        # Where in meta a cursor is looked for
+max_pages_in_flight = 2                             # Pages requested ahead of the one being parsed
+
 #----------------------------------------------------------------
 # Logger Function
+# Extra arguments are %-formatted into text only when debug is on,
+# so calls on hot paths cost nothing otherwise
 #----------------------------------------------------------------
-def logger(text):
+def logger(text, *args):
     if debug:
-        print(text)
+        print(text % args if args else text)
 
 
 
@@ -84,8 +135,15 @@ class CalendarAccount:
 
 #----------------------------------------------------------------
 # Class to hold information about our observed events
+# __slots__ keeps each instance free of a per-object __dict__
 #----------------------------------------------------------------
 class EventInfo:
+    __slots__ = ('id', 'type', 'uid', 'summary', 'description', 'location', 'starts_at', 'ends_at',
+                 'all_day', 'status', 'invited_emails', 'rrule', 'owner_email', 'calendar_id',
+                 'master_event_id', 'time_zone', 'recurring', 'recurring_config', 'lat', 'lng',
+                 'source', 'kind', 'editable', 'category_id', 'category_label', 'category_color',
+                 'calendar_account_id')
+
     def __init__(self, 
         event_id, 
         event_type,
@@ -110,7 +168,10 @@ class EventInfo:
         source=None, 
         kind=None, 
         editable=None,
-        category_id=None):
+        category_id=None,
+        category_label=None,
+        category_color=None,
+        calendar_account_id=None):
 
         self.id = event_id
         self.type = event_type
@@ -135,7 +196,10 @@ class EventInfo:
         self.source = source
         self.kind = kind
         self.editable = editable
-        self.category_id = category_id  # Store only category ID
+        self.category_id = category_id
+        self.category_label = category_label            # Resolved from the included categories
+        self.category_color = category_color
+        self.calendar_account_id = calendar_account_id
 
     # Prints the contained information if called
     def __str__(self):
@@ -178,8 +242,198 @@ class EventInfo:
             info += f"\nKind: {self.kind}"
         if self.editable is not None:
             info += f"\nEditable: {self.editable}"
+        if self.category_label:
+            info += f"\nCategory: {self.category_label}"
+        if self.category_color:
+            info += f"\nCategory Color: {self.category_color}"
+        if self.calendar_account_id:
+            info += f"\nCalendar Account ID: {self.calendar_account_id}"
         return info
 
+#----------------------------------------------------------------
+# Converts an API timestamp such as "2024-04-23T18:00:00.000Z" into
+# epoch milliseconds and back. None is stored as missing_timestamp.
+#----------------------------------------------------------------
+missing_timestamp = -(1 << 63)
+
+def timestamp_to_epoch_ms(value):
+    if value is None:
+        return missing_timestamp
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+def epoch_ms_to_timestamp(value):
+    if value == missing_timestamp:
+        return None
+    dt = datetime.fromtimestamp(value // 1000, timezone.utc)
+    return f'{dt:%Y-%m-%dT%H:%M:%S}.{value % 1000:03d}Z'
+
+# Keeps a single copy of strings that repeat across events (categories, sources, time zones...)
+# Columns store the index of the string, with -1 for None
+class _StringPool:
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def add(self, value):
+        if value is None:
+            return -1
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return i
+
+    def get(self, i):
+        return None if i < 0 else self.strings[i]
+
+#----------------------------------------------------------------
+# Compact, column oriented table of events
+# Start and end times are kept as int64 epoch milliseconds, flags
+# as bytes, coordinates as doubles, and repeated strings are
+# interned in a shared pool. The remaining free text stays in lists.
+#
+# Reading it works like a list of EventInfo objects: len(), indexing
+# and iteration all hand back EventInfo objects, which are only built
+# when asked for, and slicing hands back an EventTable. The EventInfo
+# objects are read-only copies: changing one does not change the
+# table until it is stored back with table[i] = event. The arrays can also be read directly, for example
+# numpy.frombuffer(table.starts_at_ms, dtype='int64').
+#----------------------------------------------------------------
+class EventTable:
+    # Columns holding a repeated string, stored as an index into the pool
+    interned_columns = ('type', 'status', 'owner_email', 'calendar_id', 'master_event_id', 'time_zone',
+                        'source', 'kind', 'category_id', 'category_label', 'category_color', 'calendar_account_id')
+    # Columns holding True/False/None, stored as 1/0/-1
+    flag_columns = ('all_day', 'recurring', 'editable')
+    # Columns holding a coordinate, stored as a double with NaN for None
+    float_columns = ('lat', 'lng')
+    # Everything else
+    object_columns = ('id', 'uid', 'summary', 'description', 'location', 'invited_emails', 'rrule', 'recurring_config')
+
+    def __init__(self, events=()):
+        self.pool = _StringPool()
+        self.starts_at_ms = array('q')
+        self.ends_at_ms = array('q')
+        self.columns = {}
+        for name in self.interned_columns:
+            self.columns[name] = array('i')
+        for name in self.flag_columns:
+            self.columns[name] = array('b')
+        for name in self.float_columns:
+            self.columns[name] = array('d')
+        for name in self.object_columns:
+            self.columns[name] = []
+
+        for event in events:
+            self.append(event)
+
+    # Builds a table straight from the events in the JSON data
+    # resources is the index_included() of the response, if available
+    @classmethod
+    def from_json(cls, events, resources=None):
+        table = cls()
+        for event in events:
+            table.append(build_event_info(event, resources))
+        return table
+
+    # Adds an EventInfo object to the table
+    def append(self, event):
+        columns = self.columns
+        self.starts_at_ms.append(timestamp_to_epoch_ms(event.starts_at))
+        self.ends_at_ms.append(timestamp_to_epoch_ms(event.ends_at))
+        for name in self.interned_columns:
+            columns[name].append(self.pool.add(getattr(event, name)))
+        for name in self.flag_columns:
+            value = getattr(event, name)
+            columns[name].append(-1 if value is None else int(bool(value)))
+        for name in self.float_columns:
+            value = getattr(event, name)
+            columns[name].append(math.nan if value is None else float(value))
+        for name in self.object_columns:
+            columns[name].append(getattr(event, name))
+
+    # Stores an EventInfo object at position i, replacing the event there
+    def __setitem__(self, i, event):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('EventTable index out of range')
+        columns = self.columns
+        self.starts_at_ms[i] = timestamp_to_epoch_ms(event.starts_at)
+        self.ends_at_ms[i] = timestamp_to_epoch_ms(event.ends_at)
+        for name in self.interned_columns:
+            columns[name][i] = self.pool.add(getattr(event, name))
+        for name in self.flag_columns:
+            value = getattr(event, name)
+            columns[name][i] = -1 if value is None else int(bool(value))
+        for name in self.float_columns:
+            value = getattr(event, name)
+            columns[name][i] = math.nan if value is None else float(value)
+        for name in self.object_columns:
+            columns[name][i] = getattr(event, name)
+
+    def extend(self, events):
+        for event in events:
+            self.append(event)
+
+    def __len__(self):
+        return len(self.starts_at_ms)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # Rebuilds the EventInfo object at position i, or returns the events of a slice as an EventTable
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            # The pool only ever grows, so the slice can share it
+            table = type(self)()
+            table.pool = self.pool
+            table.starts_at_ms = self.starts_at_ms[i]
+            table.ends_at_ms = self.ends_at_ms[i]
+            table.columns = {name: column[i] for name, column in self.columns.items()}
+            return table
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('EventTable index out of range')
+        columns = self.columns
+        values = {name: columns[name][i] for name in self.object_columns}
+        for name in self.interned_columns:
+            values[name] = self.pool.get(columns[name][i])
+        for name in self.flag_columns:
+            flag = columns[name][i]
+            values[name] = None if flag < 0 else bool(flag)
+        for name in self.float_columns:
+            value = columns[name][i]
+            values[name] = None if math.isnan(value) else value
+
+        return EventInfo(values['id'], values['type'], values['uid'], values['summary'], values['description'],
+                         values['location'], epoch_ms_to_timestamp(self.starts_at_ms[i]),
+                         epoch_ms_to_timestamp(self.ends_at_ms[i]), values['all_day'], values['status'],
+                         values['invited_emails'], values['rrule'], values['owner_email'], values['calendar_id'],
+                         values['master_event_id'], values['time_zone'], values['recurring'],
+                         values['recurring_config'], values['lat'], values['lng'], values['source'],
+                         values['kind'], values['editable'], values['category_id'], values['category_label'],
+                         values['category_color'], values['calendar_account_id'])
+
+    # Returns a whole column decoded back into plain Python values
+    def column(self, name):
+        if name == 'starts_at':
+            return [epoch_ms_to_timestamp(value) for value in self.starts_at_ms]
+        if name == 'ends_at':
+            return [epoch_ms_to_timestamp(value) for value in self.ends_at_ms]
+        if name in self.interned_columns:
+            return [self.pool.get(value) for value in self.columns[name]]
+        if name in self.flag_columns:
+            return [None if value < 0 else bool(value) for value in self.columns[name]]
+        if name in self.float_columns:
+            return [None if math.isnan(value) else value for value in self.columns[name]]
+        return list(self.columns[name])
+
 #----------------------------------------------------------------
 # Class to hold all of our identified Frames and respective info
 #----------------------------------------------------------------
@@ -214,8 +468,57 @@ class Frame:
                 frames.append(Frame(frame_data))
             return frames
 
+#----------------------------------------------------------------
+# Reads the login credentials without prompting
+# The environment is checked first, then the JSON credentials file
+# which may contain "email" and "password"
+# Returns a dictionary with whatever was found
+#----------------------------------------------------------------
+def load_credentials(path=None):
+    credentials = {}
+    path = path or default_credentials_file
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            credentials = json.load(f)
+    if os.environ.get('SKYLIGHT_EMAIL'):
+        credentials['email'] = os.environ['SKYLIGHT_EMAIL']
+    if os.environ.get('SKYLIGHT_PASSWORD'):
+        credentials['password'] = os.environ['SKYLIGHT_PASSWORD']
+    return credentials
+
+#----------------------------------------------------------------
+# Token cache, stored as {email: {"userId": ..., "userToken": ...}}
+#----------------------------------------------------------------
+def load_cached_token(path, email):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get(email)
+    except (OSError, ValueError):
+        return None
+
+# Saves the token for this email, only readable by the current user
+def save_cached_token(path, email, userId, userToken):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[email] = {'userId': userId, 'userToken': userToken}
+
+    # Write to a temporary file created with restricted permissions, then swap it in
+    tmp_path = f'{path}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+
 # ----------------------------------------------------------------
 # Handles the Login process
+# Credentials come from the arguments, the environment or the
+# credentials file, and are only prompted for when missing.
+# A cached token is reused until the API rejects it, at which
+# point we log in again automatically.
 # ----------------------------------------------------------------
 class login():
     loggedIn = False
@@ -226,24 +529,61 @@ class login():
     authToken = ''
     frame_id = []
 
-    def __init__(self):
-        userEmail = input('Enter email:')
-        userPassword = input('Enter password:')
-        r = requests.post(f'{url}/sessions', json={
-            'email': userEmail,
-            'name':'',
-            'phone':'',
-            'password': userPassword,
-            'resettingPassword':'false',
-            'textMeTheApp':'true',
-            'agreedToMarketing':'true'
-        }).json()
-
-        self.userId = r['data']['id']
-        self.userToken = r['data']['attributes']['token']
-
+    def __init__(self, client=None, email=None, password=None, credentials_file=None, token_cache=default_token_cache):
+        # Every request of this login goes through one pooled client
+        self.client = client or SkylightClient(url)
+        self.client.reauthenticate = self.refresh
+        self.token_cache = token_cache
+        self._lock = threading.Lock()
+
+        credentials = load_credentials(credentials_file)
+        self.userEmail = email or credentials.get('email') or input('Enter email:')
+        self.client.account = self.userEmail
+        self.userPassword = password or credentials.get('password') or ''
+
+        cached = load_cached_token(token_cache, self.userEmail) if token_cache else None
+        if cached:
+            logger('Using cached token')
+            self.setToken(cached['userId'], cached['userToken'])
+        else:
+            self.refresh()
+
+    # Logs in with our credentials to obtain a new User ID and User Token
+    # stale is the Authorization header that was rejected; if another thread
+    # has already replaced it there is nothing left to do
+    def refresh(self, stale=None):
+        with self._lock:
+            if stale is not None and self.client.session.headers.get('Authorization') != stale:
+                return
+
+            if not self.userPassword:
+                self.userPassword = input('Enter password:')
+            with metrics.stage('login'):
+                r = self.client.post('/sessions', auth_retry=False, json={
+                    'email': self.userEmail,
+                    'name':'',
+                    'phone':'',
+                    'password': self.userPassword,
+                    'resettingPassword':'false',
+                    'textMeTheApp':'true',
+                    'agreedToMarketing':'true'
+                })
+                r.raise_for_status()
+                r = r.json()
+                #logger(r)
+
+                self.setToken(r['data']['id'], r['data']['attributes']['token'])
+                if self.token_cache:
+                    save_cached_token(self.token_cache, self.userEmail, self.userId, self.userToken)
+
+    # Stores the User ID and User Token, then computes the Auth Token once
+    # and attaches it to every request made through our client
+    def setToken(self, userId, userToken):
+        self.userId = userId
+        self.userToken = userToken
+        self.authToken = base64.b64encode(f'{userId}:{userToken}'.encode())
+        self.client.session.headers['Authorization'] = f'Basic {self.authToken.decode()}'
         self.loggedIn = True
-        #logger(r)
 
     def __str__(self):
         info = 'Login Info: '
@@ -267,7 +607,7 @@ class login():
     def getId(self):
         if self.loggedIn:
             
-            logger(f'UserID: {self.userId}')
+            logger('UserID: %s', self.userId)
             return(self.userId)
         else:
             return 'NOT_LOGGED_IN'
@@ -275,19 +615,17 @@ class login():
     # Verifies that we have a token and returns it
     def getToken(self):
         if self.userToken:
-            logger(f'UserToken: {self.userToken}')
+            logger('UserToken: %s', self.userToken)
             return(self.userToken)
         else:
             return 'NOT_LOGGED_IN'
         #if self.loggedIn:
 
-    # Verifies that we have a User ID and User Token then produces an Auth Token
+    # Verifies that we have a User ID and User Token then returns the Auth Token
+    # The Auth Token is only computed once per login, in setToken
     def getAuthToken(self):
         if self.userId != 0 and self.userToken != '':
-            preAuthString = self.userId + ':' + self.userToken
-            self.authToken = base64.b64encode(preAuthString.encode())
-
-            logger(f'Auth token: {self.authToken}')
+            logger('Auth token: %s', self.authToken)
             return self.authToken
         else:
             return 'MISSING_ITEM'
@@ -296,11 +634,8 @@ class login():
     def getFrameInfo(self):
         all_info = []
 
-        # Obtain the JSON data
-        data = requests.get(
-            f'{url}/frames?show_deleted=true&', 
-            headers={'Authorization': f'Basic {self.getAuthToken().decode()}'}    
-        ).json()
+        # Obtain the JSON data (shared with getFrameId)
+        data = self.client.get_frames()
 
         for calendar_data in data['data']:
             # Extract frame information
@@ -329,123 +664,1153 @@ class login():
         return all_info
 
     # Obtains our available frame ID's
-    # TODO: Extract and store this while initially getting Frame info to prevent multiple calls
+    # The /frames response is only requested once and shared with getFrameInfo
     def getFrameId(self):
-        
 
         # Obtain the JSON data
-        data = requests.get(
-            f'{url}/frames?show_deleted=true&', 
-            headers={'Authorization': f'Basic {self.getAuthToken().decode()}'}    
-        ).json()
+        data = self.client.get_frames()
 
+        self.frame_id = []
         for frame_data in data['data']:
             # Build a list of ID's for available frames
             self.frame_id.append(frame_data['id'])
 
         return self.frame_id
 
+#----------------------------------------------------------------
+# Builds a Category object from an included item
+#----------------------------------------------------------------
+def build_category(item):
+    attributes = item['attributes']
+    return Category(item['id'], attributes['label'], attributes.get('color'),
+                    attributes.get('selected_for_chore_chart'), attributes.get('profile_pic_url'))
+
+#----------------------------------------------------------------
+# Builds a CalendarAccount object from an included item
+#----------------------------------------------------------------
+def build_calendar_account(item):
+    attributes = item['attributes']
+    return CalendarAccount(item['id'], attributes['email'], attributes['active_calendars'], attributes['provider'])
+
+# How each type of included item is turned into an object
+included_builders = {
+    'category': build_category,
+    'calendar_account': build_calendar_account,
+}
+
+#----------------------------------------------------------------
+# Indexes the included JSON data in a single pass
+# Returns a dictionary keyed by (type, id). Categories and Calendar
+# Accounts are stored as their objects, anything else as is, so
+# relationships can be resolved with a dictionary lookup.
+#----------------------------------------------------------------
+def index_included(included_data):
+    resources = {}
+    for item in included_data:
+        builder = included_builders.get(item['type'])
+        resources[(item['type'], item['id'])] = builder(item) if builder else item
+    return resources
+
+#----------------------------------------------------------------
+# Extracts the categories from the included JSON data
+# Accepts the included list or an index_included() dictionary
+# Returns a list of Category objects
+#----------------------------------------------------------------
+def extract_categories(included_data):
+    if not isinstance(included_data, dict):
+        included_data = index_included(included_data)
+    return [resource for (item_type, _), resource in included_data.items() if item_type == 'category']
+
+#----------------------------------------------------------------
+# Extracts the calendar accounts from the included JSON data
+# This may be accounts specific to the user logged in?
+# I have not observed other active calendars from family memebers
+# Accepts the included list or an index_included() dictionary
+# Returns a list of CalendarAccount objects
+#----------------------------------------------------------------
+def extract_calendar_accounts(included_data):
+    if not isinstance(included_data, dict):
+        included_data = index_included(included_data)
+    return [resource for (item_type, _), resource in included_data.items() if item_type == 'calendar_account']
+
+# Returns the id an event's relationship points to, or None
+def relationship_id(event, name):
+    relationship = event.get('relationships', {}).get(name)
+    if relationship and relationship.get('data'):
+        return relationship['data']['id']
+    return None
+
+#----------------------------------------------------------------
+# Builds an EventInfo object from a single event in the JSON data
+# If the index_included() of the response is provided, the category
+# and calendar account relationships are resolved against it
+#----------------------------------------------------------------
+def build_event_info(event, resources=None):
+
+    # Store all attributes to be moved into a class
+    event_id = event['id']
+    event_type = event['type']                                      # Example: "calendar_event"
+    uid = event['attributes'].get('uid')                            # Example: "from-app-d7a81571fe0e5983a4f8a76d9bbbb7e0-after-1707091200"
+    summary = event['attributes'].get('summary')                    # Example: "Free Lunch at Work"
+    description = event['attributes'].get('description')            # I have not observed a value here yet
+    location = event['attributes'].get('location')                  # A full address
+    starts_at = event['attributes'].get('starts_at')                # Example: "2024-04-23T18:00:00.000Z"
+    ends_at = event['attributes'].get('ends_at')                    # Example: "2024-04-23T19:00:00.000Z"
+    all_day = event['attributes'].get('all_day')                    # True or False
+    invited_emails = event['attributes'].get('invited_emails')      # List, I have not observed any emails here yet
+    status = event['attributes'].get('status')                      # Example: "approved"
+    rrule = event['attributes'].get('rrule')                        # Example: "RRULE:FREQ=WEEKLY;WKST=SU;INTERVAL=1;BYDAY=TU" or "RRULE:FREQ=YEARLY"
+    owner_email = event['attributes'].get('owner_email')            # Email of creator
+    calendar_id = event['attributes'].get('calendar_id')            # I have not value here yet
+    master_event_id = event['attributes'].get('master_event_id')    # I have not value here yet
+    time_zone = event['attributes'].get('timezone')                 # Example: "America/New_York"
+    recurring = event['attributes'].get('recurring')                # True or False
+    recurring_config = event['attributes'].get('recurring_config')  # True or False
+    lat = event['attributes'].get('lat')                            # I have not observed a value here yet
+    lng = event['attributes'].get('lng')                            # I have not observed a value here yet
+    source = event['attributes'].get('source')                      # Example: "skylight" or "ics_link" or "google"
+    kind = event['attributes'].get('kind')                          # Example: "standard"
+    editable = event['attributes'].get('editable')                  # True, I have not observed False yet
+
+    # Extract relationship IDs (if they exist)
+    category_id = relationship_id(event, 'category')
+    calendar_account_id = relationship_id(event, 'calendar_account')
+
+    # Resolve the category
+    category_label = None
+    category_color = None
+    if resources and category_id is not None:
+        category = resources.get(('category', category_id))
+        if category:
+            category_label = category.label
+            category_color = category.color
+
+    # Create Event object
+    return EventInfo(event_id, event_type, uid, summary, description, location, starts_at, ends_at, all_day, status, invited_emails, rrule, owner_email, calendar_id, master_event_id, time_zone, recurring, recurring_config, lat, lng, source, kind, editable, category_id, category_label, category_color, calendar_account_id)
+
+#------------------------------------------------------------------
+# Parses an API timestamp such as "2024-04-23T18:00:00.000Z"
+# The fractional seconds and zone are dropped (we assume UTC).
+# fromisoformat is used for the common layout as it is much faster
+# than strptime, anything else goes through the original strptime.
+#------------------------------------------------------------------
+def parse_timestamp(value):
+    if len(value) >= 19 and value[19:20] in ('.', ''):
+        return datetime.fromisoformat(value[:19])
+    return datetime.strptime(value.split('.')[0], '%Y-%m-%dT%H:%M:%S')
+
+#------------------------------------------------------------------
+# Converts an RRULE string into the dictionary handed to icalendar
+# Recurring series repeat the same RRULE for every instance, so the
+# result is cached by the RRULE string. Callers must copy it before
+# changing it.
+#------------------------------------------------------------------
+@functools.lru_cache(maxsize=4096)
+def parse_rrule(rrule_str):
+    logger('Original RRULE: %s', rrule_str)
+
+    # Try parsing UNTIL date (assuming YYYYMMDD format)
+    try:
+        until_date = dateutil.parser.parse(rrule_str.split("UNTIL=")[1][:8])
+        # Convert parsed date to datetime object
+        until_datetime = until_date.astimezone()  # Assuming local timezone
+    except (IndexError, ValueError):
+        # No UNTIL= found or invalid date format, keep original format
+        until_datetime = None
+
+    # Update RRULE UNTIL date with the correct ISO8601 format (if valid)
+    if until_datetime:
+        rrule_str = rrule_str.replace(f"UNTIL={rrule_str.split('UNTIL=')[1]}", f"UNTIL={until_datetime.isoformat()}")
+
+    # Split and convert remaining date strings (if any)
+    rrule_formatted = rrule_str.split(';')
+    rrule_dict = dict(item.split('=', 1) for item in rrule_formatted)
+    logger('Modified RRULE: %s', rrule_str)
+    logger('RRULE dictionary: %s', rrule_dict)
+
+    # Add UNTIL as datetime to the dictionary (if valid)
+    if until_datetime:
+        rrule_dict['UNTIL'] = until_datetime
+
+    return rrule_dict
+
+#------------------------------------------------------------------
+# Returns the ZoneInfo for a time zone name such as "America/New_York"
+# Every event of a calendar tends to share a handful of zones, so
+# they are cached by name. Returns None for unknown names.
+#------------------------------------------------------------------
+@functools.lru_cache(maxsize=None)
+def get_zoneinfo(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
 #------------------------------------------------------------------
 # Handles parsing a calendar event form the provided JSON data
+# The created and last-modified stamps come from the API's
+# created_at / updated_at when it sends them, otherwise from now;
+# callers generating a whole calendar pass now in so it is only
+# read once.
+# If the index_included() of the response is provided, the event's
+# category is added as CATEGORIES and COLOR.
 # Returns an iCalendar Event object.
 #------------------------------------------------------------------
-def parse_event(event_data):
+def parse_event(event_data, now=None, resources=None):
+    if now is None:
+        now = datetime.now()
+    created, modified = source_stamps(event_data['attributes'])
+
+    event = build_event(event_data, resources)
+    event.add('created', vDatetime(created or now))
+    event.add('last-modified', vDatetime(modified or now))
+    return event
 
-    event = Event()
-    event.add('summary', event_data['attributes']['summary'])
-    event.add('uid', event_data['attributes']['uid'])
+#------------------------------------------------------------------
+# Builds the iCalendar Event of parse_event without the created
+# and last-modified stamps, which is all the content of the event
+#------------------------------------------------------------------
+def build_event(event_data, resources=None):
+    attributes = event_data['attributes']
 
-    # Extract date/time parts for parsing
-    dtstart_str = event_data['attributes']['starts_at'].split('.')[0]
-    dtend_str = event_data['attributes']['ends_at'].split('.')[0]
+    event = Event()
+    event.add('summary', attributes['summary'])
+    event.add('uid', attributes['uid'])
 
-    # Parse date/time strings using datetime
-    dtstart = datetime.strptime(dtstart_str, '%Y-%m-%dT%H:%M:%S')
+    # Parse date/time strings
+    dtstart = parse_timestamp(attributes['starts_at'])
     event.add('dtstart', vDatetime(dtstart))
-    
-    if event_data['attributes']['all_day']:
+
+    if attributes['all_day']:
         event.add('dtend', vDatetime(dtstart + timedelta(days=1)))
     else:
-        dtend = datetime.strptime(dtend_str, '%Y-%m-%dT%H:%M:%S')
-        event.add('dtend', vDatetime(dtend))
+        event.add('dtend', vDatetime(parse_timestamp(attributes['ends_at'])))
 
     # Add location (if available)
-    if event_data['attributes'].get('location'):
-        event.add('location', event_data['attributes']['location'])
+    if attributes.get('location'):
+        event.add('location', attributes['location'])
 
     # Add time zone (already assumed UTC for 'starts_at' and 'ends_at')
-    if event_data['attributes'].get('timezone'):
-        event.add('tzid', event_data['attributes']['timezone'])
-    
+    if attributes.get('timezone'):
+        event.add('tzid', attributes['timezone'])
+
     # Add recurrence rule (if available)
-    # TODO: Maybe clean this up? 
-    if event_data['attributes'].get('recurring'):
-        rrule_str = event_data['attributes']['rrule'][0]
-        logger(f"Original RRULE: {rrule_str}")
+    if attributes.get('recurring'):
+        event.add('rrule', dict(parse_rrule(attributes['rrule'][0])))
 
-        # Try parsing UNTIL date (assuming YYYYMMDD format)
-        try:
-            until_date = dateutil.parser.parse(rrule_str.split("UNTIL=")[1][:8])
-            # Convert parsed date to datetime object
-            until_datetime = until_date.astimezone()  # Assuming local timezone
-        except (IndexError, ValueError):
-            # No UNTIL= found or invalid date format, keep original format
-            until_datetime = None
-            pass
-
-        # Update RRULE UNTIL date with the correct ISO8601 format (if valid)
-        if until_datetime:
-            rrule_str = rrule_str.replace(f"UNTIL={rrule_str.split('UNTIL=')[1]}", f"UNTIL={until_datetime.isoformat()}")
-
-        # Split and convert remaining date strings (if any)
-        rrule_formatted = rrule_str.split(';')
-        rrule_dict = dict(item.split('=', 1) for item in rrule_formatted)
-        logger(f"Modified RRULE: {rrule_str}")
-        logger(f"RRULE dictionary: {rrule_dict}")
-
-        # Add UNTIL as datetime to the dictionary (if valid)
-        if until_datetime:
-            rrule_dict['UNTIL'] = until_datetime
-
-        event.add('rrule', rrule_dict)
+    # Add the category (if it can be resolved)
+    if resources:
+        category = resources.get(('category', relationship_id(event_data, 'category')))
+        if category:
+            event.add('categories', [category.label])
+            if category.color:
+                event.add('color', category.color)
 
     # Add other relevant properties (you can add more based on your needs)
-    event.add('description', event_data['attributes'].get('description', ''))
-    event.add('created', vDatetime(datetime.now()))
-    event.add('last-modified', vDatetime(datetime.now()))
-    
+    event.add('description', attributes.get('description', ''))
+
     return event
 
+# Parses a timestamp of the API as a UTC datetime
+def _utc_timestamp(value):
+    return parse_timestamp(value).replace(tzinfo=timezone.utc)
+
+# Returns the created and last-modified stamps the API gave an event (None where it gave none)
+def source_stamps(attributes):
+    created = attributes.get('created_at')
+    modified = attributes.get('updated_at')
+    return (_utc_timestamp(created) if created else None, _utc_timestamp(modified) if modified else None)
+
+#----------------------------------------------------------------
+# Creates the Calendar object that wraps our events
+#----------------------------------------------------------------
+def new_calendar():
+    cal = Calendar()
+    cal.add('prodid', '-//skylight-extractor//www.icalendar.com//')
+    cal.add('version', '1.0')
+    return cal
+
+# The bytes written after the last event of a calendar
+calendar_footer = b'END:VCALENDAR\r\n'
+
+# Returns the bytes written before the first event of a calendar
+def calendar_header():
+    return new_calendar().to_ical()[:-len(calendar_footer)]
+
+#----------------------------------------------------------------
+# Writes the events straight to a .ics file (or an open binary stream)
+# The VCALENDAR header is written first, then each VEVENT as soon as
+# parse_event produces it, then the footer. Nothing but the current
+# event is held in memory and the bytes are identical to
+# generate_icalendar(...).to_ical().
+# If compress is set the output is gzipped (with a fixed timestamp so
+# the same events always produce the same file).
+# resources is the index_included() of the response, if available
+# Returns the number of events written
+#----------------------------------------------------------------
+def write_icalendar_stream(events, output, compress=False, now=None, resources=None):
+    if now is None:
+        now = datetime.now()
+
+    raw = open(output, 'wb') if isinstance(output, (str, os.PathLike)) else output
+    f = gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) if compress else raw
+
+    count = 0
+    try:
+        f.write(calendar_header())
+        if metrics.enabled:
+            # The same loop, with each step timed on its own
+            for event_data in events:
+                with metrics.stage('ics_build'):
+                    event = parse_event(event_data, now, resources)
+                with metrics.stage('serialize'):
+                    ical = event.to_ical()
+                with metrics.stage('write'):
+                    f.write(ical)
+                metrics.add('ics_bytes', len(ical))
+                count += 1
+            metrics.add('events_written', count)
+        else:
+            for event_data in events:
+                f.write(parse_event(event_data, now, resources).to_ical())
+                count += 1
+        f.write(calendar_footer)
+    finally:
+        if f is not raw:
+            f.close()
+        if raw is not output:
+            raw.close()
+    return count
+
+# Appended to a .ics path for the file remembering what was written to it
+ics_state_suffix = '.state.json'
+
+# Events per chunk handed to an ICS worker process
+ics_chunk_size = 2000
+
+# Returns the key identifying an event from one run to the next
+def event_key(event_data):
+    return str(event_data.get('id') or event_data['attributes']['uid'])
+
+# Returns the key the events of a deterministic calendar are sorted by
+def event_sort_key(event_data):
+    attributes = event_data['attributes']
+    return (timestamp_to_epoch_ms(attributes.get('starts_at')), attributes.get('uid') or '', event_key(event_data))
+
+# The attributes build_event writes an event from, which its content hash covers
+digest_attributes = ('uid', 'summary', 'description', 'location', 'starts_at', 'ends_at', 'all_day', 'timezone',
+                     'recurring', 'rrule', 'created_at', 'updated_at')
+
+# Raise when build_event changes what it writes, so every calendar is written again
+ics_format_version = 1
+
+#----------------------------------------------------------------
+# Returns the content hash of an event
+# Covers the attributes it is written from and its resolved
+# category, but not stamps made up locally, so it only changes
+# when the event itself does. The event is not built for this.
+#----------------------------------------------------------------
+def event_digest(event_data, resources=None):
+    attributes = event_data['attributes']
+    content = [attributes.get(name) for name in digest_attributes]
+    category = resources.get(('category', relationship_id(event_data, 'category'))) if resources else None
+    content += [category.label, category.color] if category else [None, None]
+    encoded = json.dumps(content, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest()
+
+# Returns the state saved next to a .ics, or an empty one
+def load_ics_state(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Returns the event of build_event with its stamps and content hash
+def stamped_event(event_data, created, modified, digest, resources=None):
+    event = build_event(event_data, resources)
+    event.add('created', vDatetime(created))
+    event.add('last-modified', vDatetime(modified))
+    event.add('x-skylight-hash', digest)
+    return event
+
+# The resources of the response being written, set once in every ICS worker process
+_worker_resources = None
+
+def _init_ics_worker(resources):
+    global _worker_resources
+    _worker_resources = resources
+
+# Hashes a chunk of events in a worker process
+def _digest_chunk(events):
+    return [event_digest(event_data, _worker_resources) for event_data in events]
+
+# Builds and serializes a chunk of (event_data, created, modified, digest) in a worker process
+def _serialize_chunk(items):
+    return b''.join(stamped_event(*item, _worker_resources).to_ical() for item in items)
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+#----------------------------------------------------------------
+# Writes the events to a .ics file that only depends on the events
+#
+# Events are written sorted by start, UID and ID, each carrying its
+# content hash as X-SKYLIGHT-HASH. CREATED and LAST-MODIFIED come
+# from the API when it sends them; otherwise they are remembered
+# in a state file next to the output (output + ics_state_suffix):
+# CREATED is when the event was first written and LAST-MODIFIED
+# when its hash last changed.
+#
+# The state also holds the hash of the whole calendar. If it still
+# matches and the file exists, the file is left untouched; else it
+# is written to a temporary file and swapped in.
+#
+# With workers > 1, calendars of more than chunk_size events are
+# hashed, built and serialized in chunks by a pool of processes and
+# the pieces written in order, so the file is byte for byte the
+# same as when written by a single process.
+#
+# events has to be a list (it is read twice), output a path.
+# Returns (number of events, whether the file was written)
+#----------------------------------------------------------------
+def write_icalendar_deterministic(events, output, compress=False, resources=None, state_path=None, now=None,
+                                  workers=1, chunk_size=ics_chunk_size):
+    if state_path is None:
+        state_path = f'{output}{ics_state_suffix}'
+
+    pool = None
+    if workers > 1 and len(events) > chunk_size:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_ics_worker, initargs=(resources,))
+    try:
+        # First pass: the content hash of every event, in output order
+        with metrics.stage('ics_hash'):
+            if pool:
+                digests = [digest for chunk in pool.map(_digest_chunk, _chunks(events, chunk_size)) for digest in chunk]
+            else:
+                digests = [event_digest(event_data, resources) for event_data in events]
+            entries = sorted((event_sort_key(event_data), digests[index], index, event_key(event_data))
+                             for index, event_data in enumerate(events))
+            calendar_digest = hashlib.blake2b(calendar_header(), digest_size=16)
+            calendar_digest.update(f'{ics_format_version}\n'.encode())
+            for _, digest, _, key in entries:
+                calendar_digest.update(f'{key}:{digest}\n'.encode())
+            calendar_digest = calendar_digest.hexdigest()
+
+        state = load_ics_state(state_path)
+        if state.get('hash') == calendar_digest and os.path.exists(output):
+            metrics.add('ics_unchanged')
+            return len(entries), False
+
+        # The stamps of every event, in output order
+        if now is None:
+            now = datetime.now(timezone.utc).replace(microsecond=0)
+        previous = state.get('events', {})
+        stamps = {}
+        items = []
+        for _, digest, index, key in entries:
+            event_data = events[index]
+            created, modified = source_stamps(event_data['attributes'])
+            seen = previous.get(key)
+            if created is None:
+                created = datetime.fromisoformat(seen[1]) if seen else now
+            if modified is None:
+                modified = datetime.fromisoformat(seen[2]) if seen and seen[0] == digest else now
+            stamps[key] = [digest, created.isoformat(), modified.isoformat()]
+            items.append((event_data, created, modified, digest))
+
+        # Second pass: write the events with their stamps, each built once
+        temp = f'{output}.tmp'
+        written = 0
+        with open(temp, 'wb') as raw:
+            f = gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) if compress else raw
+            try:
+                f.write(calendar_header())
+                if pool:
+                    # The workers build and serialize, so the wait for them is timed as serialize
+                    pieces = pool.map(_serialize_chunk, _chunks(items, chunk_size))
+                    while True:
+                        with metrics.stage('serialize'):
+                            piece = next(pieces, None)
+                        if piece is None:
+                            break
+                        with metrics.stage('write'):
+                            f.write(piece)
+                        written += len(piece)
+                elif metrics.enabled:
+                    # The same loop, with each step timed on its own
+                    for item in items:
+                        with metrics.stage('ics_build'):
+                            event = stamped_event(*item, resources)
+                        with metrics.stage('serialize'):
+                            ical = event.to_ical()
+                        with metrics.stage('write'):
+                            f.write(ical)
+                        written += len(ical)
+                else:
+                    for item in items:
+                        f.write(stamped_event(*item, resources).to_ical())
+                f.write(calendar_footer)
+            finally:
+                if f is not raw:
+                    f.close()
+    finally:
+        if pool:
+            pool.shutdown()
+    os.replace(temp, output)
+
+    with open(f'{state_path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'hash': calendar_digest, 'events': stamps}, f, separators=(',', ':'))
+    os.replace(f'{state_path}.tmp', state_path)
+    metrics.add('ics_bytes', written)
+    metrics.add('events_written', len(entries))
+    return len(entries), True
+
+#----------------------------------------------------------------
+# Runs the --on-change command for a calendar file that was written
+# The path of the file is passed in $SKYLIGHT_ICS
+#----------------------------------------------------------------
+def run_on_change(command, path):
+    result = subprocess.run(command, shell=True, env={**os.environ, 'SKYLIGHT_ICS': path})
+    if result.returncode:
+        print(f'Warning: --on-change command exited with {result.returncode} for {path}')
+
 #----------------------------------------------------------------
 # Generates an iCalendar string from the provided JSON data
 # Returns a Calendar object containing the iCalendar data
 #----------------------------------------------------------------
 def generate_icalendar(data):
+    return generate_icalendar_from_events(data['data'], index_included(data.get('included', [])))
 
-    cal = Calendar()
-    cal.add('prodid', '-//skylight-extractor//www.icalendar.com//')
-    cal.add('version', '1.0')
+#----------------------------------------------------------------
+# Generates an iCalendar from any iterable of event JSON data,
+# such as the events of a CalendarEventStream
+# resources is the index_included() of the response, if available
+# Returns a Calendar object containing the iCalendar data
+#----------------------------------------------------------------
+def generate_icalendar_from_events(events, resources=None):
+
+    cal = new_calendar()
 
-    # Process events
-    for event_data in data['data']:
-        event = parse_event(event_data)
+    # Process events, every event is stamped with the same run time
+    now = datetime.now()
+    for event_data in events:
+        event = parse_event(event_data, now, resources)
         cal.add_component(event)
 
     return cal
 
+#----------------------------------------------------------------
+# Retrieves a single calendar_events response for a frame
+# If path is given (a PageFollower request or a "next" link) it is
+# requested with params as they are, else after and before are
+# sent along with params
+#----------------------------------------------------------------
+def fetch_calendar_events_page(AccountInfo, frame_id, after, before, timeout=None, retries=None, params=None, path=None):
+    with metrics.stage('fetch'):
+        r = AccountInfo.client.get(
+            path or f'/frames/{frame_id}/calendar_events',
+            params=params if path else {'after': after, 'before': before, **(params or {})},
+            timeout=timeout,
+            retries=retries
+        )
+        r.raise_for_status()
+        metrics.add('bytes_received', len(r.content))
+    with metrics.stage('parse'):
+        data = r.json()
+    metrics.add('events_fetched', len(data['data']))
+    return data
+
+# Turns a "next" link into a path relative to the client's base URL
+def _relative_link(client, link):
+    if link.startswith(client.base_url):
+        return link[len(client.base_url):]
+    parts = urlsplit(link)
+    base_path = urlsplit(client.base_url).path
+    path = parts.path[len(base_path):] if parts.path.startswith(base_path + '/') else parts.path
+    return f'{path}?{parts.query}' if parts.query else path
+
+# Returns the cursor of the next page if the response has one
+def _next_cursor(data):
+    meta = data.get('meta') or {}
+    for key in page_cursor_keys:
+        if meta.get(key):
+            return meta[key]
+    return None
+
+# Returns the key telling the events of a frame's pages apart
+# A hash of the ID and UID, so remembering every event streamed is cheap
+def page_key(event):
+    return hash((event['id'], event['attributes'].get('uid')))
+
+#----------------------------------------------------------------
+# Class deciding which page of a frame's calendar events to
+# request next, shared by the buffered, streamed and async fetches
+#
+# The first response decides how to continue:
+#   links.next          the link is followed
+#   meta cursor         the cursor is sent back as ?cursor=
+#   fewer events than meta.total_event_count
+#                       numbered pages (?page=2, 3, ...) are requested;
+#                       if the API turns out to ignore the page number,
+#                       the range is continued from the start of the
+#                       last event instead
+# Requests are (path, params) with params None for a "next" link.
+# Pages may repeat events; seen holds the page_key of every event
+# so far, and a page that brings nothing new ends the frame.
+#----------------------------------------------------------------
+class PageFollower:
+    def __init__(self, client, frame_id, after, before):
+        self.client = client
+        self.frame_id = frame_id
+        self.path = f'/frames/{frame_id}/calendar_events'
+        self.after = after
+        self.before = before
+        self.seen = set()
+        self.total = None
+        self.number = None          # Number of the last page while numbered pages are followed
+        self.last_number = None
+        self.link = None
+        self.cursor = None
+        self.last_start = None
+        self.done = False
+
+    def first_request(self):
+        return self.path, {'after': self.after, 'before': self.before}
+
+    # Returns the page_key of an event item
+    def key(self, event):
+        return page_key(event)
+
+    # Returns the requests of every numbered page after the first
+    def numbered_requests(self):
+        return [(self.path, {'after': self.after, 'before': self.before, page_param: number})
+                for number in range(2, self.last_number + 1)]
+
+    #----------------------------------------------------------------
+    # Takes in a page that arrived, given as its document (for the
+    # links and meta), the keys of its events in order and the start
+    # of its last event
+    # Returns whether the page counts, False when it only repeats
+    # events already seen
+    #----------------------------------------------------------------
+    def add(self, document, keys, last_start):
+        if self.total is None:
+            self.total = (document.get('meta') or {}).get('total_event_count') or 0
+            self.seen.update(keys)
+            self._follow(document, last_start)
+            if not self.link and not self.cursor:
+                if len(keys) >= self.total or not keys:
+                    self.done = True
+                else:
+                    self.number = 1
+                    self.last_number = math.ceil(self.total / len(keys))
+            return True
+
+        new = set(keys) - self.seen
+        if self.number is not None:
+            if keys and not new:
+                # The page number was ignored, continue by time from the last page instead
+                logger('Frame %s: numbered pages are not supported, paging by time', self.frame_id)
+                self.number = None
+                return False
+            self.number += 1
+        elif not new:
+            # Stop once a page brings nothing new, whatever the API claims
+            self.done = True
+            return False
+        self.seen |= new
+        self._follow(document, last_start)
+        return True
+
+    # Takes in a whole page of JSON data
+    def add_page(self, page):
+        return self.add(page, [self.key(event) for event in page['data']], page['data'][-1]['attributes'].get('starts_at') if page['data'] else None)
+
+    def _follow(self, document, last_start):
+        self.link = (document.get('links') or {}).get('next')
+        self.cursor = _next_cursor(document)
+        self.last_start = last_start
+
+    # Returns the request for the next page, or None after the last one
+    def next_request(self):
+        if self.done:
+            return None
+        if self.link:
+            return _relative_link(self.client, self.link), None
+        if self.cursor:
+            return self.path, {'after': self.after, 'before': self.before, page_cursor_param: self.cursor}
+        if self.number is not None:
+            if self.number < self.last_number:
+                return self.path, {'after': self.after, 'before': self.before, page_param: self.number + 1}
+            return None
+        if self.last_start and len(self.seen) < self.total:
+            return self.path, {'after': self.last_start, 'before': self.before}
+        return None
+
+#----------------------------------------------------------------
+# Yields every page of calendar events for a single frame in order,
+# following them as PageFollower decides
+# Numbered pages are known up front, so up to max_in_flight of them
+# are requested at a time. Otherwise the next request is always
+# sent before the current page is handed back, so the network time
+# overlaps with whatever the caller does with the page. Pages may
+# repeat events, merge_page_data drops them.
+#----------------------------------------------------------------
+def iter_calendar_event_pages(AccountInfo, frame_id, after, before, timeout=None, retries=None, max_in_flight=max_pages_in_flight):
+    # At least the next page has to be in flight, or the rest are never requested
+    max_in_flight = max(1, max_in_flight)
+    follower = PageFollower(AccountInfo.client, frame_id, after, before)
+
+    def fetch(request):
+        path, params = request
+        return fetch_calendar_events_page(AccountInfo, frame_id, after, before, timeout, retries, params=params, path=path)
+
+    page = fetch(follower.first_request())
+    follower.add_page(page)
+
+    # Everything arrived in one response
+    if follower.next_request() is None:
+        yield page
+        return
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        yielded = False
+
+        if follower.number is not None:
+            requests = follower.numbered_requests()
+            pending = [executor.submit(fetch, request) for request in requests[:max_in_flight]]
+            queued = len(pending)
+            while pending:
+                yield page
+                next_page = pending.pop(0).result()
+                if queued < len(requests):
+                    pending.append(executor.submit(fetch, requests[queued]))
+                    queued += 1
+                if not follower.add_page(next_page):
+                    # Paging by time from here, starting after the page just handed back
+                    for future in pending:
+                        future.cancel()
+                    yielded = True
+                    break
+                page = next_page
+            else:
+                yield page
+                return
+
+        # Every further request depends on the page before it
+        while True:
+            request = follower.next_request()
+            future = executor.submit(fetch, request) if request else None
+            if not yielded:
+                yield page
+            yielded = False
+            if future is None:
+                return
+            page = future.result()
+            if not follower.add_page(page):
+                return
+
+#----------------------------------------------------------------
+# Merges the pages of a single response into one, dropping events
+# that appeared on more than one page. The meta of the first page
+# is kept as it describes the whole response.
+#----------------------------------------------------------------
+def merge_page_data(pages):
+    pages = list(pages)
+    if len(pages) == 1:
+        return pages[0]
+    merged = merge_shard_data(pages)
+    merged['meta'] = {key: value for key, value in (pages[0].get('meta') or {}).items() if key not in page_cursor_keys}
+    merged['meta'].setdefault('total_event_count', len(merged['data']))
+    return merged
+
+#----------------------------------------------------------------
+# Retrieves the calendar events JSON data for a single frame,
+# following every page if the API splits the response up
+#----------------------------------------------------------------
+def fetch_calendar_events(AccountInfo, frame_id, after, before, timeout=None, retries=None):
+    return merge_page_data(iter_calendar_event_pages(AccountInfo, frame_id, after, before, timeout, retries))
+
+#----------------------------------------------------------------
+# Streams the calendar events of a single frame
+# The response body is parsed as it arrives, so iterating over the
+# returned CalendarEventStream yields one event at a time. Further
+# pages are followed like fetch_calendar_events does, one at a time.
+# Its included and meta are available once iteration has finished.
+#----------------------------------------------------------------
+def stream_calendar_events(AccountInfo, frame_id, after, before, timeout=None):
+    def open_page(request):
+        path, params = request
+        r = AccountInfo.client.get(path, params=params, timeout=timeout, stream=True)
+        r.raise_for_status()
+        chunks = r.iter_content(chunk_size=stream_chunk_size)
+        return _count_bytes(chunks) if metrics.enabled else chunks
+
+    follower = PageFollower(AccountInfo.client, frame_id, after, before)
+    return CalendarEventStream(open_page(follower.first_request()), follower, open_page)
+
+# Passes the chunks of a response through while counting them
+def _count_bytes(chunks):
+    for chunk in chunks:
+        metrics.add('bytes_received', len(chunk))
+        yield chunk
+
+# Passes the events through while building an EventInfo for each one
+def _collect_event_info(events, all_events):
+    for event in events:
+        all_events.append(build_event_info(event))
+        yield event
+
+#----------------------------------------------------------------
+# Converts a date given by the user or the API into a UTC datetime
+# Accepts "2024-04-23", "2024-04-23T18:00:00" or "2024-04-23T18:00:00.000Z"
+#----------------------------------------------------------------
+def parse_api_datetime(value):
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+# Converts a datetime back into the format the API expects
+def format_api_datetime(dt):
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+# Returns the first boundary after dt for the provided window size
+def _next_window_boundary(dt, window):
+    if window == 'year':
+        return dt.replace(year=dt.year + 1, month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if window == 'month':
+        if dt.month == 12:
+            return dt.replace(year=dt.year + 1, month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        return dt.replace(month=dt.month + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if window == 'week':
+        return (dt + timedelta(days=7 - dt.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == 'day':
+        return (dt + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    # Otherwise a number of days
+    return dt + timedelta(days=int(window))
+
+#----------------------------------------------------------------
+# Splits the after/before range into windows
+# window can be 'year', 'month', 'week', 'day' or a number of days
+# Returns a list of (after, before) tuples formatted for the API
+#----------------------------------------------------------------
+def build_time_windows(after, before, window='month'):
+    start = parse_api_datetime(after)
+    end = parse_api_datetime(before)
+    windows = []
+    while start < end:
+        boundary = min(_next_window_boundary(start, window), end)
+        windows.append((format_api_datetime(start), format_api_datetime(boundary)))
+        start = boundary
+    return windows
+
+# Fetches a single shard, the client retries only this shard when it fails or times out
+def _fetch_shard(AccountInfo, frame_id, after, before, timeout, retries):
+    try:
+        return fetch_calendar_events(AccountInfo, frame_id, after, before, timeout, retries)
+    except (requests.RequestException, ValueError) as e:
+        # The attempts the failing request made, which the client records on the error or its response
+        attempts = getattr(e, 'attempts', None) or getattr(getattr(e, 'response', None), 'attempts', None)
+        failed = f'failed after {attempts} attempts' if attempts and attempts > 1 else 'failed'
+        raise RuntimeError(f'Shard {after} - {before} of frame {frame_id} {failed}: {e}') from e
+
+#----------------------------------------------------------------
+# Merges the included items (Categories and Calendar Accounts) from
+# several responses, only keeping each (type, id) once
+#----------------------------------------------------------------
+def _merge_included(responses):
+    included = []
+    seen_included = set()
+    for data in responses:
+        for item in data.get('included', []):
+            key = (item['type'], item['id'])
+            if key not in seen_included:
+                seen_included.add(key)
+                included.append(item)
+    return included
+
+#----------------------------------------------------------------
+# Merges the responses of several shards into a single structure
+# that looks like one calendar_events response.
+# Events that fall on a window boundary are returned by both shards,
+# so they are de-duplicated by their id and uid.
+#----------------------------------------------------------------
+def merge_shard_data(responses):
+    merged = {'data': [], 'included': _merge_included(responses), 'meta': {'total_event_count': 0}}
+    seen_events = set()
+    duplicates = 0
+    for data in responses:
+        for event in data['data']:
+            key = (event['id'], event['attributes'].get('uid'))
+            if key in seen_events:
+                duplicates += 1
+                continue
+            seen_events.add(key)
+            merged['data'].append(event)
+        merged['meta']['total_event_count'] += data['meta']['total_event_count']
+    merged['meta']['total_event_count'] -= duplicates
+    return merged
+
+#----------------------------------------------------------------
+# Fetches the provided (after, before) windows of a single frame
+# concurrently. Each window is retried on its own if it fails.
+# Returns a list of responses in the same order as windows
+#----------------------------------------------------------------
+def fetch_windows(AccountInfo, frame_id, windows, max_workers=max_shard_workers, timeout=shard_timeout, retries=shard_retries):
+    logger('Fetching frame %s in %d windows', frame_id, len(windows))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_fetch_shard, AccountInfo, frame_id, shard_after, shard_before, timeout, retries)
+                   for shard_after, shard_before in windows]
+        # Keep the shards in chronological order
+        return [future.result() for future in futures]
+
+#----------------------------------------------------------------
+# Retrieves the calendar events JSON data for a single frame by
+# splitting the range into windows and fetching them concurrently.
+# Returns the merged data in the same shape as fetch_calendar_events
+#----------------------------------------------------------------
+def fetch_calendar_events_sharded(AccountInfo, frame_id, after, before, window='month',
+                                  max_workers=max_shard_workers, timeout=shard_timeout, retries=shard_retries):
+    windows = build_time_windows(after, before, window)
+    return merge_shard_data(fetch_windows(AccountInfo, frame_id, windows, max_workers, timeout, retries))
+
+#----------------------------------------------------------------
+# Brings the local store up to date for a single frame.
+# Windows that were never fetched, and windows that end after
+# refresh_days ago (recent and future events), are refetched and
+# upserted. Older windows that are already stored are left alone.
+# Returns the frame's data rebuilt from the store
+#----------------------------------------------------------------
+def sync_frame(AccountInfo, store, frame_id, after, before, window='month', refresh_days=sync_refresh_days):
+    stale = stale_windows(store, frame_id, after, before, window, refresh_days)
+    return _save_windows(store, frame_id, stale, fetch_windows(AccountInfo, frame_id, stale))
+
+# Returns the windows of a frame sync_frame has to refetch
+def stale_windows(store, frame_id, after, before, window='month', refresh_days=sync_refresh_days):
+    cutoff = datetime.now(timezone.utc) - timedelta(days=refresh_days)
+    stale = []
+    for window_after, window_before in build_time_windows(after, before, window):
+        if store.get_window(frame_id, window_after, window_before) is None or parse_api_datetime(window_before) > cutoff:
+            stale.append((window_after, window_before))
+    logger('Frame %s: refetching %d windows', frame_id, len(stale))
+    return stale
+
+# Upserts the refetched windows of a frame and returns its data rebuilt from the store
+def _save_windows(store, frame_id, stale, responses):
+    for (window_after, window_before), data in zip(stale, responses):
+        store.save_window(frame_id, window_after, window_before, data)
+    return store.load_calendar_data([frame_id])
+
+#----------------------------------------------------------------
+# Class to hold the outcome of extracting a single frame
+#----------------------------------------------------------------
+class FrameResult:
+    def __init__(self, frame_id, data=None, error=None, elapsed=0.0):
+        self.frame_id = frame_id
+        self.data = data
+        self.error = error
+        self.elapsed = elapsed
+
+    def __str__(self):
+        if self.error:
+            return f'Frame {self.frame_id}: FAILED after {self.elapsed:.2f}s ({self.error})'
+        return f'Frame {self.frame_id}: {len(self.data["data"])} events in {self.elapsed:.2f}s'
+
+# Fetches one frame and records how long it took and whether it failed
+def _fetch_frame(AccountInfo, frame_id, after, before, window=None):
+    start = time.perf_counter()
+    try:
+        if window:
+            data = fetch_calendar_events_sharded(AccountInfo, frame_id, after, before, window)
+        else:
+            data = fetch_calendar_events(AccountInfo, frame_id, after, before)
+        return FrameResult(frame_id, data=data, elapsed=time.perf_counter() - start)
+    except Exception as e:
+        return FrameResult(frame_id, error=e, elapsed=time.perf_counter() - start)
+
+# Fetches the stale windows of one frame and records how long it took and whether it failed
+def _fetch_stale_windows(AccountInfo, frame_id, stale):
+    start = time.perf_counter()
+    try:
+        return FrameResult(frame_id, data=fetch_windows(AccountInfo, frame_id, stale), elapsed=time.perf_counter() - start)
+    except Exception as e:
+        return FrameResult(frame_id, error=e, elapsed=time.perf_counter() - start)
+
+#----------------------------------------------------------------
+# Syncs (or, offline, just loads) every provided frame through the
+# local store. The frames are fetched concurrently like
+# extract_frames does, but the store is only ever touched from the
+# calling thread as its SQLite connection cannot be shared: the
+# stale windows are worked out up front and each frame is saved
+# as soon as its windows arrive.
+# Returns a list of FrameResult objects in the same order as frame_ids
+#----------------------------------------------------------------
+def sync_frames(AccountInfo, store, frame_ids, after, before, max_workers=max_frame_workers, window=None, offline=False):
+    results = {}
+    if offline:
+        for frame_id in frame_ids:
+            start = time.perf_counter()
+            try:
+                result = FrameResult(frame_id, data=store.load_calendar_data([frame_id]), elapsed=time.perf_counter() - start)
+            except Exception as e:
+                result = FrameResult(frame_id, error=e, elapsed=time.perf_counter() - start)
+            results[frame_id] = result
+            print(result)
+        return [results[frame_id] for frame_id in frame_ids]
+
+    stale = {frame_id: stale_windows(store, frame_id, after, before, window or 'month') for frame_id in frame_ids}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_fetch_stale_windows, AccountInfo, frame_id, stale[frame_id]) for frame_id in frame_ids]
+        for future in as_completed(futures):
+            result = future.result()
+            if not result.error:
+                start = time.perf_counter()
+                try:
+                    result.data = _save_windows(store, result.frame_id, stale[result.frame_id], result.data)
+                except Exception as e:
+                    result.data, result.error = None, e
+                result.elapsed += time.perf_counter() - start
+            results[result.frame_id] = result
+            print(result)
+    return [results[frame_id] for frame_id in frame_ids]
+
+#----------------------------------------------------------------
+# Extracts every provided frame concurrently
+# A bounded pool of workers is used so we do not flood the API,
+# and each frame is reported as soon as it finishes so a slow
+# frame does not hold up the others.
+# If a window is provided each frame is also split into shards.
+# Returns a list of FrameResult objects in the same order as frame_ids
+#----------------------------------------------------------------
+def extract_frames(AccountInfo, frame_ids, after, before, max_workers=max_frame_workers, window=None):
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_fetch_frame, AccountInfo, frame_id, after, before, window) for frame_id in frame_ids]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.frame_id] = result
+            print(result)
+    return [results[frame_id] for frame_id in frame_ids]
+
+#----------------------------------------------------------------
+# Merges the JSON data of several frames into a single structure
+# that looks like one calendar_events response.
+# Included items (Categories and Calendar Accounts) are only kept once.
+#----------------------------------------------------------------
+def merge_frame_data(results):
+    responses = [result.data for result in results if not result.error]
+    merged = {'data': [], 'included': _merge_included(responses), 'meta': {'total_event_count': 0}}
+    for data in responses:
+        merged['data'].extend(data['data'])
+        merged['meta']['total_event_count'] += data['meta']['total_event_count']
+    return merged
+
+#----------------------------------------------------------------
+# Writes a calendar file unless its events are the same as last
+# time, and runs the --on-change command if it was written
+#----------------------------------------------------------------
+def _write_calendar_file(events, path, args, resources):
+    count, changed = write_icalendar_deterministic(events, path, args.gzip, resources, workers=args.ics_workers)
+    if not changed:
+        print(f'{path} is unchanged ({count} events), left as it was')
+        return
+    print(f'iCalendar file {path} generated successfully!')
+    if args.on_change:
+        run_on_change(args.on_change, path)
+
 
 def main():
+    parser = argparse.ArgumentParser(description='Extract calendar information from Skylight')
+    parser.add_argument('--all-frames', action='store_true', help='Extract every available frame instead of prompting for one')
+    parser.add_argument('--merge', action='store_true', help='Write all frames into a single calendar.ics instead of one file per frame')
+    parser.add_argument('--workers', type=int, default=max_frame_workers, help='Number of frames to extract at the same time')
+    parser.add_argument('--after', default=default_after, help='Start of the range to extract, e.g. 2020-01-01')
+    parser.add_argument('--before', default=default_before, help='End of the range to extract, e.g. 2026-12-31T23:59:59')
+    parser.add_argument('--window', help='Split the range into windows fetched concurrently: year, month, week, day or a number of days')
+    parser.add_argument('--frame', help='Frame ID to extract instead of prompting for one')
+    parser.add_argument('--store', help='Path to a local SQLite store; only recent and future windows are refetched')
+    parser.add_argument('--offline', action='store_true', help='Regenerate the .ics from the local store without going to the network')
+    parser.add_argument('--credentials', help=f'JSON file with "email" and "password" (default {default_credentials_file})')
+    parser.add_argument('--no-token-cache', action='store_true', help='Always log in instead of reusing the cached token')
+    parser.add_argument('--stream', action='store_true', help='Parse the response of a single frame as it arrives to keep memory flat')
+    parser.add_argument('--gzip', action='store_true', help='Write gzip compressed .ics.gz files')
+    parser.add_argument('--dedupe', action='store_true', help='Drop copies of the same event held by several frames or sources and join split series')
+    parser.add_argument('--dedupe-sources', help='Comma separated sources in the order their copy wins (default skylight,google,icloud,outlook,ics_link)')
+    parser.add_argument('--dedupe-precedence', help='Comma separated rules deciding which copy wins (default source,editable,updated,complete)')
+    parser.add_argument('--dedupe-ignore-uid', action='store_true', help='Also treat events with different UIDs but the same summary, times and rule as copies')
+    parser.add_argument('--ics-workers', type=int, default=1, help='Processes building and serializing large .ics files (default 1)')
+    parser.add_argument('--on-change', help='Shell command to run for every .ics file that changed, with its path in $SKYLIGHT_ICS')
+    parser.add_argument('--export', help='Directory to also export events, categories and calendar accounts into')
+    parser.add_argument('--export-format', choices=export_formats, default='jsonl', help='Format of the --export files')
+    parser.add_argument('--export-compression', choices=compressions, help='Compress the --export files (Parquet only supports gz)')
+    parser.add_argument('--occurrences', action='store_true', help='Also count the occurrences of recurring events within the range')
+    parser.add_argument('--metrics', help='Write per-stage timings and counters to this file (Prometheus text for .prom, JSON otherwise)')
+    parser.add_argument('--max-rate', type=float, default=shared_limiter.max_rate, help='Most requests per second the rate limiter ramps up to')
+    parser.add_argument('--max-concurrency', type=int, default=shared_limiter.max_concurrency, help='Most requests in flight the rate limiter ramps up to')
+    parser.add_argument('--cache', help='Directory to cache API responses in')
+    parser.add_argument('--cache-mode', choices=cache_modes, default='live',
+                        help='live revalidates cached responses, record stores every response, replay never goes to the network')
+    parser.add_argument('--cache-ttl', type=int, default=default_ttl, help='Seconds to reuse a response the API gave no ETag or Last-Modified for')
+    args = parser.parse_args()
+
     frame_ids = []
     num_calendar_accounts = []
+    ics_extension = '.ics.gz' if args.gzip else '.ics'
+
+    # The local store is only used when asked for
+    store = EventStore(args.store) if args.store else None
+    if args.offline and not store:
+        parser.error('--offline requires --store')
+    if args.stream and (store or args.window or args.all_frames):
+        parser.error('--stream only supports a single frame without --store or --window')
+    if args.stream and args.dedupe:
+        parser.error('--dedupe needs every event at once and cannot be used with --stream')
+    if args.cache_mode != 'live' and not args.cache:
+        parser.error('--cache-mode requires --cache')
+    if args.max_rate <= 0:
+        parser.error('--max-rate has to be above 0')
+    if args.max_concurrency < 1:
+        parser.error('--max-concurrency has to be at least 1')
+    if args.export_format == 'parquet' and args.export_compression not in parquet_compressions:
+        parser.error(f'--export-format parquet only supports --export-compression {", ".join(filter(None, parquet_compressions))}')
+
+    if args.metrics:
+        metrics.enable()
+
+    # Imported here as skylight_dedup builds on this module
+    deduplicator = None
+    duplicates = 0
+    if args.dedupe:
+        from skylight_dedup import Deduplicator, default_precedence, default_source_order
+        try:
+            deduplicator = Deduplicator(args.dedupe_precedence.split(',') if args.dedupe_precedence else default_precedence,
+                                        args.dedupe_sources.split(',') if args.dedupe_sources else default_source_order,
+                                        by_uid=not args.dedupe_ignore_uid)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # Every request of this run shares the same limiter
+    shared_limiter.set_limits(args.max_rate, args.max_concurrency)
+
+    # Responses are cached on disk when asked for
+    cache = ResponseCache(args.cache, args.cache_mode, args.cache_ttl) if args.cache else None
+
+    if args.offline:
+        # Regenerate from the local store without going to the network
+        AccountInfo = None
+        frame_ids = store.frame_ids()
+    else:
+        # Test new login
+        AccountInfo = login(client=SkylightClient(url, cache=cache), credentials_file=args.credentials,
+                            token_cache=None if args.no_token_cache else default_token_cache)
 
-    # Test new login
-    AccountInfo = login()
-
-    logger(AccountInfo.getId())
-    logger(AccountInfo.getToken())
-    logger(AccountInfo.getAuthToken())
+        logger(AccountInfo.getId())
+        logger(AccountInfo.getToken())
+        logger(AccountInfo.getAuthToken())
 
-    frame_ids = AccountInfo.getFrameId()
+        frame_ids = AccountInfo.getFrameId()
 
     for frame in frame_ids:
         print('Frame ID: ' + frame)
@@ -458,23 +1823,81 @@ def main():
     # You can obtain this by logging in and observing the id in:
     # https://app.ourskylight.com/api/frames/<<< ID >>>/calendar_events
 
-    # TODO: Extract all frames and iterate through
-    frameID = input('Type a frame ID to extract from above: ')
+    # This is the range that we are searching
+    testAfter = format_api_datetime(parse_api_datetime(args.after))
+    testBefore = format_api_datetime(parse_api_datetime(args.before))
+
+    # Type 'all' (or pass --all-frames) to extract every frame at once
+    if args.all_frames:
+        frameID = 'all'
+    elif args.frame:
+        frameID = args.frame
+    else:
+        frameID = input('Type a frame ID to extract from above (or \'all\' for every frame): ')
     #frameID = 1600234
+    frameID = frameID.strip()
+    all_frames = frameID.lower() == 'all'
+    if all_frames and args.stream:
+        parser.error('--stream only supports a single frame')
+
+    if all_frames:
+        if store:
+            results = sync_frames(AccountInfo, store, frame_ids, testAfter, testBefore, args.workers, args.window, args.offline)
+        else:
+            results = extract_frames(AccountInfo, frame_ids, testAfter, testBefore, args.workers, args.window)
+
+        failed = [result for result in results if result.error]
+        print(f'Extracted {len(results) - len(failed)} of {len(results)} frames')
+
+        # Copies within each frame go first, copies across frames once they are merged
+        if deduplicator:
+            for result in results:
+                if not result.error:
+                    count = len(result.data['data'])
+                    result.data['data'] = deduplicator.dedupe(result.data['data'])
+                    duplicates += count - len(result.data['data'])
+                    logger('Frame %s: %s', result.frame_id, deduplicator)
+
+        # Either write one .ics per frame, or fall through and write the merged one below
+        if not args.merge:
+            for result in results:
+                if not result.error:
+                    _write_calendar_file(result.data['data'], f'calendar_{result.frame_id}{ics_extension}', args,
+                                         index_included(result.data['included']))
+
+        data = merge_frame_data(results)
+    elif args.offline:
+        data = store.load_calendar_data([frameID])
+    elif store:
+        data = sync_frame(AccountInfo, store, frameID, testAfter, testBefore, args.window or 'month')
+    elif args.stream:
+        # Each event is handed to parse_event and the EventInfo builder as soon as it arrives,
+        # and written out straight away. Categories are not resolved here as the
+        # included items are only known once the whole response has been read.
+        all_events = EventTable()
+        stream = stream_calendar_events(AccountInfo, frameID, testAfter, testBefore)
+        write_icalendar_stream(_collect_event_info(stream, all_events), f'calendar{ics_extension}', args.gzip)
+        print('iCalendar file generated successfully!')
+
+        # The events themselves are not kept, only what was collected on the side
+        data = {'data': [], 'included': stream.included, 'meta': stream.meta}
+    else:
+        # Obtain the JSON data, split into windows if requested
+        if args.window:
+            data = fetch_calendar_events_sharded(AccountInfo, frameID, testAfter, testBefore, args.window)
+        else:
+            data = fetch_calendar_events(AccountInfo, frameID, testAfter, testBefore)
 
-    # This is the range that we are searching
-    # TODO: Accept input for this
-    testAfter = '2020-01-01T00:00:00.000Z'
-    testBefore = '2026-12-31T23:59:59.000Z'
+    if store:
+        store.close()
 
-    # Base URL
-    url = f'https://app.ourskylight.com/api/frames/{frameID}/calendar_events'
-    
-    # Obtain the JSON data
-    data = requests.get(
-        f'{url}?after={testAfter}&before={testBefore}', 
-        headers={'Authorization': f'Basic {AccountInfo.getAuthToken().decode()}'}    
-    ).json()
+    if deduplicator:
+        with metrics.stage('dedupe'):
+            count = len(data['data'])
+            data['data'] = deduplicator.dedupe(data['data'])
+        duplicates += count - len(data['data'])
+        logger(deduplicator)
+        print(f'De-duplication removed {duplicates} events')
 
     # If debug is enabled, dump our retrieved Calendar events JSON data
     if debug:
@@ -482,11 +1905,13 @@ def main():
             json.dump(data, f, ensure_ascii=False, indent=4)
     
     # Generate iCalendar data
-    ical = generate_icalendar(data)
+    # This is only needed for debugging, the files are written straight from the events
+    if debug and not args.stream:
+        ical = generate_icalendar(data)
 
     # Assuming you have the `ical` object generated from your code
     # Only print if debug is enabled
-    if debug:
+    if debug and not args.stream:
         with open('output.txt', 'w') as f:
             for event in ical.walk('VEVENT'):
                 # Check data type of dtstart, dtend, and other relevant properties)
@@ -500,101 +1925,38 @@ def main():
 
                 print('-' * 20, file=f)  # Separator for each event
 
-    # Write iCalendar data to file (replace with your desired filename)
-    with open('calendar.ics', 'wb') as f:
-        f.write(ical.to_ical())
+    # Index the includes (Categories and Calendar Accounts) once so events can be joined to them
+    resources = index_included(data['included'])
 
-    print('iCalendar file generated successfully!')
+    # Write iCalendar data to file (replace with your desired filename)
+    # In per-frame and streaming mode the files have already been written above
+    if (not all_frames or args.merge) and not args.stream:
+        _write_calendar_file(data['data'], f'calendar{ics_extension}', args, resources)
 
     # Set aside for the events
     events = data['data']
 
-    # Set aside for the includes (Categories and Calendar Accounts)
-    included_data = data['included']
-
     # Go ahead and grab the total number of events
     total_event_count = data['meta']['total_event_count']  # Extract total event count
 
     # Extract categories
-    categories = []
-    for item in included_data:
-        if item['type'] == 'category':
-            category_id = item['id']
-            label = item['attributes']['label']
-            try:
-                color = item['attributes']['color']
-            except KeyError:
-                color = None
-            try:
-                selected_for_chore_chart = item['attributes']['selected_for_chore_chart']
-            except KeyError:
-                selected_for_chore_chart = None
-            try:
-                profile_pic_url = item['attributes']['profile_pic_url']
-            except KeyError:
-                profile_pic_url = None
-            category_obj = Category(category_id, label, color, selected_for_chore_chart, profile_pic_url)
-
-            # Append this to the list of categories
-            categories.append(category_obj)
+    categories = extract_categories(resources)
 
     # Extract calendar accounts
-    # This may be accounts specific to the user logged in?
-    # I have not observed other active calendars from family memebers
-    calendar_accounts = []
-    for item in included_data:
-        if item['type'] == 'calendar_account':
-            calendar_id = item['id']
-            attributes = item['attributes']
-            email = attributes['email']
-            active_calendars = attributes['active_calendars']
-            provider = attributes['provider']
-            calendar_obj = CalendarAccount(calendar_id, email, active_calendars, provider)
-            
-            # Append this to the list of available calendars
-            calendar_accounts.append(calendar_obj)
+    calendar_accounts = extract_calendar_accounts(resources)
 
     # Create Event objects and store in a list
-    all_events = []
-    for event in events:
-
-        # Store all attributes to be moved into a class
-        event_id = event['id']
-        event_type = event['type']                                      # Example: "calendar_event"
-        uid = event['attributes'].get('uid')                            # Example: "from-app-d7a81571fe0e5983a4f8a76d9bbbb7e0-after-1707091200"
-        summary = event['attributes'].get('summary')                    # Example: "Free Lunch at Work"
-        description = event['attributes'].get('description')            # I have not observed a value here yet
-        location = event['attributes'].get('location')                  # A full address
-        starts_at = event['attributes'].get('starts_at')                # Example: "2024-04-23T18:00:00.000Z"
-        ends_at = event['attributes'].get('ends_at')                    # Example: "2024-04-23T19:00:00.000Z"
-        all_day = event['attributes'].get('all_day')                    # True or False
-        invited_emails = event['attributes'].get('invited_emails')      # List, I have not observed any emails here yet
-        status = event['attributes'].get('status')                      # Example: "approved"
-        rrule = event['attributes'].get('rrule')                        # Example: "RRULE:FREQ=WEEKLY;WKST=SU;INTERVAL=1;BYDAY=TU" or "RRULE:FREQ=YEARLY"
-        owner_email = event['attributes'].get('owner_email')            # Email of creator
-        calendar_id = event['attributes'].get('calendar_id')            # I have not value here yet
-        master_event_id = event['attributes'].get('master_event_id')    # I have not value here yet
-        time_zone = event['attributes'].get('timezone')                 # Example: "America/New_York"
-        recurring = event['attributes'].get('recurring')                # True or False
-        recurring_config = event['attributes'].get('recurring_config')  # True or False
-        lat = event['attributes'].get('lat')                            # I have not observed a value here yet
-        lng = event['attributes'].get('lng')                            # I have not observed a value here yet
-        source = event['attributes'].get('source')                      # Example: "skylight" or "ics_link" or "google"
-        kind = event['attributes'].get('kind')                          # Example: "standard"
-        editable = event['attributes'].get('editable')                  # True, I have not observed False yet
-
-        # Extract category ID (if it exists)
-        category_id = None
-        if event['relationships'].get('category'):
-            category_id = event['relationships']['category']['data']['id']
-
-        # Create Event object
-        event_obj = EventInfo(event_id, event_type, uid, summary, description, location, starts_at, ends_at, all_day, status, invited_emails, rrule, owner_email, calendar_id, master_event_id, time_zone, recurring, recurring_config, lat, lng, source, kind, editable, category_id)
-
-        # Add the event object to the list
-        all_events.append(event_obj)
-
-
+    # When streaming these were already built as the events arrived
+    if not args.stream:
+        with metrics.stage('extract'):
+            all_events = EventTable.from_json(events, resources)
+
+    # Export for analytics, one record at a time
+    if args.export:
+        with metrics.stage('export'):
+            written = export_all(args.export, args.export_format, all_events, categories, calendar_accounts, args.export_compression)
+        for path, count in written.values():
+            print(f'Exported {count} records to {path}')
 
     # The logger function checks for the debug flag
     # but for sake of time, we'll check before looping
@@ -618,9 +1980,25 @@ def main():
     # Print our totals
     print(f'Total Events: {total_event_count}')
     print(f'Total number of events extracted this session: {len(all_events)}')
+    if len(all_events) + duplicates < total_event_count:
+        print(f'Warning: {total_event_count - len(all_events) - duplicates} events reported by the API were not extracted')
+    if args.occurrences:
+        # Imported here as skylight_recurrence builds on this module
+        from skylight_recurrence import RecurrenceExpander
+        print(f'Total number of occurrences between {testAfter} and {testBefore}: {RecurrenceExpander().count(all_events, testAfter, testBefore)}')
     print(f'Total number of categories extracted this session: {len(categories)}')
     for i, calendar in enumerate(calendar_accounts):
         print(f'Total number of calendars within Calender {i}: {len(calendar.active_calendars)}')
+    if cache:
+        print(cache)
+    # The limiter is only worth mentioning when the API pushed back
+    if shared_limiter.throttled:
+        print(shared_limiter)
+    else:
+        logger(shared_limiter)
+
+    if args.metrics:
+        metrics.write(args.metrics)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
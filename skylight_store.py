@@ -0,0 +1,197 @@
+###############################################################################################
+# Description:	Local SQLite store for the calendar information scraped from Skylight.
+# 		Events, Categories and Calendar Accounts are kept between runs along with
+# 		a record of which time windows were fetched and when, so a sync only
+# 		needs to refetch the recent and future windows.
+###############################################################################################
+import json
+import time
+import sqlite3
+
+# Default location of the store
+default_store_path = 'skylight.db'
+
+#----------------------------------------------------------------
+# Table definitions
+# The raw JSON for every row is kept so that the calendar_events
+# response can be rebuilt exactly and regenerated without the network
+#----------------------------------------------------------------
+schema = '''
+CREATE TABLE IF NOT EXISTS events (
+    frame_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    summary TEXT,
+    starts_at TEXT,
+    ends_at TEXT,
+    all_day INTEGER,
+    recurring INTEGER,
+    time_zone TEXT,
+    source TEXT,
+    category_id TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (frame_id, id, uid)
+);
+CREATE INDEX IF NOT EXISTS events_starts_at ON events (frame_id, starts_at);
+
+CREATE TABLE IF NOT EXISTS categories (
+    id TEXT PRIMARY KEY,
+    label TEXT,
+    color TEXT,
+    selected_for_chore_chart INTEGER,
+    profile_pic_url TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS calendar_accounts (
+    id TEXT PRIMARY KEY,
+    email TEXT,
+    provider TEXT,
+    active_calendars TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS windows (
+    frame_id TEXT NOT NULL,
+    after TEXT NOT NULL,
+    before TEXT NOT NULL,
+    event_count INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (frame_id, after, before)
+);
+'''
+
+#----------------------------------------------------------------
+# Class to hold the connection to our local event store
+#----------------------------------------------------------------
+class EventStore:
+    def __init__(self, path=default_store_path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    # Returns when the window was last fetched, or None if it never was
+    def get_window(self, frame_id, after, before):
+        row = self.conn.execute(
+            'SELECT fetched_at FROM windows WHERE frame_id = ? AND after = ? AND before = ?',
+            (str(frame_id), after, before)
+        ).fetchone()
+        return row[0] if row else None
+
+    # Returns every frame that has been stored
+    def frame_ids(self):
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT frame_id FROM windows ORDER BY frame_id')]
+
+    #----------------------------------------------------------------
+    # Stores the calendar_events response for a single window
+    # Events are upserted, events that start inside the window but
+    # were not returned anymore are removed, and the window is
+    # recorded as fetched. Everything happens in one transaction.
+    #----------------------------------------------------------------
+    def save_window(self, frame_id, after, before, data):
+        frame_id = str(frame_id)
+        now = time.time()
+
+        with self.conn:
+            returned = set()
+            for event in data['data']:
+                returned.add((event['id'], event['attributes'].get('uid') or ''))
+                self._upsert_event(frame_id, event, now)
+
+            # Remove anything that was deleted upstream since the last fetch
+            stored = self.conn.execute(
+                'SELECT id, uid FROM events WHERE frame_id = ? AND starts_at >= ? AND starts_at < ?',
+                (frame_id, after, before)
+            ).fetchall()
+            for event_id, uid in stored:
+                if (event_id, uid) not in returned:
+                    self.conn.execute('DELETE FROM events WHERE frame_id = ? AND id = ? AND uid = ?', (frame_id, event_id, uid))
+
+            for item in data.get('included', []):
+                attributes = item['attributes']
+                if item['type'] == 'category':
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO categories VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (item['id'], attributes.get('label'), attributes.get('color'),
+                         attributes.get('selected_for_chore_chart'), attributes.get('profile_pic_url'),
+                         json.dumps(item, ensure_ascii=False), now)
+                    )
+                elif item['type'] == 'calendar_account':
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO calendar_accounts VALUES (?, ?, ?, ?, ?, ?)',
+                        (item['id'], attributes.get('email'), attributes.get('provider'),
+                         json.dumps(attributes.get('active_calendars'), ensure_ascii=False),
+                         json.dumps(item, ensure_ascii=False), now)
+                    )
+
+            self.conn.execute(
+                'INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?)',
+                (frame_id, after, before, len(data['data']), now)
+            )
+
+    # Inserts or replaces a single event, within the caller's transaction
+    def _upsert_event(self, frame_id, event, now):
+        attributes = event['attributes']
+        category_id = None
+        if event.get('relationships', {}).get('category'):
+            category_id = event['relationships']['category']['data']['id']
+
+        self.conn.execute(
+            'INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (str(frame_id), event['id'], attributes.get('uid') or '', attributes.get('summary'), attributes.get('starts_at'),
+             attributes.get('ends_at'), attributes.get('all_day'), attributes.get('recurring'),
+             attributes.get('timezone'), attributes.get('source'), category_id,
+             json.dumps(event, ensure_ascii=False), now)
+        )
+
+    #----------------------------------------------------------------
+    # Applies changes made through the write API without refetching
+    # upserted is a list of event JSON items, deleted a list of IDs
+    #----------------------------------------------------------------
+    def apply_changes(self, frame_id, upserted=(), deleted=()):
+        now = time.time()
+        with self.conn:
+            for event in upserted:
+                self.conn.execute('DELETE FROM events WHERE frame_id = ? AND id = ?', (str(frame_id), event['id']))
+                self._upsert_event(frame_id, event, now)
+            for event_id in deleted:
+                self.conn.execute('DELETE FROM events WHERE frame_id = ? AND id = ?', (str(frame_id), str(event_id)))
+
+    # Returns the stored JSON item of an event, or None
+    def get_event(self, frame_id, event_id):
+        row = self.conn.execute('SELECT data FROM events WHERE frame_id = ? AND id = ?', (str(frame_id), str(event_id))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    #----------------------------------------------------------------
+    # Rebuilds a calendar_events response from the store
+    # Accepts a list of frame IDs, or None for every stored frame
+    # Returns a dictionary with the same data/included/meta layout
+    #----------------------------------------------------------------
+    def load_calendar_data(self, frame_ids=None):
+        if frame_ids is None:
+            rows = self.conn.execute('SELECT data FROM events ORDER BY frame_id, starts_at, id, uid')
+        else:
+            frame_ids = [str(frame_id) for frame_id in frame_ids]
+            placeholders = ', '.join('?' for _ in frame_ids)
+            rows = self.conn.execute(
+                f'SELECT data FROM events WHERE frame_id IN ({placeholders}) ORDER BY frame_id, starts_at, id, uid',
+                frame_ids
+            )
+        events = [json.loads(row[0]) for row in rows]
+
+        included = [json.loads(row[0]) for row in self.conn.execute('SELECT data FROM categories ORDER BY id')]
+        included += [json.loads(row[0]) for row in self.conn.execute('SELECT data FROM calendar_accounts ORDER BY id')]
+
+        return {'data': events, 'included': included, 'meta': {'total_event_count': len(events)}}
@@ -0,0 +1,217 @@
+###############################################################################################
+# Description:	Incremental parsing of Skylight's JSON:API documents.
+# 		The response body is fed in chunks as it arrives and every item of
+# 		the top level "data" array is handed back as soon as it is complete,
+# 		so the whole document never has to be held in memory at once.
+# 		Everything else ("included", "meta", ...) is collected on the side.
+###############################################################################################
+import json
+import codecs
+
+_whitespace = ' \t\n\r'
+
+# Once this much of the buffer has been consumed it is trimmed
+_compact_size = 1 << 16
+
+#----------------------------------------------------------------
+# Push parser for a single JSON:API document
+#
+# feed() accepts bytes or str and returns the list of items from
+# the "data" array that were completed by that chunk.
+# Items of "included" are collected one at a time into
+# self.document['included'], and any other top level values
+# (such as "meta") are stored in self.document as they are.
+#----------------------------------------------------------------
+class JsonApiStreamParser:
+    def __init__(self, stream_key='data', collect_keys=('included',)):
+        self.stream_key = stream_key
+        self.collect_keys = collect_keys
+        self.document = {}
+
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'start'
+        self._key = None
+        self._closed = False
+
+    @property
+    def done(self):
+        return self._state == 'done'
+
+    # Adds a chunk of the response and returns the completed "data" items
+    def feed(self, chunk):
+        if isinstance(chunk, bytes):
+            chunk = self._text.decode(chunk)
+        self._buffer += chunk
+        items = self._parse()
+
+        # Drop whatever has already been parsed
+        if self._pos > _compact_size:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return items
+
+    # Signals the end of the response and returns any remaining items
+    def close(self):
+        self._buffer += self._text.decode(b'', final=True)
+        self._closed = True
+        items = self._parse()
+        if self._state != 'done':
+            raise ValueError('Incomplete JSON:API document')
+        return items
+
+    # Skips whitespace, returning the next character or None if we need more data
+    def _peek(self):
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in _whitespace:
+            self._pos += 1
+        if self._pos < len(self._buffer):
+            return self._buffer[self._pos]
+        return None
+
+    # Decodes one complete value at the current position, or returns (False, None)
+    # A value that ends exactly at the end of the buffer may still be growing
+    # (a number for instance), so it is only accepted once more data or the end arrives
+    def _value(self):
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if self._closed:
+                raise
+            return False, None
+        if end == len(self._buffer) and not self._closed:
+            return False, None
+        self._pos = end
+        return True, value
+
+    def _parse(self):
+        items = []
+        while True:
+            char = self._peek()
+            if char is None:
+                return items
+
+            if self._state == 'start':
+                if char != '{':
+                    raise ValueError(f'Expected a JSON object, found {char!r}')
+                self._pos += 1
+                self._state = 'key'
+
+            elif self._state == 'key':
+                if char == ',':
+                    self._pos += 1
+                    continue
+                if char == '}':
+                    self._pos += 1
+                    self._state = 'done'
+                    continue
+                complete, key = self._value()
+                if not complete:
+                    return items
+                self._key = key
+                self._state = 'colon'
+
+            elif self._state == 'colon':
+                if char != ':':
+                    raise ValueError(f'Expected ":" after {self._key!r}, found {char!r}')
+                self._pos += 1
+                self._state = 'value'
+
+            elif self._state == 'value':
+                # Arrays we care about are walked one item at a time
+                if char == '[' and (self._key == self.stream_key or self._key in self.collect_keys):
+                    self._pos += 1
+                    if self._key != self.stream_key:
+                        self.document[self._key] = []
+                    self._state = 'array'
+                    continue
+                complete, value = self._value()
+                if not complete:
+                    return items
+                self.document[self._key] = value
+                self._state = 'key'
+
+            elif self._state == 'array':
+                if char == ',':
+                    self._pos += 1
+                    continue
+                if char == ']':
+                    self._pos += 1
+                    self._state = 'key'
+                    continue
+                complete, value = self._value()
+                if not complete:
+                    return items
+                if self._key == self.stream_key:
+                    items.append(value)
+                else:
+                    self.document[self._key].append(value)
+
+            else:
+                raise ValueError(f'Unexpected data after the JSON:API document: {char!r}')
+
+#----------------------------------------------------------------
+# Iterates over the "data" items of a JSON:API document that
+# arrives as an iterable of chunks (such as requests' iter_content)
+# Given a follower (skylight_scrape.PageFollower) and open_page,
+# which turns one of its requests into chunks, the pages after the
+# first are followed too, and events an earlier page already held
+# are skipped.
+# Once iteration has finished, included and meta are available.
+#----------------------------------------------------------------
+class CalendarEventStream:
+    def __init__(self, chunks, follower=None, open_page=None):
+        self.chunks = chunks
+        self.follower = follower
+        self.open_page = open_page
+        self.parser = JsonApiStreamParser()
+        self._included = []
+
+    def __iter__(self):
+        if self.follower is None:
+            yield from self._items(self.parser, self.chunks)
+            return
+
+        parser = self.parser
+        chunks = self.chunks
+        included_keys = set()
+        while True:
+            seen = self.follower.seen
+            keys = []
+            last_start = None
+            for item in self._items(parser, chunks):
+                key = self.follower.key(item)
+                keys.append(key)
+                last_start = item['attributes'].get('starts_at')
+                if key not in seen:
+                    yield item
+
+            # Keep the included items of every page once, the meta is that of the first
+            for item in parser.document.get('included', []):
+                if (item['type'], item['id']) not in included_keys:
+                    included_keys.add((item['type'], item['id']))
+                    self._included.append(item)
+
+            self.follower.add(parser.document, keys, last_start)
+            request = self.follower.next_request()
+            if request is None:
+                return
+            parser = JsonApiStreamParser()
+            chunks = self.open_page(request)
+
+    @staticmethod
+    def _items(parser, chunks):
+        for chunk in chunks:
+            yield from parser.feed(chunk)
+        yield from parser.close()
+
+    @property
+    def included(self):
+        if self.follower is not None:
+            return self._included
+        return self.parser.document.get('included', [])
+
+    @property
+    def meta(self):
+        return self.parser.document.get('meta', {})
@@ -0,0 +1,409 @@
+###############################################################################################
+# Description:	Write path for calendar events: create, update and delete.
+# 		Changes are queued first and sent together by flush():
+# 		  update after update     one request with both sets of attributes
+# 		  update after create     folded into the create
+# 		  delete after create     nothing is sent at all
+# 		  delete after update     only the delete is sent
+# 		The queued requests are sent from a pool of threads through the
+# 		shared rate limiter, which bounds how many are in flight and backs
+# 		off when the API pushes back. Updates and deletes are retried like
+# 		any other request; creates are only retried when the API cannot
+# 		have acted on them (429, 503, or a connection that could not be
+# 		opened), so an import does not end up with the same event twice.
+#
+# 		Once sent, the results are applied to the local model: the event
+# 		JSON items of a calendar_events response (apply()) and the local
+# 		SQLite store when one is given, so nothing has to be fetched again.
+#
+# 		The write endpoints are not documented; they follow the layout of the
+# 		read API and are kept in events_path / event_path and event_payload().
+#
+# Usage:	python skylight_write.py import events.ics --frame 1600234
+# 		python skylight_write.py import events.jsonl --frame 1600234 --store skylight.db
+###############################################################################################
+import json
+import time
+import argparse
+import itertools
+import threading
+import requests
+from urllib3.exceptions import NewConnectionError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import skylight_scrape
+from skylight_scrape import login, logger, format_api_datetime, default_token_cache
+from skylight_client import SkylightClient, backoff_delay, default_retries, retry_statuses
+from skylight_store import EventStore
+from skylight_limiter import shared_limiter, throttle_statuses
+
+events_path = '/frames/{frame_id}/calendar_events'
+event_path = '/frames/{frame_id}/calendar_events/{event_id}'
+update_method = 'PATCH'
+
+# Requests sent at the same time by flush(), the shared limiter may allow fewer
+default_max_workers = 16
+
+# Attributes an import sends, everything else (IDs, resolved categories, ...) is the API's own
+# These are EventInfo field names, which api_attribute_names / api_relationships map onto the API's
+writable_attributes = ('summary', 'description', 'location', 'starts_at', 'ends_at', 'all_day', 'time_zone',
+                       'rrule', 'recurring', 'invited_emails', 'lat', 'lng', 'category_id')
+
+# EventInfo fields the API knows under another attribute name
+api_attribute_names = {'time_zone': 'timezone'}
+
+# EventInfo fields the API holds as a relationship: field: (relationship, type)
+api_relationships = {'category_id': ('category', 'category')}
+
+#----------------------------------------------------------------
+# Splits attributes given with EventInfo field names into the
+# API's attributes and relationships
+# Returns (attributes, relationships)
+#----------------------------------------------------------------
+def to_api(attributes):
+    api_attributes = {}
+    relationships = {}
+    for name, value in attributes.items():
+        if name in api_relationships:
+            relationship, item_type = api_relationships[name]
+            relationships[relationship] = {'data': {'type': item_type, 'id': str(value)} if value is not None else None}
+        else:
+            api_attributes[api_attribute_names.get(name, name)] = value
+    return api_attributes, relationships
+
+# Returns the request body for a set of event attributes
+def event_payload(attributes):
+    api_attributes, relationships = to_api(attributes)
+    data = {'type': 'calendar_event', 'attributes': api_attributes}
+    if relationships:
+        data['relationships'] = relationships
+    return {'data': data}
+
+# Returns a copy of an event JSON item with the attributes applied, as the API would hold them
+def patch_event(event, attributes):
+    api_attributes, relationships = to_api(attributes)
+    patched = dict(event, attributes=dict(event['attributes'], **api_attributes))
+    if relationships:
+        patched['relationships'] = dict(event.get('relationships') or {}, **relationships)
+    return patched
+
+#----------------------------------------------------------------
+# Checks whether a request failed before it could reach the API
+# Only a connect timeout or a connection that could not be opened
+# (refused, name not resolved) is certain; a reset or abort can
+# come after the server has acted on the request
+#----------------------------------------------------------------
+def never_sent(error):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or isinstance(error, requests.Timeout):
+        return False
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, NewConnectionError)
+
+#----------------------------------------------------------------
+# Class holding one queued change and, once sent, its outcome
+# key is the event ID, or a local "new-<n>" key for a create until
+# the API has given the event an ID of its own
+# status is one of pending, done, failed or dropped (a create that
+# was deleted again before it was sent)
+#----------------------------------------------------------------
+class Mutation:
+    __slots__ = ('op', 'frame_id', 'key', 'attributes', 'status', 'event', 'error', 'attempts')
+
+    def __init__(self, op, frame_id, key, attributes=None):
+        self.op = op
+        self.frame_id = str(frame_id)
+        self.key = key
+        self.attributes = dict(attributes or {})
+        self.status = 'pending'
+        self.event = None           # The event JSON item the API sent back
+        self.error = None
+        self.attempts = 0
+
+    @property
+    def event_id(self):
+        if self.event:
+            return self.event['id']
+        return None if self.op == 'create' else self.key
+
+    def __str__(self):
+        info = f'{self.op} {self.frame_id}/{self.event_id or self.key}: {self.status}'
+        if self.error:
+            info += f' ({self.error})'
+        return info
+
+#----------------------------------------------------------------
+# Class holding the queue of changes for one login
+#----------------------------------------------------------------
+class WriteQueue:
+    def __init__(self, AccountInfo, max_workers=default_max_workers, retries=default_retries, store=None):
+        self.AccountInfo = AccountInfo
+        self.max_workers = max_workers
+        self.retries = retries
+        self.store = store
+        self.pending = OrderedDict()        # (frame_id, key): Mutation
+        self._new_keys = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    # Queues a new event, returns its Mutation (its key can be passed to update() and delete())
+    def create(self, frame_id, attributes):
+        with self._lock:
+            mutation = Mutation('create', frame_id, f'new-{next(self._new_keys)}', attributes)
+            self.pending[(mutation.frame_id, mutation.key)] = mutation
+            return mutation
+
+    #----------------------------------------------------------------
+    # Queues changed attributes of an event
+    # Folded into a change already queued for the same event
+    #----------------------------------------------------------------
+    def update(self, frame_id, event_id, attributes):
+        key = (str(frame_id), str(event_id))
+        with self._lock:
+            mutation = self.pending.get(key)
+            if mutation is None:
+                mutation = Mutation('update', frame_id, str(event_id), attributes)
+                self.pending[key] = mutation
+            elif mutation.op == 'delete':
+                raise ValueError(f'Event {event_id} is already queued to be deleted')
+            else:
+                mutation.attributes.update(attributes)
+            return mutation
+
+    #----------------------------------------------------------------
+    # Queues the removal of an event
+    # A create still in the queue is simply dropped
+    #----------------------------------------------------------------
+    def delete(self, frame_id, event_id):
+        key = (str(frame_id), str(event_id))
+        with self._lock:
+            mutation = self.pending.get(key)
+            if mutation is not None and mutation.op == 'create':
+                del self.pending[key]
+                mutation.status = 'dropped'
+                return mutation
+            mutation = Mutation('delete', frame_id, str(event_id))
+            self.pending[key] = mutation
+            return mutation
+
+    # Returns the method, path and body of a mutation
+    def _request(self, mutation):
+        if mutation.op == 'create':
+            return 'POST', events_path.format(frame_id=mutation.frame_id), event_payload(mutation.attributes)
+        path = event_path.format(frame_id=mutation.frame_id, event_id=mutation.key)
+        if mutation.op == 'update':
+            return update_method, path, event_payload(mutation.attributes)
+        return 'DELETE', path, None
+
+    #----------------------------------------------------------------
+    # Sends one mutation, retrying what is safe to retry
+    #----------------------------------------------------------------
+    def _send(self, mutation):
+        method, path, body = self._request(mutation)
+        client = self.AccountInfo.client
+        # A create that timed out or failed on the server may still have been made
+        retryable = throttle_statuses if mutation.op == 'create' else retry_statuses
+        while True:
+            mutation.attempts += 1
+            try:
+                # Sent straight to the API, one attempt at a time, as writes must not be cached
+                response = client.send(method, path, json=body, retries=1)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if mutation.attempts >= self.retries or (mutation.op == 'create' and not never_sent(e)):
+                    mutation.status, mutation.error = 'failed', f'{type(e).__name__}: {e}'
+                    return mutation
+                time.sleep(backoff_delay(mutation.attempts - 1))
+                continue
+
+            if response.status_code in retryable and mutation.attempts < self.retries:
+                response.close()
+                time.sleep(backoff_delay(mutation.attempts - 1, response))
+                continue
+            break
+
+        # A delete of an event that is already gone has done its job
+        if response.ok or (mutation.op == 'delete' and response.status_code == 404):
+            mutation.status = 'done'
+            if mutation.op != 'delete' and response.content:
+                try:
+                    mutation.event = response.json().get('data')
+                except ValueError:
+                    pass
+        else:
+            mutation.status = 'failed'
+            mutation.error = f'HTTP {response.status_code}: {response.text[:200]}'
+        return mutation
+
+    #----------------------------------------------------------------
+    # Sends every queued mutation and applies the results to the
+    # local store, if there is one
+    # Returns the list of mutations with their outcome
+    #----------------------------------------------------------------
+    def flush(self):
+        with self._lock:
+            mutations = list(self.pending.values())
+            self.pending.clear()
+        if not mutations:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(mutations))) as executor:
+            results = list(executor.map(self._send, mutations))
+        for mutation in results:
+            logger(mutation)
+
+        if self.store:
+            self._apply_to_store(results)
+        return results
+
+    # Writes the outcome of the mutations into the local store
+    def _apply_to_store(self, mutations):
+        by_frame = {}
+        for mutation in mutations:
+            if mutation.status != 'done':
+                continue
+            upserted, deleted = by_frame.setdefault(mutation.frame_id, ([], []))
+            if mutation.op == 'delete':
+                deleted.append(mutation.key)
+                continue
+            event = mutation.event
+            if event is None and mutation.op == 'update':
+                # The API sent nothing back, so patch the stored copy
+                event = self.store.get_event(mutation.frame_id, mutation.key)
+                if event is not None:
+                    event = patch_event(event, mutation.attributes)
+            if event is not None:
+                upserted.append(event)
+        for frame_id, (upserted, deleted) in by_frame.items():
+            self.store.apply_changes(frame_id, upserted, deleted)
+
+#----------------------------------------------------------------
+# Applies the outcome of flushed mutations to the event JSON items
+# of a calendar_events response (data['data']) in place
+# Created events are appended, updated ones replaced (or patched
+# when the API sent nothing back) and deleted ones removed
+#----------------------------------------------------------------
+def apply(events, mutations):
+    positions = {event['id']: i for i, event in enumerate(events)}
+    deleted = set()
+    for mutation in mutations:
+        if mutation.status != 'done':
+            continue
+        if mutation.op == 'delete':
+            deleted.add(mutation.key)
+        elif mutation.op == 'create':
+            if mutation.event is not None:
+                positions[mutation.event['id']] = len(events)
+                events.append(mutation.event)
+        elif mutation.key in positions:
+            i = positions[mutation.key]
+            if mutation.event is not None:
+                events[i] = mutation.event
+            else:
+                events[i] = patch_event(events[i], mutation.attributes)
+    if deleted:
+        events[:] = [event for event in events if event['id'] not in deleted]
+    return events
+
+#----------------------------------------------------------------
+# Returns the writable attributes of a JSON Lines record, either as
+# written by skylight_export or an event JSON item of the API
+#----------------------------------------------------------------
+def _record_attributes(record):
+    if 'attributes' in record:
+        attributes = {field: record['attributes'].get(name) for field, name in api_attribute_names.items()}
+        attributes.update((name, value) for name, value in record['attributes'].items() if name not in attributes)
+        for field, (relationship, _) in api_relationships.items():
+            link = (record.get('relationships') or {}).get(relationship) or {}
+            attributes[field] = (link.get('data') or {}).get('id')
+    else:
+        attributes = record
+    return {name: attributes[name] for name in writable_attributes if attributes.get(name) is not None}
+
+# Formats an iCalendar date or datetime as an API timestamp
+def _ical_timestamp(value):
+    if not hasattr(value, 'hour'):
+        return f'{value:%Y-%m-%d}T00:00:00.000Z'
+    return format_api_datetime(value if value.tzinfo else value.astimezone())
+
+#----------------------------------------------------------------
+# Reads the events of a .ics file or a JSON Lines export as
+# attribute dictionaries ready for WriteQueue.create()
+#----------------------------------------------------------------
+def read_import(path):
+    if path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as f:
+            return [_record_attributes(json.loads(line)) for line in f if line.strip()]
+
+    from icalendar import Calendar
+    with open(path, 'rb') as f:
+        calendar = Calendar.from_ical(f.read())
+    events = []
+    for component in calendar.walk('VEVENT'):
+        start = component.decoded('dtstart')
+        attributes = {
+            'summary': str(component.get('summary', '')),
+            'starts_at': _ical_timestamp(start),
+            'all_day': not hasattr(start, 'hour'),
+        }
+        if component.get('dtend'):
+            attributes['ends_at'] = _ical_timestamp(component.decoded('dtend'))
+        for name in ('description', 'location'):
+            if component.get(name):
+                attributes[name] = str(component[name])
+        if component.get('rrule'):
+            attributes['recurring'] = True
+            attributes['rrule'] = [f'RRULE:{component["rrule"].to_ical().decode()}']
+        events.append(attributes)
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create, update or delete Skylight calendar events in bulk')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    importer = subparsers.add_parser('import', help='Create every event of a .ics file or a JSON Lines export')
+    importer.add_argument('path', help='.ics file or .jsonl export to import')
+    deleter = subparsers.add_parser('delete', help='Delete events by ID')
+    deleter.add_argument('event_ids', nargs='+', help='IDs of the events to delete')
+    for subparser in (importer, deleter):
+        subparser.add_argument('--frame', required=True, help='Frame ID the events belong to')
+        subparser.add_argument('--store', help='Local SQLite store to apply the changes to')
+        subparser.add_argument('--workers', type=int, default=default_max_workers, help='Requests sent at the same time')
+        subparser.add_argument('--max-rate', type=float, default=shared_limiter.max_rate, help='Most requests per second the rate limiter ramps up to')
+        subparser.add_argument('--credentials', help='JSON file with "email" and "password"')
+        subparser.add_argument('--no-token-cache', action='store_true', help='Always log in instead of reusing the cached token')
+    args = parser.parse_args()
+    if args.max_rate <= 0:
+        parser.error('--max-rate has to be above 0')
+    shared_limiter.set_limits(max_rate=args.max_rate)
+
+    AccountInfo = login(client=SkylightClient(skylight_scrape.url), credentials_file=args.credentials,
+                        token_cache=None if args.no_token_cache else default_token_cache)
+    store = EventStore(args.store) if args.store else None
+    queue = WriteQueue(AccountInfo, args.workers, store=store)
+
+    if args.command == 'import':
+        for attributes in read_import(args.path):
+            queue.create(args.frame, attributes)
+    else:
+        for event_id in args.event_ids:
+            queue.delete(args.frame, event_id)
+
+    start = time.perf_counter()
+    results = queue.flush()
+    elapsed = time.perf_counter() - start
+    if store:
+        store.close()
+
+    failed = [mutation for mutation in results if mutation.status == 'failed']
+    for mutation in failed:
+        print(mutation)
+    print(f'{len(results) - len(failed)} of {len(results)} changes sent in {elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    main()